@@ -11,20 +11,200 @@ from __future__ import absolute_import, division, unicode_literals
 
 from math import sqrt
 
-from numpy import log, mean, array, std
-from scipy.stats import kurtosis, skew
+import numpy as np
+from numpy import log, mean, array
 
 DEBUG = False
 PROBLEM_THRESHOLD = 3  # NUMBER OF STANDARD DEVIATIONS BEFORE A PROBLEM IS HIGHLIGHTED
 
 
+class Moments(object):
+    """
+    Count, mean and central moments of some samples, accumulated in one pass,
+    and mergeable with the Moments of other samples
+    https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Higher-order_statistics
+    """
+
+    def __init__(self, samples=()):
+        self.count = 0
+        self.mean = 0.0
+        # SUMS OF 2nd, 3rd AND 4th POWERS OF DIFFERENCE FROM THE MEAN
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        if len(samples):
+            data = array(samples, dtype=float)
+            diff = data - mean(data)
+            square = diff * diff
+            self.count = len(data)
+            self.mean = float(mean(data))
+            self.m2 = float(np.sum(square))
+            self.m3 = float(np.sum(square * diff))
+            self.m4 = float(np.sum(square * square))
+
+    def __add__(self, other):
+        if not other.count:
+            return self.copy()
+        if not self.count:
+            return other.copy()
+        a, b = self, other
+        n = a.count + b.count
+        delta = b.mean - a.mean
+        output = Moments()
+        output.count = n
+        output.mean = a.mean + delta * b.count / n
+        output.m2 = a.m2 + b.m2 + delta ** 2 * a.count * b.count / n
+        output.m3 = (
+            a.m3
+            + b.m3
+            + delta ** 3 * a.count * b.count * (a.count - b.count) / n ** 2
+            + 3 * delta * (a.count * b.m2 - b.count * a.m2) / n
+        )
+        output.m4 = (
+            a.m4
+            + b.m4
+            + delta ** 4
+            * a.count
+            * b.count
+            * (a.count ** 2 - a.count * b.count + b.count ** 2)
+            / n ** 3
+            + 6 * delta ** 2 * (a.count ** 2 * b.m2 + b.count ** 2 * a.m2) / n ** 2
+            + 4 * delta * (a.count * b.m3 - b.count * a.m3) / n
+        )
+        return output
+
+    def copy(self):
+        return Moments.new_instance(self.__data__())
+
+    @property
+    def std(self):
+        return sqrt(self.m2 / self.count)
+
+    @property
+    def skew(self):
+        if self._is_constant():
+            return np.nan
+        return sqrt(self.count) * self.m3 / self.m2 ** 1.5
+
+    @property
+    def kurtosis(self):
+        # FISHER'S DEFINITION: NORMAL IS ZERO
+        if self._is_constant():
+            return np.nan
+        return self.count * self.m4 / self.m2 ** 2 - 3
+
+    def _is_constant(self):
+        # SAME TEST AS scipy.stats.skew() AND kurtosis(); NO SAMPLES IS CONSTANT TOO
+        if not self.count:
+            return True
+        return self.m2 / self.count <= (np.finfo(float).resolution * self.mean) ** 2
+
+    def __data__(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "m3": self.m3,
+            "m4": self.m4,
+        }
+
+    @staticmethod
+    def new_instance(state):
+        output = Moments()
+        output.count = state["count"]
+        output.mean = state["mean"]
+        output.m2 = state["m2"]
+        output.m3 = state["m3"]
+        output.m4 = state["m4"]
+        return output
+
+
 def moments(samples):
-    data = array(samples)
-    return len(data), mean(data), std(data), skew(data), kurtosis(data)
+    m = Moments(samples)
+    return m.count, m.mean, m.std, m.skew, m.kurtosis
+
+
+class DevianceMoments(object):
+    """
+    Enough about some samples to calculate their deviance(), accumulated in
+    one pass, and mergeable with the DevianceMoments of other samples. This
+    allows deviance() over chunks of a series, without concatenating them.
+
+    The min and max are kept aside; the rest of the samples are accumulated
+    in `raw` and, while all samples are positive, in `logged`
+    """
+
+    def __init__(self, samples=()):
+        self.extremes = ()  # THE (AT MOST TWO) SAMPLES KEPT ASIDE, IN ORDER
+        self.raw = Moments()
+        self.logged = Moments()  # None ONCE A SAMPLE IS NOT POSITIVE
+        if len(samples):
+            data = array(samples, dtype=float)
+            lo, hi = np.argmin(data), np.argmax(data)
+            if lo == hi:
+                # ALL SAMPLES ARE EQUAL
+                hi = (lo + 1) % len(data)
+            aside = [lo] if lo == hi else [lo, hi]
+            self.extremes = tuple(data[aside])
+            rest = np.delete(data, aside)
+            self.raw = Moments(rest)
+            if data[lo] > 0:
+                self.logged = Moments(log(rest))
+            else:
+                self.logged = None
+
+    @property
+    def count(self):
+        return self.raw.count + len(self.extremes)
+
+    def __add__(self, other):
+        # KEEP THE NEW min AND max ASIDE, THE OTHER EXTREMES JOIN THE REST
+        extremes = sorted(self.extremes + other.extremes)
+        output = DevianceMoments()
+        output.extremes = tuple(extremes[:1] + extremes[1:][-1:])
+        returned = extremes[1:-1]
+        output.raw = self.raw + other.raw + Moments(returned)
+        if (
+            self.logged is None
+            or other.logged is None
+            or (extremes and extremes[0] <= 0)
+        ):
+            output.logged = None
+        else:
+            output.logged = self.logged + other.logged + Moments(log(returned))
+        return output
 
+    def deviance(self):
+        """
+        :return: SAME AS deviance()
+        """
+        if self.count < 6:
+            return "N/A", 0
 
-def identity(v):
-    return v
+        if self.logged is not None:
+            # Use log(): We assume this is log-normal data
+            m = self.logged
+        else:
+            m = self.raw
+        return describe(m.count, m.skew, m.kurtosis)
+
+    def __data__(self):
+        return {
+            "extremes": list(self.extremes),
+            "raw": self.raw.__data__(),
+            "logged": self.logged.__data__() if self.logged is not None else None,
+        }
+
+    @staticmethod
+    def new_instance(state):
+        output = DevianceMoments()
+        output.extremes = tuple(state["extremes"])
+        output.raw = Moments.new_instance(state["raw"])
+        if state["logged"] is None:
+            output.logged = None
+        else:
+            output.logged = Moments.new_instance(state["logged"])
+        return output
 
 
 def deviance(samples):
@@ -41,20 +221,18 @@ def deviance(samples):
     N/A - not enough data to even guess
     OK - no egregious deviation from normal
     """
-
     if len(samples) < 6:
         return "N/A", 0
+    return DevianceMoments(samples).deviance()
 
-    if all(v > 0 for v in samples):
-        # Use log(): We assume this is log-normal data
-        transform = log
-    else:
-        transform = identity
-
-    samples = sorted(samples)[1:-1]
-    corrected_samples = transform(samples)
-    (count, mean, stddev, skew, kurt) = moments(corrected_samples)
 
+def describe(count, skew, kurt):
+    """
+    :param count: Number of samples
+    :param skew: Skew of the samples
+    :param kurt: Kurtosis (Fisher's definition) of the samples
+    :return: (description, score) pair, same as deviance()
+    """
     # https://en.wikipedia.org/wiki/D%27Agostino%27s_K-squared_test
 
     skew_stddev = sqrt(6 * (count - 2) / ((count + 1) * (count + 3)))
@@ -89,3 +267,80 @@ def deviance(samples):
             return "MODAL", kurt_normalized
         else:
             return "OK", kurt_normalized
+
+
+def deviance_batch(values, offsets=None):
+    """
+    Same as deviance(), but for many series at once
+
+    :param values: Either a 2D array, one series per row, padded with NaN,
+                   or the concatenation of all series (when `offsets` is given)
+    :param offsets: Start of each series in `values`, plus the end of the last
+    :return: (descriptions, scores) arrays, one entry per series
+    """
+    if offsets is None:
+        padded = np.array(values, dtype=float, ndmin=2)
+        exists = ~np.isnan(padded)
+        values = padded[exists]
+        lengths = exists.sum(axis=1)
+    else:
+        values = np.asarray(values, dtype=float)
+        offsets = np.asarray(offsets, dtype=int)
+        lengths = np.diff(offsets)
+        values = values[offsets[0] : offsets[-1]]
+    num = len(lengths)
+    ids = np.repeat(np.arange(num), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    # SORT EACH SERIES, SO WE CAN DROP ITS MIN AND MAX
+    values = values[np.lexsort((values, ids))]
+    position = np.arange(len(values)) - starts
+    keep = (position > 0) & (position < np.repeat(lengths, lengths) - 1)
+
+    # USE log() ON SERIES THAT ARE ALL POSITIVE: WE ASSUME THEY ARE LOG-NORMAL
+    positive = np.bincount(ids, weights=values <= 0, minlength=num) == 0
+    ids = ids[keep]
+    samples = values[keep]
+    is_log = positive[ids]
+    samples[is_log] = log(samples[is_log])
+
+    with np.errstate(all="ignore"):
+        count = (lengths - 2).astype(float)
+        mean_ = np.bincount(ids, weights=samples, minlength=num) / count
+        dev = samples - mean_[ids]
+        m2 = np.bincount(ids, weights=dev ** 2, minlength=num) / count
+        m3 = np.bincount(ids, weights=dev ** 3, minlength=num) / count
+        m4 = np.bincount(ids, weights=dev ** 4, minlength=num) / count
+        # SAME AS scipy: NO SKEW OR KURTOSIS WHEN ALL VALUES ARE EQUAL
+        zero = m2 <= (np.finfo(float).resolution * mean_) ** 2
+        skew_ = np.where(zero, np.nan, m3 / m2 ** 1.5)
+        kurt = np.where(zero, np.nan, m4 / m2 ** 2 - 3)
+
+        skew_stddev = np.sqrt(6 * (count - 2) / ((count + 1) * (count + 3)))
+        kurt_stddev = np.sqrt(
+            24
+            * count
+            * (count - 2)
+            * (count - 3)
+            / ((count + 1) * (count + 1) * (count + 3) * (count + 5))
+        )
+        skew_normalized = skew_ / skew_stddev
+        kurt_normalized = kurt / kurt_stddev
+
+    # REPORT THE WORST NUMBER
+    is_skew = abs(skew_normalized) > abs(kurt_normalized)
+    descriptions = np.select(
+        [
+            lengths < 6,
+            is_skew & (abs(skew_normalized) > PROBLEM_THRESHOLD),
+            is_skew,
+            kurt_normalized > PROBLEM_THRESHOLD,
+            kurt_normalized < -PROBLEM_THRESHOLD,
+        ],
+        ["N/A", "SKEWED", "OK", "OUTLIERS", "MODAL"],
+        "OK",
+    )
+    scores = np.where(
+        lengths < 6, 0, np.where(is_skew, skew_normalized, kurt_normalized)
+    )
+    return descriptions, scores
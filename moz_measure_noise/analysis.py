@@ -19,30 +19,91 @@ from jx_base.expressions import TRUE
 from jx_bigquery import bigquery
 from jx_bigquery.expressions import BQLang
 from jx_bigquery.sql import quote_column, quote_value, sql_iso
-from jx_python import jx
 from moz_measure_noise import deviance, step_detector
-from moz_measure_noise.extract_perf import get_signature, get_dataum
-from moz_measure_noise.step_detector import find_segments, MAX_POINTS, MIN_POINTS
+from moz_measure_noise.compare import (
+    alert_segments,
+    is_diff,
+    segment_diffs,
+    unmatched,
+)
+from moz_measure_noise.extract_perf import NO_DATA
+from moz_measure_noise.latest import LatestMirror, local_query, open_latest
+from moz_measure_noise.lru import LRU
+from moz_measure_noise.pushes import aggregate_pushes
+from moz_measure_noise.sources import MySQLSource, data_source
+from moz_measure_noise.step_detector import (
+    DEFAULT_THRESHOLD,
+    find_segments,
+    MAX_POINTS,
+)
+from moz_measure_noise.summary import normalize_segments
 from moz_measure_noise.utils import assign_colors, histogram
-from mo_collections import left
-from mo_dots import Data, coalesce, unwrap, to_data, listwrap
+from mo_dots import Data, coalesce, to_data, listwrap
 from mo_files import File
 from mo_files.url import value2url_param
 from mo_future import text
 from mo_logs import Log, startup, constants
-from mo_math.stats import median
 from mo_threads import Queue, Thread
 from mo_times import Date, Timer, Duration
-from mo_times.dates import parse
 from pyLibrary.convert import list2tab
 
 IGNORE_TOP = 3  # WHEN CALCULATING NOISE OR DEVIANCE, IGNORE SOME EXTREME VALUES
-LOCAL_RETENTION = "3day"  # HOW LONG BEFORE WE REFRESH LOCAL DATABASE ENTRIES
-# WHEN COMPARING new AND old STEPS, THE NUMBER OF PUSHES TO CONSIDER THEM STILL EQUAL
-TOLERANCE = MIN_POINTS
 SCATTER_RANGE = "6month"  # TIME RANGE TO SHOW IN SCATTER PLOT
 TREEHERDER_RANGE = "365day"  # TIME RANGE TO SHOW ON PERFHERDER
 DOWNLOAD_LIMIT = 100_000
+NUM_ANALYZE = 4  # NUMBER OF THREADS ANALYZING PREFETCHED SIGNATURES
+ANALYSIS_CACHE_SIZE = 256 * 2 ** 20  # BYTES OF analyze() RESULTS KEPT FOR REUSE
+
+# THE RANKINGS SHOWN BY main(), NAMED BY THE config.args THAT HOLDS THEIR LIMIT
+CATEGORIES = to_data(
+    [
+        {
+            "name": "deviant",
+            "sort": {"value": {"abs": "overall_dev_score"}, "sort": "desc"},
+            "show_distribution": True,
+        },
+        {
+            "name": "modal",
+            "sort": "overall_dev_score",
+            "where": {"eq": {"overall_dev_status": "MODAL"}},
+            "show_distribution": True,
+        },
+        {
+            "name": "outliers",
+            "sort": {"value": "overall_dev_score", "sort": "desc"},
+            "where": {"eq": {"overall_dev_status": "OUTLIERS"}},
+            "show_distribution": True,
+        },
+        {
+            "name": "skewed",
+            "sort": {"value": {"abs": "overall_dev_score"}, "sort": "desc"},
+            "where": {"eq": {"overall_dev_status": "SKEWED"}},
+            "show_distribution": True,
+        },
+        {
+            "name": "ok",
+            "sort": {"value": {"abs": "overall_dev_score"}, "sort": "desc"},
+            "where": {"eq": {"overall_dev_status": "OK"}},
+            "show_distribution": True,
+        },
+        {
+            "name": "noise",
+            "sort": {"value": {"abs": "relative_noise"}, "sort": "desc"},
+            "where": {"gte": {"num_pushes": 30}},
+        },
+        {
+            "name": "extra",
+            "sort": {"value": {"abs": "max_extra_diff"}, "sort": "desc"},
+            "where": {"lte": {"num_new_segments": 7}},
+        },
+        {
+            "name": "missing",
+            "sort": {"value": {"abs": "max_missing_diff"}, "sort": "desc"},
+            "where": {"lte": {"num_old_segments": 6}},
+        },
+        {"name": "pathological", "sort": {"value": "num_segments", "sort": "desc"}},
+    ]
+)
 
 
 def process(
@@ -54,6 +115,7 @@ def process(
     show_limit=MAX_POINTS,
     show_old=False,
     show_distribution=None,
+    prefetched=None,
 ):
     """
     :param signature_hash: The performance hash
@@ -62,33 +124,29 @@ def process(
     :param show_limit:
     :param show_old:
     :param show_distribution:
+    :param prefetched: Optional (sig, analysis) pair, from prefetch()
     :return:
     """
     sig_id = about_deviant.id
     if not isinstance(sig_id, int):
         Log.error("expecting id")
 
-    # GET SIGNATURE DETAILS
-    sig = get_signature(db_config=source, signature_id=sig_id)
-
-    # GET SIGNATURE DETAILS
-    data = get_dataum(source, sig.id, since=since, limit=show_limit)
-
-    min_date = since.unix
-    pushes = jx.sort(
-        [
-            {
-                "value": median(rows.value),
-                "runs": rows,
-                "push": {"time": unwrap(t)["push.time"]},
-            }
-            for t, rows in jx.groupby(data, "push.time")
-            if t["push\\.time"] > min_date
-        ],
-        "push.time",
-    )
+    source = data_source(source)
+    if prefetched:
+        sig, analysis = prefetched
+    else:
+        # GET SIGNATURE DETAILS
+        sig = source.get_signature(sig_id)
+        key = analysis_key(sig, since, show_limit)
+        analysis = analyses.get(key)
+        if analysis is None:
+            datums = source.get_dataum_columns(
+                [sig.id], since=since, limit=show_limit
+            ).get(sig.id, NO_DATA)
+            analysis = analyze(sig, datums, since)
+            analyses.set(key, analysis)
+    pushes, values, new_segments, new_diffs, old_segments, old_diffs = analysis
 
-    values = list(pushes.value)
     title = "-".join(
         map(
             str,
@@ -112,27 +170,6 @@ def process(
 
     Log.note("With {{title}}: {{url}}", title=title, url=url)
 
-    with Timer("find segments"):
-        new_segments, new_diffs = find_segments(
-            values, sig.alert_change_type, sig.alert_threshold
-        )
-
-    # USE PERFHERDER ALERTS TO IDENTIFY OLD SEGMENTS
-    old_segments = tuple(
-        sorted(
-            set(
-                [i for i, p in enumerate(pushes) if any(r.alert.id for r in p.runs)]
-                + [0, len(pushes)]
-            )
-        )
-    )
-    old_medians = [0.0] + [
-        np.median(values[s:e]) for s, e in zip(old_segments[:-1], old_segments[1:])
-    ]
-    old_diffs = np.array(
-        [b / a - 1 for a, b in zip(old_medians[:-1], old_medians[1:])] + [0]
-    )
-
     if len(new_segments) == 1:
         overall_dev_status = None
         overall_dev_score = None
@@ -153,13 +190,7 @@ def process(
         last_dev_status, last_dev_score = deviance(trimmed_segment)
         relative_noise = last_std / last_mean
 
-        # FOR EACH SEGMENT, NORMALIZE MEAN AND VARIANCE
-        normalized = []
-        for s, e in jx.pairs(new_segments):
-            data = np.array(values[s:e])
-            norm = (data + last_mean - np.mean(data)) * last_std / np.std(data)
-            normalized.extend(norm)
-
+        normalized = normalize_segments(values, new_segments, last_mean, last_std)
         overall_dev_status, overall_dev_score = deviance(normalized)
         Log.note(
             "\n\tdeviance = {{deviance}}\n\tnoise={{std}}\n\tpushes={{pushes}}\n\tsegments={{num_segments}}",
@@ -180,16 +211,10 @@ def process(
     _is_diff = is_diff(new_segments, old_segments)
     if _is_diff:
         # FOR MISSING POINTS, CALC BIGGEST DIFF
-        max_extra_diff = mo_math.MAX(
-            abs(d)
-            for s, d in zip(new_segments, new_diffs)
-            if all(not (s - TOLERANCE <= o <= s + TOLERANCE) for o in old_segments)
-        )
-        max_missing_diff = mo_math.MAX(
-            abs(d)
-            for s, d in zip(old_segments, old_diffs)
-            if all(not (s - TOLERANCE <= n <= s + TOLERANCE) for n in new_segments)
-        )
+        extra = unmatched(new_segments, old_segments)
+        missing = unmatched(old_segments, new_segments)
+        max_extra_diff = mo_math.MAX(abs(d) for d in np.asarray(new_diffs)[extra])
+        max_missing_diff = mo_math.MAX(abs(d) for d in old_diffs[missing])
 
         Log.alert(
             "Disagree max_extra_diff={{max_extra_diff|round(places=3)}}, max_missing_diff={{max_missing_diff|round(places=3)}}",
@@ -234,72 +259,107 @@ def process(
     )
 
 
-def is_diff(A, B):
-    if len(A) != len(B):
-        return True
+def analyze(sig, datums, since):
+    """
+    THE EXPENSIVE PART OF process(), WITHOUT THE DATABASE OR THE CHARTS
+    :param datums: (push_times, values, alert_ids, datum_ids) OF sig, FROM get_dataum_columns()
+    :return: (pushes, values, new_segments, new_diffs, old_segments, old_diffs) TUPLE
+    """
+    push_times, runs, alert_ids, _ = datums
+    pushes, medians, _ = aggregate_pushes(push_times, runs, since.unix)
+    values = medians.tolist()
 
-    for a, b in zip(A, B):
-        if b - TOLERANCE <= a <= b + TOLERANCE:
-            continue
-        else:
-            return True
-    return False
+    with Timer("find segments"):
+        new_segments, new_diffs = find_segments(
+            values, sig.alert_change_type, sig.alert_threshold
+        )
 
+    # USE PERFHERDER ALERTS TO IDENTIFY OLD SEGMENTS
+    old_segments = alert_segments(pushes, push_times, alert_ids)
+    old_diffs = segment_diffs(values, old_segments)
+    return pushes, values, new_segments, new_diffs, old_segments, old_diffs
 
-def update_local_database(config, deviant_summary, candidates, since):
-    if isinstance(deviant_summary, bigquery.Table):
-        Log.note("Only the ETL process should fill the bigquery table")
-        return
 
-    # GET EVERYTHING WE HAVE SO FAR
-    exists = deviant_summary.query(
-        {
-            "select": ["signature_hash", "last_updated"],
-            "where": {
-                "and": [
-                    {"in": {"signature_hash": candidates.signature_hash}},
-                    {"exists": "num_pushes"},
-                ]
-            },
-            "sort": "last_updated",
-            "limit": 100000,
-            "format": "list",
-        }
-    ).data
-    # CHOOSE MISSING, THEN OLDEST, UP TO "RECENT"
-    missing = list(set(candidates.signature_hash) - set(exists.signature_hash))
-
-    too_old = Date.today() - parse(LOCAL_RETENTION)
-    needs_update = missing + [
-        e.signature_hash for e in exists if e.last_updated < too_old.unix
-    ]
-    Log.alert("{{num}} series are candidates for local update", num=len(needs_update))
+def analysis_size(analysis):
+    """
+    :return: APPROXIMATE BYTES HELD BY AN analyze() RESULT
+    """
+    return sum(
+        part.nbytes if isinstance(part, np.ndarray) else 8 * len(part)
+        for part in analysis
+    )
+
 
-    limited_update = Queue("sigs")
-    limited_update.extend(
-        left(needs_update, coalesce(config.display.download_limit, 100))
+# analyze() RESULTS, SO SHOWING A SIGNATURE AGAIN IN THE SAME PROCESS DOES NOT
+# FETCH OR SEGMENT IT AGAIN.  THE RESULTS ARE SHARED; DO NOT MODIFY THEM
+analyses = LRU(ANALYSIS_CACHE_SIZE, sizeof=analysis_size)
+
+
+def analysis_key(sig, since, show_limit):
+    """
+    :return: EVERYTHING THAT CHANGES THE analyze() RESULT OF sig
+    """
+    return (
+        sig.id,
+        Date(since).unix,
+        show_limit,
+        coalesce(sig.alert_change_type),
+        coalesce(sig.alert_threshold, DEFAULT_THRESHOLD),
     )
-    Log.alert("Updating local database with {{num}} series", num=len(limited_update))
-
-    with Timer("Updating local database"):
-
-        def loop(please_stop):
-            while not please_stop:
-                signature_hash = limited_update.pop_one()
-                if not signature_hash:
-                    return
-                process(
-                    signature_hash,
-                    since,
-                    source=config.database,
-                    deviant_summary=deviant_summary,
-                )
-
-        threads = [Thread.run(text(i), loop) for i in range(3)]
+
+
+def invalidate(sig_id=None):
+    """
+    FORGET THE analyze() RESULTS OF sig_id, OR OF ALL SIGNATURES, AFTER
+    THEIR DATUMS CHANGE
+    """
+    if sig_id is None:
+        analyses.remove()
+    else:
+        analyses.remove(lambda key: key[0] == sig_id)
+
+
+def prefetch(sig_ids, since, source, show_limit=MAX_POINTS, num_threads=NUM_ANALYZE):
+    """
+    FETCH MANY SIGNATURES WITH FEW QUERIES, AND analyze() THEM CONCURRENTLY
+    :return: MAP FROM SIGNATURE ID TO (sig, analysis) PAIR, FOR process()
+    """
+    if not sig_ids:
+        return {}
+    source = data_source(source)
+    sigs = source.get_signatures(sig_ids)
+    output = {}
+    for sig_id, sig in sigs.items():
+        analysis = analyses.get(analysis_key(sig, since, show_limit))
+        if analysis is not None:
+            output[sig_id] = sig, analysis
+    missing = [sig_id for sig_id in sigs if sig_id not in output]
+    if not missing:
+        return output
+    datums = source.get_dataum_columns(missing, since=since, limit=show_limit)
+
+    todo = Queue("signatures to analyze")
+    todo.extend(missing)
+
+    def loop(please_stop):
+        while not please_stop:
+            sig_id = todo.pop_one()
+            if not sig_id:
+                return
+            sig = sigs[sig_id]
+            try:
+                analysis = analyze(sig, datums.get(sig_id, NO_DATA), since)
+            except Exception as cause:
+                Log.warning("Problem analyzing {{id}}", id=sig_id, cause=cause)
+                continue
+            analyses.set(analysis_key(sig, since, show_limit), analysis)
+            output[sig_id] = sig, analysis
+
+    with Timer("analyze {{num}} signatures", param={"num": len(missing)}):
+        threads = [Thread.run("analyze " + text(i), loop) for i in range(num_threads)]
         for t in threads:
             t.join()
-
-    Log.note("Local database is up to date")
+    return output
 
 
 def show_sorted(
@@ -312,12 +372,18 @@ def show_sorted(
     where=TRUE,
     show_distribution=None,
     show_old=False,
+    ranking=None,
 ):
+    """
+    :param ranking: TABLE WITH ONLY THE LATEST ROW OF EACH SIGNATURE, AND NO
+                    values, TO QUERY INSTEAD OF THE FULL HISTORY IN deviant_summary
+    """
     if not limit:
         return
 
+    require_ranking(ranking, deviant_summary)
     tops = list(
-        deviant_summary.jx_query(
+        ranking.jx_query(
             {
                 "where": {"and": [where, config.analysis.interesting]},
                 "sort": sort,
@@ -339,6 +405,73 @@ def show_sorted(
         )
 
 
+def show_combined(config, since, source, deviant_summary, categories, ranking=None):
+    """
+    SAME AS show_sorted() FOR EACH OF THE categories, BUT WITH ONE QUERY, AND
+    EACH SIGNATURE FETCHED AND ANALYZED ONCE, CONCURRENTLY, BEFORE ANY CHART
+    :param categories: (category, limit) PAIRS, category FROM CATEGORIES
+    :param ranking: SAME AS FOR show_sorted()
+    """
+    categories = [(c, limit) for c, limit in categories if limit]
+    if not categories:
+        return
+    require_ranking(ranking, deviant_summary)
+
+    docs = list(
+        ranking.jx_query(
+            {
+                "where": {
+                    "and": [
+                        {"or": [coalesce(c.where, TRUE) for c, _ in categories]},
+                        config.analysis.interesting,
+                    ]
+                },
+                "limit": DOWNLOAD_LIMIT,
+                "format": "list",
+            }
+        ).data
+    )
+    if len(docs) == DOWNLOAD_LIMIT:
+        Log.warning("Not all signatures ranked")
+
+    tops = [
+        (c, local_query(docs, {"where": c.where, "sort": c.sort, "limit": limit}))
+        for c, limit in categories
+    ]
+    sig_ids = list({d["id"]: None for _, top in tops for d in top})
+    Log.note(
+        "{{num}} signatures in {{categories}}",
+        num=len(sig_ids),
+        categories=[c.name for c, _ in categories],
+    )
+    prefetched = prefetch(sig_ids, since, source)
+
+    for c, top in tops:
+        Log.note("Showing {{name}}", name=c.name)
+        for doc in top:
+            process(
+                about_deviant=to_data(doc),
+                since=since,
+                source=source,
+                deviant_summary=deviant_summary,
+                show=True,
+                show_distribution=c.show_distribution,
+                prefetched=prefetched.get(doc["id"]),
+            )
+
+
+def require_ranking(ranking, deviant_summary):
+    """
+    RANKING THE FULL HISTORY IS A SCAN OF EVERY ROW, AND ITS values, SO
+    REFUSE TO DO IT
+    """
+    if ranking is None:
+        Log.error(
+            "No latest table for {{table}}, run analysis_etl.py to make it",
+            table=deviant_summary.short_name,
+        )
+
+
 def enrich_download_docs(docs):
     template_url = (
         'https://treeherder.mozilla.org/perf.html#/graphs'
@@ -356,7 +489,10 @@ def enrich_download_docs(docs):
 def main():
     since = Date.today() - Duration(SCATTER_RANGE)
 
-    if config.database.host not in listwrap(config.analysis.expected_database_host):
+    source = data_source(config.database)
+    if isinstance(source, MySQLSource) and config.database.host not in listwrap(
+        config.analysis.expected_database_host
+    ):
         Log.error("Expecting database to be one of {{expected}}", expected=config.analysis.expected_database_host)
     if not config.analysis.interesting:
         Log.alert("Expecting config file to have `analysis.interesting` with a json expression.  All series are included.")
@@ -374,14 +510,35 @@ def main():
             process(
                 signature_hash,
                 since=since,
-                source=config.database,
+                source=source,
                 deviant_summary=deviant_summary,
                 show=True,
             )
         return
 
+    # ONE ROW PER SIGNATURE, FOR RANKING, REBUILT BY THE ETL
+    latest = open_latest(deviant_summary)
+    ranking = latest
+    if config.deviant_summary.mirror:
+        ranking = LatestMirror(File(config.deviant_summary.mirror).abspath)
+        if latest is not None and (config.args.refresh_mirror or not len(ranking)):
+            ranking.update(latest)
+
     # DOWNLOAD
-    if config.args.download:
+    if config.args.download and latest is not None:
+        where_clause = BQLang[jx_expression(config.analysis.interesting)].to_bq(
+            latest.schema
+        )
+        docs = list(
+            latest.sql_query(f"""
+                SELECT *
+                FROM {quote_column(latest.full_name)}
+                WHERE {sql_iso(where_clause)}
+                LIMIT {quote_value(DOWNLOAD_LIMIT)}
+            """
+            )
+        )
+    elif config.args.download:
         # GET INTERESTING SERIES
         where_clause = BQLang[jx_expression(config.analysis.interesting)].to_bq(
             deviant_summary.schema
@@ -403,114 +560,37 @@ def main():
             """
             )
         )
+    if config.args.download:
         Log.note("Downloaded {{num}} series", num=len(docs))
         if len(docs) == DOWNLOAD_LIMIT:
             Log.warning("Not all signatures downloaded")
         docs = enrich_download_docs(docs)
         File(config.args.download).write(list2tab(docs, separator=","))
 
-    # DEVIANT
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort={"value": {"abs": "overall_dev_score"}, "sort": "desc"},
-        limit=config.args.deviant,
-        show_old=False,
-        show_distribution=True,
-    )
-
-    # MODAL
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort="overall_dev_score",
-        limit=config.args.modal,
-        where={"eq": {"overall_dev_status": "MODAL"}},
-        show_distribution=True,
-    )
-
-    # OUTLIERS
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort={"value": "overall_dev_score", "sort": "desc"},
-        limit=config.args.outliers,
-        where={"eq": {"overall_dev_status": "OUTLIERS"}},
-        show_distribution=True,
-    )
-
-    # SKEWED
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort={"value": {"abs": "overall_dev_score"}, "sort": "desc"},
-        limit=config.args.skewed,
-        where={"eq": {"overall_dev_status": "SKEWED"}},
-        show_distribution=True,
-    )
-
-    # OK
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort={"value": {"abs": "overall_dev_score"}, "sort": "desc"},
-        limit=config.args.ok,
-        where={"eq": {"overall_dev_status": "OK"}},
-        show_distribution=True,
-    )
-
-    # NOISE
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort={"value": {"abs": "relative_noise"}, "sort": "desc"},
-        where={"gte": {"num_pushes": 30}},
-        limit=config.args.noise,
-    )
-
-    # EXTRA
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort={"value": {"abs": "max_extra_diff"}, "sort": "desc"},
-        where={"lte": {"num_new_segments": 7}},
-        limit=config.args.extra,
-    )
-
-    # MISSING
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort={"value": {"abs": "max_missing_diff"}, "sort": "desc"},
-        where={"lte": {"num_old_segments": 6}},
-        limit=config.args.missing,
-    )
+    categories = [(c, config.args[c.name]) for c in CATEGORIES]
+    if config.args.combined:
+        show_combined(
+            config=config,
+            since=since,
+            source=source,
+            deviant_summary=deviant_summary,
+            categories=categories,
+            ranking=ranking,
+        )
+        return
 
-    # PATHOLOGICAL
-    show_sorted(
-        config=config,
-        since=since,
-        source=config.database,
-        deviant_summary=deviant_summary,
-        sort={"value": "num_segments", "sort": "desc"},
-        limit=config.args.pathological,
-    )
+    for c, limit in categories:
+        show_sorted(
+            config=config,
+            since=since,
+            source=source,
+            deviant_summary=deviant_summary,
+            ranking=ranking,
+            sort=c.sort,
+            limit=limit,
+            where=coalesce(c.where, TRUE),
+            show_distribution=c.show_distribution,
+        )
 
 
 if __name__ == "__main__":
@@ -604,6 +684,18 @@ if __name__ == "__main__":
                 "help": "show number of series which are missing alerts over perfherder",
                 "action": "store",
             },
+            {
+                "name": ["--combined"],
+                "dest": "combined",
+                "help": "rank all categories with one query, and analyze them before showing",
+                "action": "store_true",
+            },
+            {
+                "name": ["--refresh-mirror"],
+                "dest": "refresh_mirror",
+                "help": "copy the latest summaries to the local mirror before ranking",
+                "action": "store_true",
+            },
             {
                 "name": ["--pathological", "--pathological", "--pathology", "-p"],
                 "dest": "pathological",
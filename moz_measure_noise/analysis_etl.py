@@ -9,128 +9,466 @@
 from __future__ import division
 from __future__ import unicode_literals
 
+import os
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
 import numpy as np
 
-from jx_python import jx
-from moz_measure_noise import deviance
-from moz_measure_noise.extract_perf import get_signature, get_dataum
-from moz_measure_noise.step_detector import find_segments
-from mo_dots import Data, unwrap
+from jx_bigquery import bigquery
+from moz_measure_noise.extract_perf import BATCH_SIZE, NO_DATA
+from moz_measure_noise.latest import refresh_latest
+from moz_measure_noise.pushes import aggregate_pushes
+from moz_measure_noise.series import series_row
+from moz_measure_noise.sources import data_source
+from moz_measure_noise.step_detector import DEFAULT_THRESHOLD
+from moz_measure_noise.state import AnalysisState
+from moz_measure_noise.summary import summarize
+from moz_measure_noise.writer import BufferedWriter
+from mo_dots import Data, unwrap, coalesce, to_data
+from mo_files import File
+from mo_future import first, text
 from mo_json import NUMBER, python_type_to_json_type, scrub
-from mo_logs import Log
-from mo_math.stats import median
-from mo_times import Timer, Date
+from mo_logs import Log, startup, constants
+from mo_threads import Queue, Thread, THREAD_STOP
+from mo_times import Timer, Date, Duration
 
 LIMIT = 5000
+NUM_FETCH = 3  # NUMBER OF THREADS PULLING FROM THE DATABASE
+REBUILD = "month"  # HOW FAR BEFORE since THE STATE MAY REACH BEFORE WE START OVER
+HISTORY = "6month"  # ANALYZE THE DATUMS OF PUSHES THIS RECENT
 
 # REGISTER float64
 python_type_to_json_type[np.float64] = NUMBER
 
 
 def process(
-    sig_id, since, source, destination,
+    sig_id, since, source, destination, state=None, series=None,
 ):
     """
     :param sig_id: The performance hash
     :param since: Only data after this date
-    :param show:
-    :param show_limit:
-    :param show_old:
-    :param show_distribution:
+    :param source: The Treeherder database, or any sources.data_source()
+    :param destination: Where the summary goes, anything with extend(rows)
+    :param state: Optional AnalysisState, so we only analyze new data
+    :param series: Optional table for the values, so the summary rows only
+                   refer to them by series_version
     :return:
     """
-    if not isinstance(sig_id, int):
-        Log.error("expecting id")
+    job = fetch(sig_id, since, source, state)
+    if not job:
+        return
+    sig, title, push_times, last_datum_id, work = job
+
+    with Timer("find segments"):
+        result = summarize(**work)
+
+    with BufferedWriter(destination) as writer, series_writer(series) as series:
+        write(sig, title, push_times, last_datum_id, result, writer, state, series)
+
+
+def process_all(
+    sig_ids,
+    since,
+    source,
+    destination,
+    state=None,
+    num_fetch=NUM_FETCH,
+    num_compute=None,
+    series=None,
+    pool=None,
+    on_write=None,
+):
+    """
+    process() MANY SIGNATURES
+    fetch THREADS FEED A POOL OF summarize() PROCESSES, AND THE CALLING
+    THREAD SENDS ALL THE RESULTS TO A BufferedWriter
+    :param num_fetch: NUMBER OF THREADS PULLING FROM source
+    :param num_compute: NUMBER OF PROCESSES (DEFAULT IS ONE PER CPU)
+    :param series: OPTIONAL TABLE FOR THE values, SEE process()
+    :param pool: OPTIONAL new_pool() TO USE, AND NOT SHUT DOWN, SO MANY CALLS
+                 CAN SHARE ONE SET OF PROCESSES
+    :param on_write: OPTIONAL FUNCTION, CALLED WITH THE sig ONCE ITS SUMMARY
+                     ROW IS WRITTEN
+    """
+    sig_ids = list(sig_ids)
+    num_compute = num_compute or os.cpu_count()
+    todo = Queue("signatures to process")
+    todo.extend(sig_ids)
+    # LIMIT HOW FAR THE fetch THREADS GET AHEAD OF THE compute PROCESSES
+    done = Queue("analyzed signatures", max=num_compute * 4)
+    failures = []  # PROBLEMS THAT MAY HAVE LOST MORE THAN ONE SIGNATURE
+    lost = []  # NAMES OF THE fetch THREADS THAT FAILED
+
+    with BufferedWriter(destination) as writer, series_writer(
+        series
+    ) as series, using_pool(pool, num_compute) as pool:
+
+        def fetcher(please_stop):
+            while not please_stop:
+                batch = []
+                for _ in range(BATCH_SIZE):
+                    sig_id = todo.pop_one()
+                    if not sig_id:
+                        break
+                    batch.append(sig_id)
+                if not batch:
+                    return
+                for sig, title, push_times, last_datum_id, work in fetch_each(
+                    batch, since, source, state
+                ):
+                    done.add(
+                        (
+                            sig,
+                            title,
+                            push_times,
+                            last_datum_id,
+                            pool.submit(summarize, **work),
+                        )
+                    )
+
+        fetchers = [Thread.run("fetch " + text(i), fetcher) for i in range(num_fetch)]
+
+        def close(please_stop):
+            for t in fetchers:
+                try:
+                    t.join()
+                except Exception as cause:
+                    Log.warning("Problem fetching signatures", cause=cause)
+                    lost.append(t.name)
+            done.add(THREAD_STOP)
+
+        Thread.run("close analyzed signatures", close)
+
+        with Timer("process {{num}} signatures", param={"num": len(sig_ids)}):
+            for sig, title, push_times, last_datum_id, result in done:
+                try:
+                    write(
+                        sig,
+                        title,
+                        push_times,
+                        last_datum_id,
+                        result.result(),
+                        writer,
+                        state,
+                        series,
+                        on_write,
+                    )
+                except BrokenProcessPool as cause:
+                    failures.append(cause)
+                except Exception as cause:
+                    Log.warning("Problem processing {{id}}", id=sig.id, cause=cause)
+    if failures:
+        # ONE cause, mo_logs CAN NOT WRAP A LIST OF EXCEPTIONS
+        for cause in failures[1:]:
+            Log.warning("Problem processing signatures", cause=cause)
+        Log.error("Problem processing signatures", cause=failures[0])
+    if lost:
+        Log.error("Problem fetching signatures in {{threads}}", threads=lost)
+
+
+def fetch(sig_id, since, source, state=None):
+    """
+    GET THE NEW DATA FOR ONE SIGNATURE
+    :return: (sig, title, push_times, last_datum_id, work) TUPLE, OR None IF
+             NOTHING CHANGED. work ARE THE PARAMETERS FOR summarize()
+    """
+    return first(fetch_batch([sig_id], since, source, state))
 
-    # GET SIGNATURE DETAILS
-    sig = get_signature(source, sig_id)
+
+def fetch_each(sig_ids, since, source, state=None):
+    """
+    SAME AS fetch_batch(), BUT IF THE BATCH FAILS, FETCH ONE SIGNATURE AT A
+    TIME, SO ONE BAD SIGNATURE DOES NOT LOSE THE OTHERS
+    """
+    try:
+        return fetch_batch(sig_ids, since, source, state)
+    except Exception as cause:
+        if len(sig_ids) == 1:
+            Log.warning("Problem fetching {{id}}", id=sig_ids[0], cause=cause)
+            return []
+        Log.warning("Problem fetching {{ids}}", ids=sig_ids, cause=cause)
+
+    output = []
+    for sig_id in sig_ids:
+        output.extend(fetch_each([sig_id], since, source, state))
+    return output
+
+
+def fetch_batch(sig_ids, since, source, state=None):
+    """
+    SAME AS fetch(), BUT FOR MANY SIGNATURES, WITH FEW QUERIES
+    :return: LIST OF (sig, title, push_times, last_datum_id, work) TUPLES, FOR
+             SIGNATURES THAT CHANGED
+    """
+    for sig_id in sig_ids:
+        if not isinstance(sig_id, int):
+            Log.error("expecting id")
 
     # GET SIGNATURE DETAILS
-    pushes = get_dataum(source, sig_id, since, LIMIT)
-
-    pushes = jx.sort(
-        [
-            {
-                "value": median(rows.value),
-                "runs": rows,
-                "push": {"time": unwrap(t)["push.time"]},
-            }
-            for t, rows in jx.groupby(pushes, "push.time")
-            if t["push\\.time"] > since
-        ],
-        "push.time",
-    )
+    source = data_source(source)
+    sigs = source.get_signatures(sig_ids)
+
+    full, appends = [], []
+    for sig_id in sig_ids:
+        sig = sigs.get(sig_id)
+        if not sig:
+            Log.warning("No signature {{id}}", id=sig_id)
+            continue
 
-    values = list(pushes.value)
-    title = "-".join(
+        previous = state.get(sig_id) if state else None
+        if previous and (
+            not previous.push_times
+            or not previous.last_datum_id
+            or previous.detector.diff_type != sig.alert_change_type
+            or previous.detector.diff_threshold
+            != coalesce(sig.alert_threshold, DEFAULT_THRESHOLD)
+            or previous.push_times[0] < Date(since).unix - Duration(REBUILD).seconds
+        ):
+            # DETECTOR SETTINGS CHANGED, OR TOO MUCH OLD DATA, START OVER
+            previous = None
+        elif previous and previous.last_updated >= sig.last_updated:
+            Log.note("No new data for {{id}}", id=sig_id)
+            continue
+
+        if previous:
+            appends.append((sig, previous))
+        else:
+            full.append(sig)
+
+    output = []
+    if appends:
+        # ONLY THE DATUMS ADDED SINCE THE LAST RUN
+        marks = {sig.id: previous.last_datum_id for sig, previous in appends}
+        start = min(previous.push_times[0] for _, previous in appends) - 1
+        datums = source.get_dataum_delta(marks, Date(start))
+        for sig, previous in appends:
+            new = datums.get(sig.id, NO_DATA)
+            last_push = previous.push_times.last()
+            if (new[0] <= last_push).any():
+                # LATE DATUMS FOR PUSHES ALREADY ANALYZED, START OVER
+                Log.note("Late datums for {{id}}", id=sig.id)
+                full.append(sig)
+                continue
+            push_times, values = get_pushes(new, last_push)
+            if len(previous.push_times) + len(values) > LIMIT:
+                full.append(sig)
+                continue
+            output.append(
+                (
+                    sig,
+                    title_of(sig),
+                    list(previous.push_times) + push_times,
+                    max(previous.last_datum_id, last_datum_id(new)),
+                    {"values": np.array(values), "detector": unwrap(previous.detector)},
+                )
+            )
+
+    if full:
+        ids = [sig.id for sig in full]
+        datums = source.get_dataum_columns(ids, Date(since), LIMIT)
+        for sig in full:
+            title = title_of(sig)
+            columns = datums.get(sig.id, NO_DATA)
+            push_times, values = get_pushes(columns, since)
+            if len(values) > LIMIT:
+                Log.alert(
+                    "Too many values for {{title}} ({at least {num}}), choosing last {{limit}}",
+                    title=title,
+                    num=len(values),
+                    limit=LIMIT,
+                )
+                push_times = push_times[-LIMIT:]
+                values = values[-LIMIT:]
+            output.append(
+                (
+                    sig,
+                    title,
+                    push_times,
+                    last_datum_id(columns),
+                    {
+                        # PLAIN VALUES, NOT Null, SO THEY CAN BE SENT TO summarize()
+                        "values": np.array(values),
+                        "diff_type": unwrap(sig.alert_change_type),
+                        "diff_threshold": coalesce(
+                            sig.alert_threshold, DEFAULT_THRESHOLD
+                        ),
+                    },
+                )
+            )
+    return output
+
+
+def title_of(sig):
+    return "-".join(
         map(str, [sig.framework, sig.suite, sig.test, sig.platform, sig.repository,],)
     )
-    Log.note("With {{title}}", title=title)
 
-    if len(values) > LIMIT:
-        Log.alert(
-            "Too many values for {{title}} ({at least {num}}), choosing last {{limit}}",
-            title=title,
-            num=len(values),
-            limit=LIMIT,
-        )
-        values = values[-LIMIT:]
 
-    with Timer("find segments"):
-        new_segments, new_diffs = find_segments(
-            values, sig.alert_change_type, sig.alert_threshold
-        )
-
-    if len(new_segments) == 1:
-        overall_dev_status = None
-        overall_dev_score = None
-        last_mean = None
-        last_std = None
-        last_dev_status = None
-        last_dev_score = None
-        relative_noise = None
-    else:
-        # NOISE OF LAST SEGMENT
-        s, e = new_segments[-2], new_segments[-1]
-        last_segment = np.array(values[s:e])
-        trimmed_segment = last_segment
-        last_mean = np.mean(trimmed_segment)
-        last_std = np.std(trimmed_segment)
-        last_dev_status, last_dev_score = deviance(trimmed_segment)
-        relative_noise = last_std / last_mean
-
-        # FOR EACH SEGMENT, NORMALIZE MEAN AND VARIANCE
-        normalized = []
-        for s, e in jx.pairs(new_segments):
-            data = np.array(values[s:e])
-            norm = (data + last_mean - np.mean(data)) * last_std / np.std(data)
-            normalized.extend(norm)
-
-        overall_dev_status, overall_dev_score = deviance(normalized)
+def write(
+    sig,
+    title,
+    push_times,
+    last_datum_id,
+    result,
+    destination,
+    state=None,
+    series=None,
+    on_write=None,
+):
+    """
+    SEND THE summarize() result TO destination, AND REMEMBER THE STATE ONCE
+    IT IS WRITTEN
+    :param destination: A BufferedWriter
+    :param last_datum_id: LARGEST performance_datum.id ANALYZED, SO THE NEXT
+                          RUN ONLY FETCHES NEWER DATUMS
+    :param series: OPTIONAL BufferedWriter FOR THE values. IF GIVEN, THE
+                   SUMMARY IS SENT ONLY AFTER ITS values ARE WRITTEN
+    :param on_write: OPTIONAL FUNCTION, CALLED WITH sig ONCE THE SUMMARY IS WRITTEN
+    """
+    summary = to_data(result["summary"])
+    Log.note("With {{title}}", title=title)
+    if summary.num_segments:
         Log.note(
             "\n\tdeviance = {{deviance}}\n\tnoise={{std}}\n\tpushes={{pushes}}\n\tsegments={{num_segments}}",
             title=title,
-            deviance=(overall_dev_status, overall_dev_score),
-            std=relative_noise,
-            pushes=len(values),
-            num_segments=len(new_segments) - 1,
+            deviance=(summary.overall_dev_status, summary.overall_dev_score),
+            std=summary.relative_noise,
+            pushes=summary.num_pushes,
+            num_segments=summary.num_segments,
         )
 
-    destination.add(
-        Data(
-            id=sig_id,
-            title=title,
-            num_pushes=len(values),
-            num_segments=len(new_segments) - 1,
-            relative_noise=relative_noise,
-            overall_dev_status=overall_dev_status,
-            overall_dev_score=overall_dev_score,
-            last_mean=last_mean,
-            last_std=last_std,
-            last_dev_status=last_dev_status,
-            last_dev_score=last_dev_score,
-            last_updated=Date.now(),
-            values=values,
+    def remember():
+        if on_write:
+            on_write(sig)
+        if not state:
+            return
+        state.set(
+            sig.id,
+            Data(
+                last_updated=sig.last_updated,
+                push_times=push_times,
+                last_datum_id=last_datum_id,
+                segments=result["segments"],
+                detector=result["detector"],
+                summary=scrub(summary),
+            ),
         )
-        | scrub(sig)
+
+    now = Date.now()
+    row = Data(id=sig.id, title=title, last_updated=now) | summary | scrub(sig)
+    if not series:
+        row["values"] = result["values"]
+        destination.add(row, on_write=remember)
+        return
+
+    row.series_version = now.unix
+    series.add(
+        series_row(sig.id, now.unix, result["values"]),
+        on_write=lambda: destination.add(row, on_write=remember),
+    )
+
+
+def new_pool(num_compute=None):
+    """
+    :param num_compute: NUMBER OF PROCESSES (DEFAULT IS ONE PER CPU)
+    :return: POOL OF summarize() PROCESSES, FOR process_all()
+    """
+    return ProcessPoolExecutor(
+        max_workers=num_compute or os.cpu_count(), mp_context=get_context("spawn")
     )
+
+
+@contextmanager
+def using_pool(pool, num_compute):
+    """
+    :return: pool, OR A new_pool() THAT IS SHUT DOWN AFTERWARD
+    """
+    if pool:
+        yield pool
+        return
+    with new_pool(num_compute) as pool:
+        yield pool
+
+
+@contextmanager
+def series_writer(series):
+    """
+    :return: BufferedWriter FOR series, OR None IF THERE IS NO series TABLE
+    """
+    if not series:
+        yield None
+        return
+    with BufferedWriter(series) as writer:
+        yield writer
+
+
+def get_pushes(datums, since):
+    """
+    :param datums: (push_times, values, alert_ids, datum_ids) FROM get_dataum_columns()
+    :return: (push_times, values) FOR PUSHES AFTER since, ONE MEDIAN VALUE PER PUSH
+    """
+    push_times, values = datums[:2]
+    pushes, medians, _ = aggregate_pushes(push_times, values, Date(since).unix)
+    return pushes.tolist(), medians.tolist()
+
+
+def last_datum_id(datums):
+    """
+    :param datums: (push_times, values, alert_ids, datum_ids) FROM get_dataum_columns()
+    :return: THE LARGEST DATUM id, OR ZERO IF THERE ARE NONE
+    """
+    datum_ids = datums[3]
+    return int(datum_ids.max()) if len(datum_ids) else 0
+
+
+def main():
+    """
+    ONE ETL RUN: process_all() THE SIGNATURES UPDATED SINCE etl.history, THEN
+    REBUILD THE LATEST TABLE
+    """
+    since = Date.today() - Duration(coalesce(config.etl.history, HISTORY))
+    deviant_summary = bigquery.Dataset(config.deviant_summary).get_or_create_table(
+        kwargs=config.deviant_summary
+    )
+    series = None
+    if config.deviant_series:
+        series = bigquery.Dataset(config.deviant_series).get_or_create_table(
+            kwargs=config.deviant_series
+        )
+    state = None
+    if config.etl.state:
+        state = AnalysisState(File(config.etl.state).abspath)
+    source = data_source(config.database)
+
+    try:
+        sig_ids = list(source.get_signature_times(since))
+        process_all(
+            sig_ids,
+            since,
+            source,
+            deviant_summary,
+            state=state,
+            num_fetch=coalesce(config.etl.num_fetch, NUM_FETCH),
+            num_compute=config.etl.num_compute,
+            series=series,
+        )
+    finally:
+        if state:
+            state.close()
+    # ONE ROW PER SIGNATURE, FOR RANKING
+    refresh_latest(deviant_summary)
+
+
+if __name__ == "__main__":
+    config = startup.read_settings()
+    constants.set(config.constants)
+    try:
+        Log.start(config.debug)
+        main()
+    except Exception as e:
+        Log.warning("Problem with ETL", e)
+    finally:
+        Log.stop()
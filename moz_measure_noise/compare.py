@@ -0,0 +1,174 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+
+from moz_measure_noise.step_detector import MIN_POINTS, coalesce, find_segments
+from perfalert import detect_changes_arrays
+
+# WHEN COMPARING TWO SETS OF SEGMENTS, THE NUMBER OF PUSHES TO CONSIDER AN EDGE THE SAME
+TOLERANCE = MIN_POINTS
+# THE DETECTORS COMPARED, AND WHICH PAIRS ARE COMPARED
+DETECTORS = ("new", "perfalert", "alert")
+PAIRS = (("new", "alert"), ("perfalert", "alert"), ("new", "perfalert"))
+# perfalert DEFAULTS, WHEN THE SIGNATURE DOES NOT SAY
+MIN_BACK_WINDOW = 12
+MAX_BACK_WINDOW = 24
+FORE_WINDOW = 12
+T_THRESHOLD = 7
+
+
+def unmatched(A, B, tolerance=TOLERANCE):
+    """
+    :param A: SORTED EDGES
+    :param B: SORTED EDGES
+    :return: BOOLEAN ARRAY, True FOR EACH EDGE IN A WITH NO EDGE IN B WITHIN tolerance
+    """
+    output = np.ones(len(A), dtype=bool)
+    j = 0
+    for i, a in enumerate(A):
+        # B[j] IS THE FIRST EDGE THAT IS NOT TOO FAR BEFORE a
+        while j < len(B) and B[j] < a - tolerance:
+            j += 1
+        if j < len(B) and B[j] <= a + tolerance:
+            output[i] = False
+    return output
+
+
+def is_diff(A, B, tolerance=TOLERANCE):
+    """
+    :return: True IF THE TWO SETS OF SEGMENTS DO NOT AGREE
+    """
+    if len(A) != len(B):
+        return True
+
+    for a, b in zip(A, B):
+        if b - tolerance <= a <= b + tolerance:
+            continue
+        else:
+            return True
+    return False
+
+
+def segment_diffs(values, segments):
+    """
+    :return: RELATIVE CHANGE IN MEDIAN AT EACH OF THE segments EDGES
+    """
+    medians = [0.0] + [
+        np.median(values[s:e]) for s, e in zip(segments[:-1], segments[1:])
+    ]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        diffs = [b / a - 1 for a, b in zip(medians[:-1], medians[1:])]
+    return np.array(diffs + [0])
+
+
+def alert_segments(pushes, push_times, alert_ids):
+    """
+    USE PERFHERDER ALERTS TO IDENTIFY OLD SEGMENTS
+    :param pushes: SORTED PUSH TIMES, FROM aggregate_pushes()
+    :param push_times: PUSH TIME OF EACH DATUM
+    :param alert_ids: ALERT OF EACH DATUM (ZERO FOR NONE)
+    :return: SEGMENTS, AS FROM find_segments()
+    """
+    alerted = np.flatnonzero(np.isin(pushes, push_times[alert_ids != 0]))
+    return tuple(sorted(set(alerted.tolist() + [0, len(pushes)])))
+
+
+def perfalert_segments(values, sig=None):
+    """
+    :param sig: OPTIONAL SIGNATURE, WITH THE perfalert WINDOW SIZES
+    :return: SEGMENTS, AS FROM find_segments(), WHERE perfalert DETECTS CHANGES
+    """
+    sig = sig or {}
+    _, change_detected, _, _ = detect_changes_arrays(
+        np.arange(len(values)),
+        values,
+        min_back_window=coalesce(sig.get("min_back_window"), MIN_BACK_WINDOW),
+        max_back_window=coalesce(sig.get("max_back_window"), MAX_BACK_WINDOW),
+        fore_window=coalesce(sig.get("fore_window"), FORE_WINDOW),
+        t_threshold=T_THRESHOLD,
+    )
+    edges = np.flatnonzero(change_detected).tolist()
+    return tuple(sorted(set(edges + [0, len(values)])))
+
+
+def compare(values, old_segments, diff_type=None, diff_threshold=None, sig=None):
+    """
+    RUN THE DETECTORS ON ONE SERIES, AND MEASURE HOW MUCH THEY AGREE
+    :param values: ONE VALUE PER PUSH
+    :param old_segments: SEGMENTS FROM PERFHERDER ALERTS
+    :param sig: OPTIONAL SIGNATURE, WITH THE perfalert WINDOW SIZES
+    :return: dict OF METRICS, ONE ROW OF THE COMPARISON TABLE
+    """
+    values = np.asarray(values, dtype=float)
+    new_segments, new_diffs = find_segments(values, diff_type, diff_threshold)
+    segments = {
+        "new": tuple(new_segments),
+        "perfalert": perfalert_segments(values, sig),
+        "alert": tuple(old_segments),
+    }
+    diffs = {
+        "new": np.asarray(new_diffs, dtype=float),
+        "perfalert": segment_diffs(values, segments["perfalert"]),
+        "alert": segment_diffs(values, segments["alert"]),
+    }
+
+    row = {"num_pushes": len(values)}
+    for name in DETECTORS:
+        row["num_" + name] = len(segments[name]) - 1
+    for a, b in PAIRS:
+        extra = unmatched(segments[a], segments[b])
+        missing = unmatched(segments[b], segments[a])
+        prefix = a + "_" + b + "_"
+        row[prefix + "agree"] = not is_diff(segments[a], segments[b])
+        row[prefix + "extra"] = int(extra.sum())
+        row[prefix + "missing"] = int(missing.sum())
+        row[prefix + "max_extra_diff"] = _max_abs(diffs[a][extra])
+        row[prefix + "max_missing_diff"] = _max_abs(diffs[b][missing])
+    return row
+
+
+def _max_abs(diffs):
+    if not len(diffs):
+        return np.nan
+    return float(np.max(np.abs(diffs)))
+
+
+def to_table(ids, rows):
+    """
+    :param ids: SIGNATURE IDS
+    :param rows: compare() RESULT FOR EACH SIGNATURE
+    :return: dict OF COLUMN NAME TO ARRAY, ONE ENTRY PER SIGNATURE
+    """
+    table = {"id": np.array(ids, dtype=np.int64)}
+    if rows:
+        for name in rows[0]:
+            table[name] = np.array([row[name] for row in rows])
+    return table
+
+
+def agreement(table):
+    """
+    AGGREGATE A COMPARISON TABLE OVER ALL ITS SIGNATURES
+    :return: dict OF METRICS, FOR EACH PAIR OF DETECTORS
+    """
+    output = {"num_signatures": len(table["id"])}
+    if not output["num_signatures"]:
+        return output
+    for a, b in PAIRS:
+        prefix = a + "_" + b + "_"
+        # EDGES BETWEEN SEGMENTS
+        num_a = max((table["num_" + a] - 1).sum(), 1)
+        num_b = max((table["num_" + b] - 1).sum(), 1)
+        output[prefix + "agree_rate"] = float(np.mean(table[prefix + "agree"]))
+        output[prefix + "extra_rate"] = float(table[prefix + "extra"].sum() / num_a)
+        output[prefix + "missing_rate"] = float(table[prefix + "missing"].sum() / num_b)
+    return output
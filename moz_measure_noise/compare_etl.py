@@ -0,0 +1,121 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+from jx_python import jx
+from moz_measure_noise.analysis_etl import HISTORY, LIMIT
+from moz_measure_noise.compare import agreement, alert_segments, compare, to_table
+from moz_measure_noise.extract_perf import BATCH_SIZE, NO_DATA
+from moz_measure_noise.pushes import aggregate_pushes
+from moz_measure_noise.sources import data_source
+from mo_dots import coalesce, unwrap
+from mo_files import File
+from mo_logs import Log, startup, constants
+from mo_times import Date, Duration, Timer
+from pyLibrary.convert import list2tab
+
+
+def compare_signatures(source, sig_ids, since):
+    """
+    compare() THE DETECTORS ON MANY SIGNATURES, WITH ONE QUERY PER BATCH_SIZE
+    :param source: The Treeherder database, or any sources.data_source()
+    :param since: Only data after this date
+    :return: COMPARISON TABLE, SEE to_table(); USE agreement() TO SUMMARIZE IT
+    """
+    source = data_source(source)
+    sig_ids = list(sig_ids)
+    since = Date(since)
+    ids, rows = [], []
+    if not sig_ids:
+        return to_table(ids, rows)
+    with Timer("compare {{num}} signatures", param={"num": len(sig_ids)}):
+        for _, batch in jx.chunk(sig_ids, size=BATCH_SIZE):
+            sigs = source.get_signatures(batch)
+            datums = source.get_dataum_columns(batch, since, LIMIT)
+            for sig_id in batch:
+                sig = sigs.get(sig_id)
+                if not sig:
+                    Log.warning("No signature {{id}}", id=sig_id)
+                    continue
+                push_times, runs, alert_ids, _ = datums.get(sig_id, NO_DATA)
+                pushes, values, _ = aggregate_pushes(push_times, runs, since.unix)
+                try:
+                    row = compare(
+                        values,
+                        alert_segments(pushes, push_times, alert_ids),
+                        unwrap(sig.alert_change_type),
+                        unwrap(sig.alert_threshold),
+                        sig,
+                    )
+                except Exception as cause:
+                    Log.warning("Problem comparing {{id}}", id=sig_id, cause=cause)
+                    continue
+                ids.append(sig_id)
+                rows.append(row)
+    return to_table(ids, rows)
+
+
+def table_rows(table):
+    """
+    :param table: to_table() RESULT
+    :return: LIST OF dict, ONE PER SIGNATURE
+    """
+    columns = {name: column.tolist() for name, column in table.items()}
+    return [
+        {name: column[i] for name, column in columns.items()}
+        for i in range(len(table["id"]))
+    ]
+
+
+def main():
+    """
+    compare_signatures() ON EVERY SIGNATURE UPDATED SINCE etl.history, SHOW
+    THE agreement(), AND WRITE THE TABLE TO THE --output CSV FILE, IF GIVEN
+    """
+    since = Date.today() - Duration(coalesce(config.etl.history, HISTORY))
+    source = data_source(config.database)
+    sig_ids = sorted(source.get_signature_times(since))
+    table = compare_signatures(source, sig_ids, since)
+    Log.note(
+        "Detector agreement:\n{{agreement|json|indent}}", agreement=agreement(table)
+    )
+    if config.args.output:
+        File(config.args.output).write(
+            list2tab(table_rows(table), separator=",")
+        )
+        Log.note(
+            "Wrote {{num}} signatures to {{file}}",
+            num=len(table["id"]),
+            file=config.args.output,
+        )
+
+
+if __name__ == "__main__":
+    config = startup.read_settings(
+        [
+            {
+                "name": "--output",
+                "dest": "output",
+                "help": "write the comparison of every signature to CSV local file",
+                "nargs": "?",
+                "const": "compare.csv",
+                "type": str,
+                "action": "store",
+            },
+        ]
+    )
+    constants.set(config.constants)
+    try:
+        Log.start(config.debug)
+        main()
+    except Exception as e:
+        Log.warning("Problem with comparison", e)
+    finally:
+        Log.stop()
@@ -0,0 +1,308 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+from heapq import heappop, heappush
+
+from jx_bigquery import bigquery
+from moz_measure_noise.analysis_etl import new_pool, process_all
+from moz_measure_noise.extract_perf import BATCH_SIZE
+from moz_measure_noise.latest import refresh_latest
+from moz_measure_noise.sources import data_source
+from moz_measure_noise.state import AnalysisState
+from mo_dots import coalesce
+from mo_files import File
+from mo_logs import Log, startup, constants
+from mo_threads import Lock, MAIN_THREAD, Signal, Thread, Till
+from mo_times import Date, Duration
+
+HISTORY = "6month"  # ANALYZE THE DATUMS OF PUSHES THIS RECENT
+RESCAN = "10minute"  # HOW OFTEN TO LOOK FOR SIGNATURES WITH NEW DATUMS
+LATEST_REFRESH = "day"  # HOW OFTEN TO REBUILD THE LATEST TABLE, IF ANYTHING WAS WRITTEN
+THROTTLE = 5  # SECONDS TO REST BETWEEN BATCHES, SO THE REPLICA IS NOT SWAMPED
+ERROR_WAIT = 60  # SECONDS TO REST AFTER A BATCH FAILS
+ACTIVITY_HALF_LIFE = "week"  # HOW QUICKLY IDLE SIGNATURES LOSE PRIORITY
+
+
+class StaleQueue(object):
+    """
+    THREAD-SAFE QUEUE OF SIGNATURE IDS, SMALLEST PRIORITY FIRST.  ADDING AN id
+    THAT IS ALREADY QUEUED ONLY CHANGES ITS PRIORITY
+
+    mo_threads.PriorityQueue HAS A FIXED NUMBER OF PRIORITY LEVELS, AND NEVER
+    POPS LEVEL ZERO, SO WE KEEP OUR OWN HEAP
+    """
+
+    def __init__(self, name):
+        self.lock = Lock(name)
+        self.heap = []  # (priority, sig_id) PAIRS, SOME NO LONGER CURRENT
+        self.priorities = {}  # MAP FROM sig_id TO ITS CURRENT priority
+        self.closed = Signal()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.priorities)
+
+    def add(self, sig_id, priority):
+        with self.lock:
+            if self.priorities.get(sig_id) == priority:
+                return
+            self.priorities[sig_id] = priority
+            heappush(self.heap, (priority, sig_id))
+
+    def pop(self, max_size, till=None):
+        """
+        WAIT FOR SOME ids
+        :param till: SIGNAL TO STOP WAITING
+        :return: UP TO max_size ids, MOST URGENT FIRST, OR EMPTY LIST IF
+                 till, OR close(), HAPPENS FIRST
+        """
+        with self.lock:
+            while not self.priorities:
+                if self.closed or till:
+                    return []
+                self.lock.wait(till=self.closed | till)
+            output = []
+            while self.heap and len(output) < max_size:
+                priority, sig_id = heappop(self.heap)
+                if self.priorities.get(sig_id) != priority:
+                    # REPLACED BY A LATER add()
+                    continue
+                del self.priorities[sig_id]
+                output.append(sig_id)
+            return output
+
+    def close(self):
+        with self.lock:
+            self.closed.go()
+
+
+def priority(last_updated, analyzed, since, now):
+    """
+    :param last_updated: WHEN THE SIGNATURE LAST GOT A DATUM
+    :param analyzed: THE last_updated OF THE DATA LAST ANALYZED, OR None IF NEVER
+    :return: SMALLER IS MORE URGENT, OR None IF THERE IS NOTHING NEW
+
+    THE TIME SPANNED BY UNANALYZED DATUMS (STALENESS), HALVED FOR EVERY
+    ACTIVITY_HALF_LIFE SINCE THE LAST DATUM, SO BUSY SIGNATURES GO FIRST
+    """
+    if analyzed is not None and analyzed >= last_updated:
+        return None
+    staleness = last_updated - coalesce(analyzed, since)
+    idle = max(0, now - last_updated)
+    activity = 0.5 ** (idle / Duration(ACTIVITY_HALF_LIFE).seconds)
+    return -staleness * activity
+
+
+class Daemon(object):
+    """
+    KEEP THE SUMMARIES UP TO DATE, CONTINUOUSLY: A scanner THREAD QUEUES
+    SIGNATURES WITH NEW DATUMS, AND A refresher THREAD process_all()S THEM,
+    ONE BATCH AT A TIME, MOST URGENT FIRST.  BETWEEN BATCHES, THE refresher
+    ALSO REBUILDS THE LATEST TABLE, SO ITS merge_shards() NEVER RUNS WHILE
+    ROWS ARE BEING WRITTEN
+    """
+
+    def __init__(
+        self,
+        source,
+        destination,
+        state,
+        series=None,
+        history=HISTORY,
+        rescan=RESCAN,
+        throttle=THROTTLE,
+        batch_size=BATCH_SIZE,
+        num_compute=None,
+        latest_refresh=LATEST_REFRESH,
+    ):
+        """
+        :param source: The Treeherder database, or any sources.data_source()
+        :param destination: Where the summary goes, SEE process_all()
+        :param state: AnalysisState, SO WE ONLY ANALYZE NEW DATA
+        :param series: OPTIONAL TABLE FOR THE values, SEE process_all()
+        :param history: ANALYZE THE DATUMS OF PUSHES THIS RECENT
+        :param rescan: HOW OFTEN TO LOOK FOR SIGNATURES WITH NEW DATUMS
+        :param throttle: SECONDS TO REST BETWEEN BATCHES
+        :param batch_size: NUMBER OF SIGNATURES PER process_all()
+        :param num_compute: NUMBER OF summarize() PROCESSES, SEE process_all()
+        :param latest_refresh: HOW OFTEN TO refresh_latest(destination), IF IT
+                               IS A BIGQUERY TABLE
+        """
+        self.source = data_source(source)
+        self.destination = destination
+        self.state = state
+        self.series = series
+        self.history = Duration(history)
+        self.rescan = Duration(rescan).seconds
+        self.throttle = throttle
+        self.batch_size = batch_size
+        self.num_compute = num_compute
+        self.latest_refresh = Duration(latest_refresh).seconds
+        self.queue = StaleQueue("stale signatures")
+        self.working = set()  # SIGNATURES BEING REFRESHED, NOT TO BE QUEUED AGAIN
+        # SUMMARY ROWS WRITTEN SINCE THE LAST refresh_latest(), COUNTED BY
+        # THE WRITER OF THE process_all() IN PROGRESS, WHICH NEVER OVERLAPS
+        # refresh_latest(), SINCE BOTH RUN ON THE refresher THREAD
+        self.num_written = 0
+        self.latest_due = Date.now().unix + self.latest_refresh
+        self.please_stop = Signal("stop daemon")
+        self.threads = []
+        self.pool = None  # summarize() PROCESSES, KEPT FOR THE DAEMON'S LIFETIME
+
+    def since(self):
+        return Date.today() - self.history
+
+    def scan(self):
+        """
+        QUEUE EVERY SIGNATURE WITH DATUMS NEWER THAN ITS STATE
+        """
+        since = self.since().unix
+        now = Date.now().unix
+        analyzed = self.state.get_times()
+        times = self.source.get_signature_times(since)
+        for sig_id, last_updated in times.items():
+            if sig_id in self.working:
+                continue
+            p = priority(last_updated, analyzed.get(sig_id), since, now)
+            if p is not None:
+                self.queue.add(sig_id, p)
+        Log.note(
+            "{{num}} of {{total}} signatures are stale",
+            num=len(self.queue),
+            total=len(times),
+        )
+
+    def refresh(self, sig_ids):
+        self.working = set(sig_ids)
+        try:
+            process_all(
+                sig_ids,
+                self.since(),
+                self.source,
+                self.destination,
+                state=self.state,
+                num_fetch=1,
+                num_compute=self.num_compute,
+                series=self.series,
+                pool=self.pool,
+                on_write=self._written,
+            )
+        except Exception:
+            if self.pool:
+                # THE PROCESSES MAY HAVE DIED, START FRESH ONES
+                self.pool.shutdown(wait=False)
+                self.pool = new_pool(self.num_compute)
+            raise
+        finally:
+            self.working = set()
+
+    def _written(self, sig):
+        self.num_written += 1
+
+    def refresh_latest(self):
+        """
+        REBUILD THE LATEST TABLE, IF ANYTHING WAS WRITTEN SINCE THE LAST TIME
+        """
+        self.latest_due = Date.now().unix + self.latest_refresh
+        if not self.num_written or not isinstance(self.destination, bigquery.Table):
+            return
+        self.num_written = 0
+        try:
+            refresh_latest(self.destination)
+        except Exception as cause:
+            Log.warning("Problem refreshing latest table", cause=cause)
+
+    def start(self):
+        self.pool = new_pool(self.num_compute)
+        self.threads = [
+            Thread.run("scan for stale signatures", self._scanner),
+            Thread.run("refresh stale signatures", self._refresher),
+        ]
+        return self
+
+    def stop(self):
+        self.please_stop.go()
+        self.queue.close()
+        for t in self.threads:
+            t.join()
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _scanner(self, please_stop):
+        please_stop = please_stop | self.please_stop
+        while not please_stop:
+            try:
+                self.scan()
+            except Exception as cause:
+                Log.warning("Problem scanning for stale signatures", cause=cause)
+            (Till(seconds=self.rescan) | please_stop).wait()
+
+    def _refresher(self, please_stop):
+        please_stop = please_stop | self.please_stop
+        while not please_stop:
+            latest_due = Till(till=self.latest_due)
+            sig_ids = self.queue.pop(self.batch_size, till=please_stop | latest_due)
+            rest = 0
+            if sig_ids:
+                try:
+                    self.refresh(sig_ids)
+                    rest = self.throttle
+                except Exception as cause:
+                    # THE NEXT scan() WILL QUEUE THEM AGAIN
+                    Log.warning("Problem refreshing {{ids}}", ids=sig_ids, cause=cause)
+                    rest = ERROR_WAIT
+            if latest_due and not please_stop:
+                self.refresh_latest()
+            (Till(seconds=rest) | please_stop).wait()
+
+
+def main():
+    deviant_summary = bigquery.Dataset(config.deviant_summary).get_or_create_table(
+        kwargs=config.deviant_summary
+    )
+    series = None
+    if config.deviant_series:
+        series = bigquery.Dataset(config.deviant_series).get_or_create_table(
+            kwargs=config.deviant_series
+        )
+    state = AnalysisState(File(config.etl.state).abspath)
+
+    daemon = Daemon(
+        source=config.database,
+        destination=deviant_summary,
+        state=state,
+        series=series,
+        history=coalesce(config.etl.history, HISTORY),
+        rescan=coalesce(config.etl.rescan, RESCAN),
+        throttle=coalesce(config.etl.throttle, THROTTLE),
+        num_compute=config.etl.num_compute,
+        latest_refresh=coalesce(config.etl.latest_refresh, LATEST_REFRESH),
+    ).start()
+    try:
+        MAIN_THREAD.wait_for_shutdown_signal(
+            please_stop=daemon.please_stop, allow_exit=True
+        )
+    finally:
+        daemon.stop()
+        state.close()
+
+
+if __name__ == "__main__":
+    config = startup.read_settings()
+    constants.set(config.constants)
+    try:
+        Log.start(config.debug)
+        main()
+    except Exception as e:
+        Log.warning("Problem with ETL daemon", e)
+    finally:
+        Log.stop()
@@ -9,26 +9,52 @@
 #
 from __future__ import absolute_import, division, unicode_literals
 
-from jx_mysql.mysql import quote_list, MySQL, quote_value
+from itertools import islice
+
+import numpy as np
+
+from jx_mysql.mysql import quote_list, quote_value
+from jx_python import jx
+from moz_measure_noise.mysql_pool import connection
 from mo_dots import listwrap
 from mo_future import first
 from mo_sql import SQL
 
+BATCH_SIZE = 100  # NUMBER OF SIGNATURES TO REQUEST AT ONCE
+CHUNK_SIZE = 10_000  # NUMBER OF ROWS TO READ FROM THE CURSOR AT ONCE
+# TYPES OF THE columns_sql() COLUMNS
+COLUMN_TYPES = (np.int64, np.float64, np.float64, np.int64, np.int64)
+# get_dataum_columns() RESULT FOR A SIGNATURE WITH NO DATUMS
+NO_DATA = (
+    np.zeros(0),
+    np.zeros(0),
+    np.zeros(0, dtype=np.int64),
+    np.zeros(0, dtype=np.int64),
+)
+
 
 def get_all_signatures(db_config, sql):
     """
     RETURN ALL SIGNATURES FROM PERFHERDER DATABASE
     """
-    db = MySQL(db_config)
-    with db:
+    with connection(db_config) as db:
         return db.query(sql)
 
 
 def get_signature(db_config, signature_id):
-    db = MySQL(db_config)
-    with db:
-        return first(
-            db.query(f"""
+    return first(get_signatures(db_config, listwrap(signature_id)).values())
+
+
+def get_signatures(db_config, signature_ids):
+    """
+    :return: MAP FROM SIGNATURE ID TO SIGNATURE DETAILS, MOST RECENTLY UPDATED FIRST
+    """
+    if not signature_ids:
+        return {}
+    with connection(db_config) as db:
+        return {
+            sig.id: sig
+            for sig in db.query(f"""
                 SELECT
                     t1.id , 
                     t1.signature_hash, 
@@ -67,76 +93,183 @@ def get_signature(db_config, signature_id):
                 LEFT JOIN
                    repository AS t6 ON t6.id = t1.repository_id
                 WHERE
-                    t1.id in {quote_list(listwrap(signature_id))}
+                    t1.id in {quote_list(signature_ids)}
                 ORDER BY 
                     t1.last_updated DESC
             """)
-        )
+        }
 
 
-def get_dataum(db_config, signature_id, since, limit):
-    db = MySQL(db_config)
-    with db:
-        return db.query(
+def get_signature_times(db_config, since):
+    """
+    :return: MAP FROM SIGNATURE ID TO ITS last_updated, FOR EVERY SIGNATURE
+             UPDATED AFTER since
+    """
+    with connection(db_config) as db:
+        rows = db.query(
             SQL(
                 f"""
+            SELECT
+                id,
+                UNIX_TIMESTAMP(last_updated)
+            FROM
+                performance_signature
+            WHERE
+                last_updated > {quote_value(since)}
+            """
+            ),
+            stream=True,
+            row_tuples=True,
+        )
+        # UNIX_TIMESTAMP() OF A datetime(6) IS A Decimal, WHICH DOES NOT MIX WITH float
+        return {sig_id: float(last_updated) for sig_id, last_updated in rows}
+
+
+def get_dataum_columns(db_config, signature_ids, since, limit):
+    """
+    ONLY push.time, value, alert.id AND THE DATUM id, AS NUMPY ARRAYS,
+    WITHOUT MAKING A Data FOR EVERY ROW
+    :return: MAP FROM SIGNATURE ID TO (push_times, values, alert_ids, datum_ids)
+             TUPLE OF ITS (AT MOST limit+1) MOST RECENT DATUMS, NEWEST FIRST.
+             alert_ids IS ZERO FOR DATUMS WITHOUT AN ALERT
+    """
+    output = {}
+    with connection(db_config) as db:
+        for _, batch in jx.chunk(list(signature_ids), size=BATCH_SIZE):
+            rows = db.query(
+                SQL(columns_sql(batch, since, limit=limit + 1)),
+                stream=True,
+                row_tuples=True,
+            )
+            for sig_id, columns in read_columns(rows):
+                output[sig_id] = columns
+    return output
+
+
+def get_dataum_delta(db_config, marks, since):
+    """
+    ONLY THE DATUMS ADDED SINCE EACH SIGNATURE'S HIGH-WATER MARK, INCLUDING
+    DATUMS THAT ARRIVED LATE FOR OLD PUSHES
+    :param marks: MAP FROM SIGNATURE ID TO THE LARGEST DATUM id ALREADY SEEN
+    :param since: ONLY DATUMS FOR PUSHES AFTER THIS
+    :return: SAME AS get_dataum_columns(), BUT WITHOUT A LIMIT
+    """
+    output = {}
+    with connection(db_config) as db:
+        for _, batch in jx.chunk(sorted(marks), size=BATCH_SIZE):
+            rows = db.query(
+                SQL(columns_sql(batch, since, min(marks[i] for i in batch))),
+                stream=True,
+                row_tuples=True,
+            )
+            for sig_id, columns in read_columns(rows):
+                is_new = columns[3] > marks[sig_id]
+                if is_new.any():
+                    output[sig_id] = tuple(c[is_new] for c in columns)
+    return output
+
+
+def columns_sql(signature_ids, since, after_id=None, limit=None):
+    """
+    :param after_id: OPTIONAL, ONLY DATUMS WITH A LARGER id
+    :param limit: OPTIONAL, ONLY THE limit MOST RECENT DATUMS OF EACH SIGNATURE
+    """
+    if after_id is None:
+        after = ""
+    else:
+        after = f"d.id > {quote_value(after_id)} AND"
+    if limit is None:
+        rank = ""
+        keep = ""
+    else:
+        rank = """,
+            ROW_NUMBER() OVER (
+                PARTITION BY d.signature_id
+                ORDER BY p.time DESC, d.id DESC
+            ) AS _rank"""
+        keep = f"WHERE _rank <= {quote_value(limit)}"
+    return f"""
         SELECT
-            d.id,
-            d.value,
-            t3.id AS `job.id`,
-            t3.guid AS `job.guid`,
-            p.revision AS `push.revision`,
-            UNIX_TIMESTAMP(p.time) AS `push.time`,
-            r.name AS `push.repository`,
-            s.created AS `summary.created`,
-            s.status AS `summary.status`,
-            s.bug_number AS `summary.bug_number`,
-            s.manually_created AS `summary.manually_created`,
-            s.prev_push_id AS `summary.prev_push`,
-            s.issue_tracker_id AS `summary.issue_tracker`,
-            s.notes AS `summary.notes`,
-            s.first_triaged AS `summary.first_triaged`,
-            s.last_updated AS `summary.last_updated`,
-            s.bug_updated AS `summary.bug_updated`,
-            a.id AS `alert.id`,
-            a.`is_regression` AS `alert.isregression`,
-            a.`status` AS `alert.status`,
-            a.`amount_pct` AS `alert.amount_pct`,
-            a.`amount_abs` AS `alert.amount_abs`,
-            a.`prev_value` AS `alert.prev_value`,
-            a.`new_value` AS `alert.new_value`,
-            a.`t_value` AS `alert.t_value`,
-            a.`manually_created` AS `alert.manually_created`,
-            a.`classifier_id` AS `alert.classifier_id`,
-            a.`starred` AS `alert.starred`,
-            a.`created` AS `alert.created`,
-            a.`first_triaged` AS `alert.first_triaged`,
-            a.`last_updated` AS `alert.last_updated`
-        FROM
-            performance_datum AS d
-        JOIN 
-            performance_signature sig on sig.id=d.signature_id
-        LEFT JOIN
-            job AS t3 ON t3.id = d.job_id
-        LEFT JOIN
-            push AS p ON p.id = d.push_id
-        LEFT JOIN
-            repository AS r ON r.id = p.repository_id
-        LEFT JOIN
-            performance_alert_summary s on s.repository_id = p.repository_id and s.push_id=p.id
-        LEFT JOIN
-            performance_alert a 
-        ON 
-            a.summary_id = s.id AND 
-            a.series_signature_id = d.signature_id AND 
-            a.manually_created=0
-        WHERE
-            p.time > {quote_value(since)} AND
-            d.signature_id in {quote_list(listwrap(signature_id))}
+            signature_id,
+            push_time,
+            value,
+            alert_id,
+            id
+        FROM (
+            SELECT
+                d.signature_id,
+                UNIX_TIMESTAMP(p.time) AS push_time,
+                d.value,
+                COALESCE(a.id, 0) AS alert_id,
+                d.id{rank}
+            FROM
+                performance_datum AS d
+            LEFT JOIN
+                push AS p ON p.id = d.push_id
+            LEFT JOIN
+                performance_alert_summary s on s.repository_id = p.repository_id and s.push_id=p.id
+            LEFT JOIN
+                performance_alert a
+            ON
+                a.summary_id = s.id AND
+                a.series_signature_id = d.signature_id AND
+                a.manually_created=0
+            WHERE
+                {after}
+                p.time > {quote_value(since)} AND
+                d.signature_id in {quote_list(signature_ids)}
+        ) datums
+        {keep}
         ORDER BY
-            p.time DESC
-        LIMIT
-            {quote_value(limit + 1)}
+            signature_id, push_time DESC, id DESC
         """
+
+
+def read_columns(rows, chunk_size=CHUNK_SIZE):
+    """
+    :param rows: columns_sql() RESULT, AS A CURSOR, OR ANY ITERABLE OF TUPLES
+    :param chunk_size: NUMBER OF ROWS TO HOLD AT ONCE
+    :return: (signature_id, (push_times, values, alert_ids, datum_ids)) PAIRS
+    """
+    # ONLY ONE CHUNK OF ROWS IS EVER A PYTHON OBJECT
+    chunks = tuple([] for _ in COLUMN_TYPES)
+    for chunk in fetch_chunks(rows, chunk_size):
+        for i, (column, dtype) in enumerate(zip(chunks, COLUMN_TYPES)):
+            column.append(
+                np.fromiter((row[i] for row in chunk), dtype=dtype, count=len(chunk))
             )
+    if not chunks[0]:
+        return
+    sig_ids, push_times, values, alert_ids, datum_ids = (
+        np.concatenate(column) for column in chunks
+    )
+
+    # ROWS ARE SORTED BY SIGNATURE, SO EACH SIGNATURE IS ONE SLICE
+    ids, starts, counts = np.unique(sig_ids, return_index=True, return_counts=True)
+    for sig_id, start, count in zip(ids, starts, counts):
+        end = start + count
+        yield int(sig_id), (
+            push_times[start:end],
+            values[start:end],
+            alert_ids[start:end],
+            datum_ids[start:end],
         )
+
+
+def fetch_chunks(rows, size):
+    """
+    :param rows: A CURSOR, OR ANY ITERABLE OF ROWS
+    :return: LISTS OF AT MOST size ROWS
+    """
+    fetchmany = getattr(rows, "fetchmany", None)
+    if fetchmany is None:
+        rows = iter(rows)
+
+        def fetchmany(size):
+            return list(islice(rows, size))
+
+    while True:
+        chunk = fetchmany(size)
+        if not chunk:
+            return
+        yield chunk
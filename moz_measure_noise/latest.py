@@ -0,0 +1,211 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from jx_bigquery.sql import (
+    ApiName,
+    ConcatSQL,
+    JoinSQL,
+    SQL,
+    SQL_COMMA,
+    SQL_DESC,
+    escape_name,
+    quote_column,
+)
+from jx_python import jx
+from jx_sqlite.sqlite import Sqlite, quote_value
+from mo_dots import Data, listwrap, to_data
+from mo_future import is_text
+from mo_json import json2value, value2json
+from mo_logs import Log
+
+LATEST_SUFFIX = "_latest"  # NAME OF THE LATEST TABLE, AFTER THE SUMMARY NAME
+MIRROR_TABLE = "deviant_latest"
+
+
+def latest_name(summary):
+    return summary.short_name + LATEST_SUFFIX
+
+
+def refresh_latest(summary):
+    """
+    MATERIALIZE THE MOST RECENT ROW OF EACH id IN summary AS ITS OWN TABLE,
+    SO RANKING QUERIES READ ONE ROW PER SIGNATURE, NOT THE WHOLE HISTORY
+    :param summary: THE jx_bigquery Table THE ETL WRITES TO
+    :return: THE LATEST TABLE
+    """
+    if summary.config.sharded:
+        # FEWER SHARDS MAKE FOR A CHEAPER SCAN
+        summary.merge_shards()
+
+    partition = JoinSQL(
+        SQL_COMMA,
+        [
+            quote_column(ApiName(*c.es_column.split(".")))
+            for f in listwrap(summary.id.field)
+            for c in summary.flake.leaves(f)
+        ],
+    )
+    order_by = JoinSQL(
+        SQL_COMMA,
+        [
+            ConcatSQL(quote_column(ApiName(*c.es_column.split("."))), SQL_DESC)
+            for f in listwrap(summary.id.version)
+            for c in summary.flake.leaves(f)
+        ],
+    )
+    # THE values ARE NOT NEEDED FOR RANKING
+    exclude = ["_rank"] + sorted(
+        {c.es_column.split(".")[0] for c in summary.flake.leaves("values")}
+    )
+    command = ConcatSQL(
+        SQL("CREATE OR REPLACE TABLE "),
+        quote_column(summary.container.full_name + escape_name(latest_name(summary))),
+        SQL(" AS SELECT * EXCEPT ("),
+        JoinSQL(SQL_COMMA, [quote_column(ApiName(e)) for e in exclude]),
+        SQL(") FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY "),
+        partition,
+        SQL(" ORDER BY "),
+        order_by,
+        SQL(") AS _rank FROM "),
+        quote_column(summary.full_name),
+        SQL(") a WHERE _rank=1"),
+    )
+    job = summary.container.query_and_wait(command)
+    if job.errors:
+        Log.error(
+            "\n{{sql}}\nDid not fill latest table:\n{{reason|json|indent}}",
+            sql=command.sql,
+            reason=job.errors,
+        )
+    return open_latest(summary)
+
+
+def open_latest(summary):
+    """
+    :return: THE LATEST TABLE OF summary, OR None IF IT WAS NEVER MADE
+    """
+    try:
+        return summary.container.get_or_create_table(
+            table=latest_name(summary),
+            sharded=False,
+            read_only=True,
+            kwargs=summary.config,
+        )
+    except Exception:
+        Log.note("No latest table for {{table}}", table=summary.short_name)
+        return None
+
+
+class LatestMirror(object):
+    """
+    LOCAL SQLITE COPY OF THE LATEST TABLE, SO RANKING NEEDS NO BIGQUERY
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: SQLITE FILE TO HOLD THE COPY
+        """
+        self.db = Sqlite(filename=filename, load_functions=False, debug=False)
+        self.db.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS {MIRROR_TABLE} (
+                id TEXT PRIMARY KEY,
+                doc TEXT
+            )
+            """
+        )
+
+    def __len__(self):
+        return self.db.query(f"SELECT COUNT(1) FROM {MIRROR_TABLE}").data[0][0]
+
+    def update(self, latest):
+        """
+        REPLACE THE COPY WITH THE CONTENT OF THE latest TABLE
+        """
+        docs = latest.sql_query(f"SELECT * FROM {quote_column(latest.full_name)}")
+        self.extend(docs, replace=True)
+
+    def extend(self, docs, replace=False):
+        """
+        :param docs: ONE DOCUMENT PER SIGNATURE, AS FROM THE LATEST TABLE
+        :param replace: REMOVE ALL EXISTING DOCUMENTS FIRST
+        """
+        with self.db.transaction() as t:
+            if replace:
+                t.execute(f"DELETE FROM {MIRROR_TABLE}")
+            for _, chunk in jx.chunk(docs, size=1000):
+                t.execute(
+                    f"""
+                    INSERT OR REPLACE INTO {MIRROR_TABLE} (id, doc) VALUES
+                    """
+                    + ",\n".join(
+                        f"({quote_value(str(doc['id']))}, {quote_value(value2json(doc))})"
+                        for doc in chunk
+                    )
+                )
+
+    def jx_query(self, query):
+        """
+        THE SAME where, sort AND limit THAT show_sorted() SENDS TO BIGQUERY
+        """
+        docs = [
+            json2value(doc)
+            for doc, in self.db.query(f"SELECT doc FROM {MIRROR_TABLE}").data
+        ]
+        return Data(data=local_query(docs, query))
+
+    def close(self):
+        self.db.close()
+
+
+def local_query(docs, query):
+    """
+    :param docs: LIST OF DOCUMENTS
+    :param query: ONLY where, sort AND limit ARE USED
+    :return: LIST OF THE MATCHING docs, SORTED
+    """
+    query = to_data(query)
+    docs = to_data(docs)
+    if query.where:
+        docs = jx.filter(docs, query.where)
+    for sort in reversed(listwrap(query.sort)):
+        descending = not is_text(sort) and sort.sort in ("desc", -1)
+        docs = sorted(docs, key=sort_key(sort), reverse=descending)
+    if query.limit:
+        docs = docs[: query.limit]
+    return list(docs)
+
+
+def sort_key(sort):
+    """
+    :param sort: THE SORT FORMS show_sorted() USES: A FIELD NAME, OR
+                 {"value": FIELD} OR {"value": {"abs": FIELD}}
+    :return: KEY FUNCTION, WITH MISSING VALUES LAST IN EITHER DIRECTION
+    """
+    if is_text(sort):
+        field, absolute = sort, False
+    elif is_text(sort.value):
+        field, absolute = sort.value, False
+    elif is_text(sort.value.abs):
+        field, absolute = sort.value.abs, True
+    else:
+        Log.error("Do not know how to sort by {{sort|json}}", sort=sort)
+    descending = not is_text(sort) and sort.sort in ("desc", -1)
+
+    def key(doc):
+        value = doc[field]
+        if value == None:
+            return (not descending, 0)
+        if absolute:
+            value = abs(value)
+        return (descending, value)
+
+    return key
@@ -0,0 +1,76 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRU(object):
+    """
+    THREAD-SAFE MAP THAT FORGETS THE LEAST RECENTLY USED ENTRIES ONCE THE
+    TOTAL SIZE OF ITS VALUES IS MORE THAN max_size
+    """
+
+    def __init__(self, max_size, sizeof=None):
+        """
+        :param max_size: MAXIMUM TOTAL SIZE OF THE VALUES
+        :param sizeof: FUNCTION GIVING THE SIZE OF A VALUE (DEFAULT IS 1, SO
+                       max_size IS THE NUMBER OF ENTRIES)
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.lock = Lock()
+        self.data = OrderedDict()  # MAP FROM KEY TO (size, value), OLDEST FIRST
+        self.size = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return default
+            self.data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            old = self.data.pop(key, None)
+            if old:
+                self.size -= old[0]
+            if size > self.max_size:
+                # TOO BIG TO KEEP
+                return
+            self.data[key] = size, value
+            self.size += size
+            while self.size > self.max_size:
+                _, (old_size, _) = self.data.popitem(last=False)
+                self.size -= old_size
+
+    def remove(self, predicate=None):
+        """
+        :param predicate: FUNCTION OF THE KEY, True FOR ENTRIES TO REMOVE
+                          (DEFAULT IS TO REMOVE EVERYTHING)
+        """
+        with self.lock:
+            if predicate is None:
+                self.data.clear()
+                self.size = 0
+                return
+            for key in [k for k in self.data if predicate(k)]:
+                size, _ = self.data.pop(key)
+                self.size -= size
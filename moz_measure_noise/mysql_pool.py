@@ -0,0 +1,131 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from contextlib import contextmanager
+from time import time
+
+from jx_mysql.mysql import MySQL
+from mo_dots import coalesce
+from mo_logs import Log
+from mo_threads import Lock
+
+POOL_SIZE = 4  # MAXIMUM NUMBER OF OPEN CONNECTIONS TO A DATABASE
+CHECK_AFTER = 60  # SECONDS IDLE BEFORE WE CHECK A CONNECTION IS STILL ALIVE
+
+
+class MySQLPool(object):
+    """
+    THREAD-SAFE POOL OF OPEN MySQL CONNECTIONS, SO WE DO NOT PAY FOR A
+    CONNECT (AND SSL HANDSHAKE) ON EVERY QUERY
+    """
+
+    def __init__(self, db_config, size=POOL_SIZE, check_after=CHECK_AFTER):
+        """
+        :param db_config: SAME AS FOR MySQL()
+        :param size: MAXIMUM NUMBER OF OPEN CONNECTIONS
+        :param check_after: SECONDS IDLE BEFORE A CONNECTION IS PINGED BEFORE USE
+        """
+        self.db_config = db_config
+        self.size = size
+        self.check_after = check_after
+        self.lock = Lock("mysql pool")
+        self.idle = []  # (last_used, db) PAIRS
+        self.num_open = 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        BORROW A CONNECTION, WITH A TRANSACTION OPEN
+        """
+        db = self._acquire()
+        try:
+            with db.transaction():
+                yield db
+        except Exception:
+            # DO NOT TRUST THE CONNECTION AFTER A FAILURE
+            self._discard(db)
+            raise
+        self._release(db)
+
+    def _acquire(self):
+        with self.lock:
+            while not self.idle and self.num_open >= self.size:
+                self.lock.wait()
+            if self.idle:
+                last_used, db = self.idle.pop()
+            else:
+                self.num_open += 1
+                last_used, db = None, None
+
+        if db and time() - last_used > self.check_after and not _is_alive(db):
+            _close(db)
+            db = None
+        if not db:
+            try:
+                db = MySQL(self.db_config)
+            except Exception as cause:
+                with self.lock:
+                    self.num_open -= 1
+                Log.error("Can not connect", cause=cause)
+        return db
+
+    def _release(self, db):
+        with self.lock:
+            self.idle.append((time(), db))
+
+    def _discard(self, db):
+        _close(db)
+        with self.lock:
+            self.num_open -= 1
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+            self.num_open -= len(idle)
+        for _, db in idle:
+            _close(db)
+
+
+def _is_alive(db):
+    try:
+        db.db.ping(reconnect=False)
+        return True
+    except Exception:
+        return False
+
+
+def _close(db):
+    try:
+        db.close()
+    except Exception as cause:
+        Log.warning("Problem closing connection", cause=cause)
+
+
+_pools = {}
+_pools_lock = Lock("mysql pools")
+
+
+def connection(db_config):
+    """
+    BORROW A POOLED CONNECTION TO db_config, WITH A TRANSACTION OPEN
+    USE LIKE `with connection(db_config) as db:`
+    :param db_config: SAME AS FOR MySQL(), WITH OPTIONAL pool_size AND pool_check_after
+    """
+    key = (db_config.host, db_config.port, db_config.schema, db_config.username)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if not pool:
+            pool = _pools[key] = MySQLPool(
+                db_config,
+                size=coalesce(db_config.pool_size, POOL_SIZE),
+                check_after=coalesce(db_config.pool_check_after, CHECK_AFTER),
+            )
+    return pool.transaction()
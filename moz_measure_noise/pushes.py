@@ -0,0 +1,51 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+
+
+def aggregate_pushes(push_times, values, since=None):
+    """
+    COMBINE THE RUNS OF EACH PUSH INTO ONE MEDIAN VALUE
+    :param push_times: PUSH TIME OF EACH RUN
+    :param values: VALUE OF EACH RUN
+    :param since: OPTIONAL UNIX TIMESTAMP, ONLY PUSHES AFTER since ARE KEPT
+    :return: (pushes, medians, counts) ARRAYS, ONE ENTRY PER PUSH, SORTED BY PUSH TIME
+    """
+    push_times = np.asarray(push_times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if since is not None:
+        keep = push_times > since
+        push_times, values = push_times[keep], values[keep]
+
+    # SORT BY PUSH, THEN BY VALUE, SO EACH PUSH IS A SORTED SLICE
+    order = np.lexsort((values, push_times))
+    push_times, values = push_times[order], values[order]
+    pushes, starts, counts = np.unique(
+        push_times, return_index=True, return_counts=True
+    )
+    medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+    return pushes, medians, counts
+
+
+def merge_datums(old, new):
+    """
+    ADD new DATUMS TO THE old ONES
+    :param old: (push_times, values, alert_ids, datum_ids) COLUMNS, NEWEST FIRST
+    :param new: SAME, BUT MORE RECENT; A DATUM IN BOTH (SAME datum_id) TAKES
+                ITS new VERSION
+    :return: (push_times, values, alert_ids, datum_ids) COLUMNS, NEWEST FIRST
+    """
+    columns = [np.concatenate([n, o]) for n, o in zip(new, old)]
+    # np.unique FINDS THE FIRST OCCURRENCE, WHICH IS THE new ONE
+    _, keep = np.unique(columns[3], return_index=True)
+    order = keep[np.argsort(-columns[0][keep], kind="stable")]
+    return tuple(c[order] for c in columns)
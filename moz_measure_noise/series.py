@@ -0,0 +1,76 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from base64 import b64decode, b64encode
+
+import numpy as np
+
+from jx_bigquery.sql import quote_column, quote_value
+from mo_dots import Data
+from mo_future import first
+
+# THE PER-PUSH values OF A SUMMARY ARE KEPT IN A SIDE TABLE, ONE ROW PER
+# (id, version), SO SUMMARY QUERIES DO NOT CARRY THE WHOLE SERIES.
+# values IS A BASE64 STRING OF LITTLE-ENDIAN float32, BECAUSE THE SUMMARY
+# STATISTICS DO NOT NEED MORE PRECISION THAN THE CHARTS DO
+SERIES_DTYPE = np.dtype("<f4")
+
+
+def pack_values(values):
+    """
+    :param values: SEQUENCE OF NUMBERS
+    :return: BASE64 TEXT OF THE values AS float32
+    """
+    return b64encode(np.asarray(values, dtype=SERIES_DTYPE).tobytes()).decode("ascii")
+
+
+def unpack_values(packed):
+    """
+    :param packed: FROM pack_values()
+    :return: ARRAY OF float64
+    """
+    return np.frombuffer(b64decode(packed), dtype=SERIES_DTYPE).astype(np.float64)
+
+
+def series_row(sig_id, version, values):
+    """
+    :param version: UNIX TIMESTAMP, THE series_version OF THE SUMMARY ROW
+    :return: ROW FOR THE SERIES TABLE
+    """
+    return Data(
+        id=sig_id, version=version, num_values=len(values), values=pack_values(values)
+    )
+
+
+def get_series(series, sig_id, version=None):
+    """
+    :param series: THE SERIES TABLE (A jx_bigquery Table)
+    :param version: THE series_version OF A SUMMARY ROW, OR None FOR THE LATEST
+    :return: ARRAY OF values, OR None IF NOT FOUND
+    """
+    if version is None:
+        where = ""
+    else:
+        where = f"AND version = {quote_value(version)}"
+    row = first(
+        series.sql_query(
+            f"""
+            SELECT *
+            FROM {quote_column(series.full_name)}
+            WHERE id = {quote_value(sig_id)} {where}
+            ORDER BY version DESC
+            LIMIT 1
+            """
+        )
+    )
+    if not row:
+        return None
+    return unpack_values(row["values"])
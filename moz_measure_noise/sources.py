@@ -0,0 +1,456 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+
+import numpy as np
+
+from jx_python import jx
+from jx_sqlite.sqlite import Sqlite, quote_list, quote_value
+from moz_measure_noise import extract_perf
+from moz_measure_noise.extract_perf import NO_DATA
+from moz_measure_noise.pushes import merge_datums
+from mo_dots import coalesce, listwrap, to_data
+from mo_files import File
+from mo_future import first
+from mo_json import json2value, value2json
+from mo_logs import Log
+from mo_threads import Lock
+from mo_times import Date, Duration
+
+SIGNATURES_FILE = "signatures.json"
+DATUMS_FILE = "datums.npz"
+CACHE_INDEX = "index.sqlite"
+CACHE_TABLE = "datum_cache"
+CACHE_TTL = "hour"  # HOW LONG CACHED DATUMS ARE USED BEFORE ASKING FOR NEW ONES
+CACHE_SIZE = 2 ** 30  # BYTES OF DATUMS TO CACHE BEFORE EVICTING THE LEAST RECENTLY USED
+CACHE_DTYPE = np.dtype(
+    [("push_time", "f8"), ("value", "f8"), ("alert_id", "i8"), ("datum_id", "i8")]
+)
+
+
+class DataSource(object):
+    """
+    WHERE THE ANALYSIS GETS ITS SIGNATURES AND DATUMS.  SUBCLASSES PROVIDE
+
+    get_signatures(signature_ids) - MAP FROM SIGNATURE ID TO SIGNATURE DETAILS
+    get_signature_times(since) - MAP FROM SIGNATURE ID TO ITS last_updated, FOR
+                                 EVERY SIGNATURE UPDATED AFTER since
+    get_dataum_columns(signature_ids, since, limit) - SAME AS
+                                 extract_perf.get_dataum_columns()
+    get_dataum_delta(marks, since) - SAME AS extract_perf.get_dataum_delta()
+    """
+
+    def get_signature(self, signature_id):
+        return first(self.get_signatures(listwrap(signature_id)).values())
+
+
+class MySQLSource(DataSource):
+    """
+    THE LIVE TREEHERDER DATABASE
+    """
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+
+    def get_signatures(self, signature_ids):
+        return extract_perf.get_signatures(self.db_config, signature_ids)
+
+    def get_signature_times(self, since):
+        return extract_perf.get_signature_times(self.db_config, Date(since))
+
+    def get_dataum_columns(self, signature_ids, since, limit):
+        return extract_perf.get_dataum_columns(
+            self.db_config, signature_ids, since, limit
+        )
+
+    def get_dataum_delta(self, marks, since):
+        return extract_perf.get_dataum_delta(self.db_config, marks, since)
+
+
+class LocalSource(DataSource):
+    """
+    A SNAPSHOT OF THE TREEHERDER DATABASE, IN A LOCAL DIRECTORY, MADE BY snapshot()
+    signatures.json - THE SIGNATURE DETAILS
+    datums.npz - signature_id, push_time, value, alert_id AND datum_id COLUMNS,
+                 SORTED BY signature_id, THEN NEWEST PUSH FIRST
+    """
+
+    def __init__(self, directory):
+        directory = File(directory)
+        self.signatures = {
+            sig.id: sig
+            for sig in to_data(
+                json2value((directory / SIGNATURES_FILE).read())
+            )
+        }
+        with np.load((directory / DATUMS_FILE).abspath) as datums:
+            self.signature_id = datums["signature_id"]
+            self.push_time = datums["push_time"]
+            self.value = datums["value"]
+            self.alert_id = datums["alert_id"]
+            if "datum_id" in datums.files:
+                self.datum_id = datums["datum_id"]
+            else:
+                # OLDER SNAPSHOT, WITHOUT DATUM ids
+                self.datum_id = np.zeros(len(self.value), dtype=np.int64)
+        Log.note(
+            "Loaded {{num_sigs}} signatures, {{num}} datums from {{dir}}",
+            num_sigs=len(self.signatures),
+            num=len(self.value),
+            dir=directory.abspath,
+        )
+
+    def get_signatures(self, signature_ids):
+        return {
+            sig_id: self.signatures[sig_id]
+            for sig_id in signature_ids
+            if sig_id in self.signatures
+        }
+
+    def get_signature_times(self, since):
+        since = Date(since).unix
+        return {
+            sig_id: sig.last_updated
+            for sig_id, sig in self.signatures.items()
+            if sig.last_updated > since
+        }
+
+    def get_dataum_columns(self, signature_ids, since, limit):
+        output = {}
+        since = Date(since).unix
+        for sig_id in signature_ids:
+            start, end = np.searchsorted(self.signature_id, [sig_id, sig_id + 1])
+            if start == end:
+                continue
+            # NEWEST FIRST, SO THE DATUMS AFTER since ARE A PREFIX
+            newest_first = -self.push_time[start:end]
+            end = start + np.searchsorted(newest_first, -since, side="left")
+            end = min(end, start + limit + 1)
+            if start == end:
+                continue
+            output[sig_id] = (
+                self.push_time[start:end],
+                self.value[start:end],
+                self.alert_id[start:end],
+                self.datum_id[start:end],
+            )
+        return output
+
+    def get_dataum_delta(self, marks, since):
+        output = {}
+        since = Date(since).unix
+        for sig_id, mark in marks.items():
+            start, end = np.searchsorted(self.signature_id, [sig_id, sig_id + 1])
+            is_new = (self.datum_id[start:end] > mark) & (
+                self.push_time[start:end] > since
+            )
+            if not is_new.any():
+                continue
+            output[sig_id] = tuple(
+                column[start:end][is_new]
+                for column in (self.push_time, self.value, self.alert_id, self.datum_id)
+            )
+        return output
+
+
+class DatumCache(DataSource):
+    """
+    LOCAL, ON-DISK CACHE OF DATUMS, IN FRONT OF ANOTHER DataSource
+    EACH SIGNATURE'S DATUMS ARE ONE .npy FILE, READ MEMORY-MAPPED, AND THE
+    SQLITE INDEX REMEMBERS HOW FAR BACK, AND HOW RECENTLY, EACH WAS FETCHED
+    ONE INSTANCE IS SHARED BY MANY THREADS, SO THE SOURCE IS ASKED OUTSIDE
+    THE LOCK, BUT THE INDEX AND FILES ARE ONLY TOUCHED WHILE HOLDING IT
+    """
+
+    def __init__(self, source, directory, ttl=CACHE_TTL, max_size=CACHE_SIZE):
+        """
+        :param source: THE DataSource TO CACHE
+        :param directory: WHERE TO KEEP THE CACHE
+        :param ttl: HOW LONG CACHED DATUMS ARE USED BEFORE FETCHING NEWER ONES
+        :param max_size: BYTES OF DATUMS TO KEEP BEFORE EVICTING THE LEAST RECENTLY USED
+        """
+        self.source = source
+        self.directory = File(directory)
+        self.ttl = Duration(ttl).seconds
+        self.max_size = max_size
+        self.lock = Lock("datum cache")  # FOR THE INDEX, AND THE FILES IT NAMES
+        os.makedirs(self.directory.abspath, exist_ok=True)
+        self.db = Sqlite(
+            filename=(self.directory / CACHE_INDEX).abspath,
+            load_functions=False,
+            debug=False,
+        )
+        self.db.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+                id INTEGER PRIMARY KEY,
+                since REAL,
+                fetched REAL,
+                accessed REAL,
+                size INTEGER
+            )
+            """
+        )
+
+    def get_signatures(self, signature_ids):
+        return self.source.get_signatures(signature_ids)
+
+    def get_signature_times(self, since):
+        return self.source.get_signature_times(since)
+
+    def get_dataum_columns(self, signature_ids, since, limit):
+        signature_ids = list(signature_ids)
+        since = Date(since).unix
+        now = Date.now().unix
+        with self.lock:
+            entries = {
+                sig_id: (complete_since, fetched)
+                for sig_id, complete_since, fetched in self.db.query(
+                    f"""
+                    SELECT id, since, fetched
+                    FROM {CACHE_TABLE}
+                    WHERE id in {quote_list(signature_ids)}
+                    """
+                ).data
+            }
+            # MEMORY-MAPPED, SO STILL READABLE IF ANOTHER THREAD EVICTS THEM
+            cached = {sig_id: self._load(sig_id) for sig_id in entries}
+
+        # MISSING, OR NOT FAR ENOUGH BACK, ARE FETCHED IN FULL
+        full = [
+            sig_id
+            for sig_id in signature_ids
+            if cached.get(sig_id) is None
+            or not self._covers(cached[sig_id], entries[sig_id][0], since, limit)
+        ]
+        if full:
+            fetched = self.source.get_dataum_columns(full, since, limit)
+            with self.lock:
+                for sig_id in full:
+                    cached[sig_id] = self._store(
+                        sig_id, fetched.get(sig_id, NO_DATA), since, limit, now
+                    )
+
+        # EXPIRED ONLY FETCH THE DATUMS ADDED SINCE THEIR LARGEST CACHED id,
+        # WHICH INCLUDES DATUMS THAT ARRIVED LATE FOR OLD PUSHES
+        expired = [
+            sig_id
+            for sig_id in signature_ids
+            if sig_id not in full and now - entries[sig_id][1] > self.ttl
+        ]
+        if expired:
+            marks = {
+                sig_id: int(cached[sig_id]["datum_id"].max())
+                if len(cached[sig_id])
+                else 0
+                for sig_id in expired
+            }
+            start = min(entries[sig_id][0] for sig_id in expired)
+            fetched = self.source.get_dataum_delta(marks, Date(start))
+            with self.lock:
+                for sig_id in expired:
+                    complete_since = entries[sig_id][0]
+                    new = fetched.get(sig_id, NO_DATA)
+                    new = tuple(c[new[0] > complete_since] for c in new)
+                    old = tuple(cached[sig_id][name] for name in CACHE_DTYPE.names)
+                    cached[sig_id] = self._store(
+                        sig_id, merge_datums(old, new), complete_since, None, now
+                    )
+
+        output = {}
+        for sig_id in signature_ids:
+            datums = cached[sig_id]
+            # NEWEST FIRST, SO THE DATUMS AFTER since ARE A PREFIX
+            end = np.searchsorted(-datums["push_time"], -since, side="left")
+            end = min(end, limit + 1)
+            if end:
+                datums = datums[:end]
+                output[sig_id] = tuple(datums[name] for name in CACHE_DTYPE.names)
+
+        with self.lock:
+            self.db.query(
+                f"""
+                UPDATE {CACHE_TABLE}
+                SET accessed = {quote_value(now)}
+                WHERE id in {quote_list(signature_ids)}
+                """
+            )
+            self._evict()
+        return output
+
+    def get_dataum_delta(self, marks, since):
+        """
+        NOT CACHED, THE CALLER ALREADY HAS THE DATUMS UP TO EACH mark, AND
+        WANTS THE NEWEST, NOT WHAT WAS CACHED WITHIN THE ttl
+        """
+        return self.source.get_dataum_delta(marks, since)
+
+    def _covers(self, datums, complete_since, since, limit):
+        """
+        :return: True IF THE CACHED datums HAVE THE limit+1 MOST RECENT DATUMS AFTER since
+        """
+        if complete_since <= since:
+            return True
+        # TRUNCATED, BUT MAY STILL HAVE ENOUGH RECENT DATUMS
+        return np.count_nonzero(datums["push_time"] > complete_since) > limit
+
+    def _filename(self, sig_id):
+        return (self.directory / (str(sig_id) + ".npy")).abspath
+
+    def _load(self, sig_id):
+        """
+        :return: THE CACHED DATUMS, OR None IF THE FILE IS MISSING, BROKEN,
+                 OR IN AN OLDER FORMAT
+        """
+        filename = self._filename(sig_id)
+        try:
+            datums = np.load(filename, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as cause:
+            # TRUNCATED BY A CRASH, FORGET IT SO IT IS FETCHED AGAIN
+            Log.warning("Broken cache file for {{id}}", id=sig_id, cause=cause)
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            self.db.query(
+                f"DELETE FROM {CACHE_TABLE} WHERE id = {quote_value(sig_id)}"
+            )
+            return None
+        if datums.dtype != CACHE_DTYPE:
+            return None
+        return datums
+
+    def _store(self, sig_id, datums, since, limit, now):
+        """
+        :param since: THE datums ARE COMPLETE AFTER THIS TIME...
+        :param limit: ...UNLESS THERE ARE MORE THAN limit OF THEM
+        :return: THE STORED datums, AS ONE TABLE
+        """
+        push_times, values, alert_ids, datum_ids = datums
+        if limit is not None and len(push_times) > limit:
+            # TRUNCATED, SO ONLY COMPLETE AFTER THE OLDEST PUSH
+            since = push_times[-1]
+        table = np.zeros(len(push_times), dtype=CACHE_DTYPE)
+        table["push_time"] = push_times
+        table["value"] = values
+        table["alert_id"] = alert_ids
+        table["datum_id"] = datum_ids
+
+        filename = self._filename(sig_id)
+        temp = filename + ".tmp"
+        with open(temp, "wb") as f:
+            np.save(f, table)
+        os.replace(temp, filename)
+        self.db.query(
+            f"""
+            INSERT OR REPLACE INTO {CACHE_TABLE} (id, since, fetched, accessed, size)
+            VALUES (
+                {quote_value(sig_id)},
+                {quote_value(float(since))},
+                {quote_value(now)},
+                {quote_value(now)},
+                {quote_value(table.nbytes)}
+            )
+            """
+        )
+        return table
+
+    def _evict(self):
+        rows = self.db.query(
+            f"SELECT id, size FROM {CACHE_TABLE} ORDER BY accessed DESC"
+        ).data
+        total = 0
+        evict = []
+        for sig_id, size in rows:
+            total += size
+            if total > self.max_size:
+                evict.append(sig_id)
+        if not evict:
+            return
+        for sig_id in evict:
+            try:
+                os.remove(self._filename(sig_id))
+            except FileNotFoundError:
+                pass
+        self.db.query(f"DELETE FROM {CACHE_TABLE} WHERE id in {quote_list(evict)}")
+
+    def close(self):
+        self.db.close()
+
+
+_caches = {}
+_caches_lock = Lock("datum caches")
+
+
+def data_source(config):
+    """
+    :param config: EITHER A DataSource, OR THE database CONFIG. IF IT HAS A local
+                   DIRECTORY, THEN USE THAT SNAPSHOT INSTEAD OF THE DATABASE.
+                   IF IT HAS cache.directory, THEN CACHE THE DATUMS THERE
+    """
+    if isinstance(config, DataSource):
+        return config
+    if not config.cache.directory:
+        return _source(config)
+
+    key = File(config.cache.directory).abspath
+    with _caches_lock:
+        cache = _caches.get(key)
+        if not cache:
+            cache = _caches[key] = DatumCache(
+                _source(config),
+                config.cache.directory,
+                ttl=coalesce(config.cache.ttl, CACHE_TTL),
+                max_size=coalesce(config.cache.max_size, CACHE_SIZE),
+            )
+    return cache
+
+
+def _source(config):
+    if config.local:
+        return LocalSource(config.local)
+    return MySQLSource(config)
+
+
+def snapshot(source, signature_ids, since, directory, limit):
+    """
+    COPY SIGNATURES, AND THEIR DATUMS, TO A LOCAL DIRECTORY FOR LocalSource
+    """
+    source = data_source(source)
+    signature_ids = sorted(set(signature_ids))
+    signatures = []
+    columns = [[], [], [], [], []]
+    for _, batch in jx.chunk(signature_ids, size=extract_perf.BATCH_SIZE):
+        signatures.extend(source.get_signatures(batch).values())
+        datums = source.get_dataum_columns(batch, since, limit)
+        for sig_id in batch:
+            if sig_id not in datums:
+                continue
+            push_times, values, alert_ids, datum_ids = datums[sig_id]
+            columns[0].append(np.full(len(values), sig_id, dtype=np.int64))
+            columns[1].append(push_times)
+            columns[2].append(values)
+            columns[3].append(alert_ids)
+            columns[4].append(datum_ids)
+
+    directory = File(directory)
+    (directory / SIGNATURES_FILE).write(value2json(signatures))
+    np.savez(
+        (directory / DATUMS_FILE).abspath,
+        signature_id=np.concatenate(columns[0] or [np.zeros(0, dtype=np.int64)]),
+        push_time=np.concatenate(columns[1] or [np.zeros(0)]),
+        value=np.concatenate(columns[2] or [np.zeros(0)]),
+        alert_id=np.concatenate(columns[3] or [np.zeros(0, dtype=np.int64)]),
+        datum_id=np.concatenate(columns[4] or [np.zeros(0, dtype=np.int64)]),
+    )
@@ -0,0 +1,84 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from jx_sqlite.sqlite import Sqlite, quote_value
+from mo_dots import to_data
+from mo_json import json2value, value2json
+
+STATE_TABLE = "analysis_state"
+
+
+class AnalysisState(object):
+    """
+    LOCAL STORE OF PER-SIGNATURE ANALYSIS STATE, SO THE NEXT RUN CAN PICK UP
+    WHERE THIS ONE LEFT OFF
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: SQLITE FILE TO HOLD THE STATE
+        """
+        self.db = Sqlite(filename=filename, load_functions=False, debug=False)
+        self.db.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                id INTEGER PRIMARY KEY,
+                last_updated REAL,
+                state TEXT
+            )
+            """
+        )
+
+    def get(self, signature_id):
+        """
+        :return: THE STATE LAST SAVED FOR signature_id, OR None
+        """
+        result = self.db.query(
+            f"""
+            SELECT state
+            FROM {STATE_TABLE}
+            WHERE id = {quote_value(signature_id)}
+            """
+        )
+        if not result.data:
+            return None
+        return to_data(json2value(result.data[0][0]))
+
+    def get_times(self):
+        """
+        :return: MAP FROM SIGNATURE ID TO THE last_updated OF ITS SAVED STATE
+        """
+        result = self.db.query(f"SELECT id, last_updated FROM {STATE_TABLE}")
+        return {sig_id: last_updated for sig_id, last_updated in result.data}
+
+    def set(self, signature_id, state):
+        """
+        :param state: MUST HAVE last_updated, THE performance_signature.last_updated
+                      OF THE DATA ANALYZED
+        """
+        self.db.query(
+            f"""
+            INSERT OR REPLACE INTO {STATE_TABLE} (id, last_updated, state)
+            VALUES (
+                {quote_value(signature_id)},
+                {quote_value(state.last_updated)},
+                {quote_value(value2json(state))}
+            )
+            """
+        )
+
+    def remove(self, signature_id):
+        self.db.query(
+            f"DELETE FROM {STATE_TABLE} WHERE id = {quote_value(signature_id)}"
+        )
+
+    def close(self):
+        self.db.close()
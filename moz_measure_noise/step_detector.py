@@ -13,7 +13,9 @@ import numpy as np
 import traceback
 
 from numpy.lib.stride_tricks import as_strided
-from scipy.stats import stats, rankdata
+from scipy import stats
+from scipy.special import ndtr, stdtr
+from scipy.stats import rankdata
 
 from moz_measure_noise.utils import plot
 
@@ -69,11 +71,34 @@ def find_segments(values, diff_type, diff_threshold):
 
     SHOW_CHARTS and plot(ranks/len(values), title="RANKS")
     mwus = sliding_MWU(values)
+    top_edges = find_edges(mwus)
+
+    segments, diffs, _ = choose_segments(
+        values, logs, top_edges, diff_type, diff_threshold
+    )
+    return segments, diffs
+
+
+def find_edges(mwus):
+    """
+    RETURN THE CANDIDATE EDGES, GIVEN THE sliding_MWU() SCORES
+    """
     edge_detection = -np.log10(mwus[:, 1])
     # edge_detection = np.convolve(percentiles, edge_wavelet, mode="valid")
 
     top_edges = np.argsort(-edge_detection)
-    top_edges = filter_nearby_edges(top_edges[edge_detection[top_edges] > THRESHOLD / 3])
+    return filter_nearby_edges(top_edges[edge_detection[top_edges] > THRESHOLD / 3])
+
+
+def choose_segments(values, logs, top_edges, diff_type, diff_threshold, previous=None):
+    """
+    CONFIRM, MOVE, OR REMOVE EACH OF THE CANDIDATE top_edges
+    :param previous: MAP FROM (start, mid, end) TO (mid, diff), FROM AN EARLIER
+                     CALL ON (A PREFIX OF) THE SAME values
+    :return: (segments, diffs, scored) TRIPLE - scored IS THE MAP FOR THIS CALL
+    """
+    previous = previous or {}
+    scored = {}
 
     # SORT THE EDGE DETECTION
     segments = np.array([0, len(values)] + list(top_edges))
@@ -83,42 +108,113 @@ def find_segments(values, diff_type, diff_threshold):
     # CAN WE DO BETTER?
     for i, _ in enumerate(segments[:-2]):
         s, m, e = segments[i], segments[i + 1], segments[i + 2]
-        m_score, t_score, best_mid = jitter_MWU(logs, s, m, e)
-        if m_score.pvalue > P_THRESHOLD or s == best_mid or e == best_mid:
-            # NO EVIDENCE OF DIFFERENCE, COLLAPSE SEGMENT
-            segments[i + 1] = s
-            continue
-        if diff_type == PERFHERDER_THRESHOLD_TYPE_ABS:
-            diff_percent = np.abs(
-                np.median(values[s:best_mid]) - np.median(values[best_mid:e])
-            )
-            if diff_percent < diff_threshold:
-                # DIFFERENCE IS TOO SMALL
-                segments[i + 1] = s
-                continue
+        key = (int(s), int(m), int(e))
+        best = previous.get(key)
+        if best is None:
+            best = choose_edge(values, logs, s, m, e, diff_type, diff_threshold)
+        scored[key] = best
+        segments[i + 1], diffs[i + 1] = best
+
+    # REMOVE ZERO-LENGTH SEGMENTS
+    non_zero_segments = segments[:-1] != segments[1:]
+    segments = tuple([0] + list(segments[1:][non_zero_segments]))
+    diffs = tuple([0] + list(diffs[1:][non_zero_segments]))
+    return segments, diffs, scored
+
+
+def choose_edge(values, logs, s, m, e, diff_type, diff_threshold):
+    """
+    RETURN THE BEST EDGE BETWEEN s AND e, NEAR m
+    ONLY values[s:e] ARE USED
+    :return: (mid, diff) PAIR - mid==s IF THERE IS NO EDGE
+    """
+    m_score, t_score, best_mid = jitter_MWU(logs, s, m, e)
+    if m_score.pvalue > P_THRESHOLD or s == best_mid or e == best_mid:
+        # NO EVIDENCE OF DIFFERENCE, COLLAPSE SEGMENT
+        return s, 0
+    if diff_type == PERFHERDER_THRESHOLD_TYPE_ABS:
         diff_percent = np.abs(
-            np.median(values[best_mid:e]) / np.median(values[s:best_mid]) - 1
+            np.median(values[s:best_mid]) - np.median(values[best_mid:e])
         )
+        if diff_percent < diff_threshold:
+            # DIFFERENCE IS TOO SMALL
+            return s, 0
+    diff_percent = np.abs(
+        np.median(values[best_mid:e]) / np.median(values[s:best_mid]) - 1
+    )
 
-        try:
-            too_small = diff_percent < diff_threshold / 100
-        except Exception as cause:
-            raise cause
+    if diff_percent < diff_threshold / 100:
+        # DIFFERENCE IS TOO SMALL
+        return s, 0
 
-        if too_small:
-            # DIFFERENCE IS TOO SMALL
-            segments[i + 1] = segments[i]
-            continue
+    # LOOKS GOOD
+    return best_mid, diff_percent
 
-        # LOOKS GOOD
-        segments[i + 1] = best_mid
-        diffs[i + 1] = diff_percent
 
-    # REMOVE ZERO-LENGTH SEGMENTS
-    non_zero_segments = segments[:-1] != segments[1:]
-    segments = tuple([0] + list(segments[1:][non_zero_segments]))
-    diffs = tuple([0] + list(diffs[1:][non_zero_segments]))
-    return segments, diffs
+class StepDetector(object):
+    """
+    find_segments() THAT CAN BE EXTENDED WITH MORE VALUES
+
+    KEEPS THE sliding_MWU() SCORES, AND THE EDGES CHOSEN SO FAR, SO ONLY THE
+    TAIL TOUCHED BY THE NEW VALUES IS RE-EVALUATED
+    """
+
+    def __init__(self, diff_type=None, diff_threshold=None, values=()):
+        self.diff_type = diff_type
+        self.diff_threshold = coalesce(diff_threshold, DEFAULT_THRESHOLD)
+        self.mwu = SlidingMWU()
+        self.is_log = True  # ALL VALUES ARE POSITIVE, SO EDGES ARE FOUND IN log()
+        self.scored = {}  # MAP FROM (start, mid, end) TO (mid, diff)
+        self.append(values)
+
+    @property
+    def values(self):
+        return self.mwu.values
+
+    def append(self, values):
+        values = np.asarray(values, dtype=float)
+        self.mwu.extend(values)
+        is_log = bool(np.all(self.values > 0))
+        if is_log != self.is_log:
+            # ALL EDGES WERE FOUND WITH THE WRONG TRANSFORM
+            self.scored = {}
+            self.is_log = is_log
+        return self
+
+    def segments(self):
+        """
+        :return: SAME (segments, diffs) AS find_segments() ON ALL values
+        """
+        values = self.values
+        if len(values) == 0:
+            return (0,), (0,)
+        logs = np.log(values) if self.is_log else values
+        top_edges = find_edges(self.mwu.scores())
+        segments, diffs, self.scored = choose_segments(
+            values, logs, top_edges, self.diff_type, self.diff_threshold, self.scored
+        )
+        return segments, diffs
+
+    def __data__(self):
+        return {
+            "diff_type": self.diff_type,
+            "diff_threshold": self.diff_threshold,
+            "mwu": self.mwu.__data__(),
+            "scored": [
+                [s, m, e, int(mid), float(diff)]
+                for (s, m, e), (mid, diff) in self.scored.items()
+            ],
+        }
+
+    @staticmethod
+    def new_instance(state):
+        output = StepDetector(state["diff_type"], state["diff_threshold"])
+        output.mwu = SlidingMWU.new_instance(state["mwu"])
+        output.is_log = bool(np.all(output.values > 0))
+        output.scored = {
+            (s, m, e): (mid, diff) for s, m, e, mid, diff in state["scored"]
+        }
+        return output
 
 
 def filter_nearby_edges(edges):
@@ -156,7 +252,98 @@ no_good_edge = Data(pvalue=1)
 
 def jitter_MWU(values, start, mid, end):
     """
-    RETURN A BETTER MIDPOINT< ACCOUNTING FOR t-test RESULTS
+    RETURN A BETTER MIDPOINT, ACCOUNTING FOR t-test RESULTS
+    ALL CANDIDATE MIDPOINTS ARE SCORED AT ONCE; SEE jitter_MWU_scipy() FOR THE REFERENCE
+    """
+
+    # ADD SOME CONSTRAINTS TO THE RANGE OF VALUES TESTED
+    m_start = min(mid, max(start + MIN_POINTS, mid - JITTER))
+    m_end = max(mid, min(mid + JITTER, end - MIN_POINTS))
+    if m_start == m_end:
+        return no_good_edge, no_good_edge, mid
+    mids = np.array(range(m_start, m_end))
+
+    # EACH MIDPOINT COMPARES values[lo:mid] TO values[mid:hi]
+    # ALL ARE SLICES OF ONE span, SO WE COMPARE ALL PAIRS IN span ONCE
+    offset = max(start, m_start - MAX_POINTS)
+    span = np.asarray(values[offset : min(end, m_end - 1 + MAX_POINTS)], dtype=float)
+    lo = np.maximum(start, mids - MAX_POINTS) - offset
+    mm = mids - offset
+    hi = np.minimum(end, mids + MAX_POINTS) - offset
+    n1, n2 = mm - lo, hi - mm
+    greater = span[:, None] > span[None, :]
+    equal = span[:, None] == span[None, :]
+
+    # MWU SCORES
+    # U1 COUNTS THE (x, y) PAIRS WITH x > y (TIES COUNT HALF), WHICH IS A
+    # RECTANGLE IN THE SUMMED-AREA TABLE OF THE PAIRWISE COMPARISONS
+    area = np.zeros((len(span) + 1, len(span) + 1))
+    area[1:, 1:] = np.cumsum(np.cumsum(greater + 0.5 * equal, axis=0), axis=1)
+    u1 = area[mm, hi] - area[lo, hi] - area[mm, mm] + area[lo, mm]
+
+    # sum(t**3 - t) OVER TIE GROUPS IS sum(c**2 - 1) WHERE c IS THE NUMBER OF
+    # VALUES EQUAL TO EACH VALUE
+    num_equal = np.zeros((len(span), len(span) + 1))
+    num_equal[:, 1:] = np.cumsum(equal, axis=1)
+    rows = lo[:, None] + np.arange(np.max(hi - lo))
+    inside = rows < hi[:, None]
+    rows = np.minimum(rows, len(span) - 1)
+    c = num_equal[rows, hi[:, None]] - num_equal[rows, lo[:, None]]
+    tie_term = np.sum(inside * (c ** 2 - 1), axis=1)
+    m_score = mwu_pvalue(u1, n1, n2, tie_term)
+    # WHEN ALL VALUES ARE TIED THE TIE CORRECTION LEAVES NO VARIANCE, AND
+    # THERE IS NO EDGE TO FIND
+    n = n1 + n2
+    m_score[tie_term >= n ** 3 - n] = 1
+
+    # stats.mannwhitneyu() IS EXACT FOR SMALL SAMPLES WITHOUT TIES
+    exact = ((n1 <= 8) | (n2 <= 8)) & (tie_term == 0) & (n1 > 0) & (n2 > 0)
+    for i in np.flatnonzero(exact):
+        m_score[i] = stats.mannwhitneyu(
+            span[lo[i] : mm[i]],
+            span[mm[i] : hi[i]],
+            use_continuity=True,
+            alternative="two-sided",
+            method="exact",
+        )[1]
+
+    # t-test SCORES, FROM PREFIX SUMS
+    centered = span - np.mean(span)
+    sums = np.concatenate([[0], np.cumsum(centered)])
+    squares = np.concatenate([[0], np.cumsum(centered ** 2)])
+
+    def mean_var(a, b):
+        n = b - a
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = (sums[b] - sums[a]) / n
+            var = np.maximum(squares[b] - squares[a] - n * mean ** 2, 0) / (n - 1)
+        # SLICES OF IDENTICAL VALUES HAVE NO VARIANCE
+        first = np.minimum(a, len(span) - 1)
+        constant = (n > 1) & (num_equal[first, b] - num_equal[first, a] == n)
+        return mean, np.where(constant, 0, var)
+
+    mean1, var1 = mean_var(lo, mm)
+    mean2, var2 = mean_var(mm, hi)
+    t_score = welch_pvalue(mean1, var1, n1, mean2, var2, n2)
+    # TWO IDENTICAL CONSTANT SIDES ARE NOT AN EDGE
+    t_score[(var1 == 0) & (var2 == 0) & (mean1 == mean2)] = 1
+
+    # NO SCORE IF ONE SIDE IS EMPTY
+    empty = (n1 == 0) | (n2 == 0)
+    m_score[empty] = 1
+    t_score[empty] = 1
+
+    # PICK LOWEST
+    pvalue = np.sqrt(m_score * t_score)
+    best = np.argmin(pvalue)
+
+    return Data(pvalue=m_score[best]), Data(pvalue=t_score[best]), mids[best]
+
+
+def jitter_MWU_scipy(values, start, mid, end):
+    """
+    SAME AS jitter_MWU(), BUT WITH stats.mannwhitneyu() AND stats.ttest_ind()
+    CALLS FOR EACH MIDPOINT
     """
 
     # ADD SOME CONSTRAINTS TO THE RANGE OF VALUES TESTED
@@ -218,9 +405,83 @@ def jitter_MWU(values, start, mid, end):
     return Data(pvalue=m_score[best, 1]), Data(pvalue=t_score[best, 1]), mids[best]
 
 
-def sliding_MWU(values):
+def rank_rows(matrix):
+    """
+    RANK EACH ROW OF matrix, LIKE rankdata() (TIES GET THEIR AVERAGE RANK)
+    :param matrix: 2D array
+    :return: (ranks, tie_term) PAIR - ranks IS SAME SHAPE AS matrix,
+             tie_term IS sum(t**3 - t) OVER THE TIE GROUPS OF EACH ROW
+    """
+    matrix = np.asarray(matrix)
+    num_rows, num_cols = matrix.shape
+    order = np.argsort(matrix, axis=1, kind="mergesort")
+    ordered = np.take_along_axis(matrix, order, axis=1)
+
+    # MARK THE START OF EACH TIE GROUP
+    starts = np.ones(matrix.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    group = np.cumsum(starts.ravel()) - 1
+    counts = np.bincount(group)
+    first = np.flatnonzero(starts.ravel()) % num_cols
+    average_rank = first + (counts + 1) / 2
+
+    ranks = np.empty(matrix.shape)
+    np.put_along_axis(ranks, order, average_rank[group].reshape(matrix.shape), axis=1)
+
+    group_row = np.flatnonzero(starts.ravel()) // num_cols
+    tie_term = np.bincount(
+        group_row, weights=counts ** 3 - counts, minlength=num_rows
+    )
+    return ranks, tie_term
+
+
+def batch_MWU(x, y):
+    """
+    TWO-SIDED MANN-WHITNEY U TEST OF EACH ROW OF x AGAINST SAME ROW OF y
+    USES NORMAL APPROXIMATION, WITH TIE CORRECTION AND CONTINUITY CORRECTION,
+    SAME AS stats.mannwhitneyu(method="asymptotic")
+    :param x: 2D array, ONE SAMPLE PER ROW
+    :param y: 2D array, ONE SAMPLE PER ROW
+    :return: (len(x), 2) ARRAY OF (U statistic, pvalue)
+    """
+    n1, n2 = x.shape[1], y.shape[1]
+    ranks, tie_term = rank_rows(np.hstack([x, y]))
+    u1 = ranks[:, :n1].sum(axis=1) - n1 * (n1 + 1) / 2
+    return np.column_stack([u1, mwu_pvalue(u1, n1, n2, tie_term)])
+
+
+def mwu_pvalue(u1, n1, n2, tie_term):
     """
-    RETURN
+    TWO-SIDED, NORMAL APPROXIMATION, MANN-WHITNEY U p-value
+    :param u1: U STATISTIC OF FIRST SAMPLE
+    :param n1: SIZE OF FIRST SAMPLE
+    :param n2: SIZE OF SECOND SAMPLE
+    :param tie_term: sum(t**3 - t) OVER THE TIE GROUPS OF BOTH SAMPLES
+    """
+    n = n1 + n2
+    u = np.maximum(u1, n1 * n2 - u1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (u - n1 * n2 / 2 - 0.5) / s
+    return np.clip(2 * ndtr(-z), 0, 1)
+
+
+def welch_pvalue(mean1, var1, n1, mean2, var2, n2):
+    """
+    TWO-SIDED p-value OF WELCH'S t-test, SAME AS stats.ttest_ind(equal_var=False)
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vn1 = var1 / n1
+        vn2 = var2 / n2
+        df = (vn1 + vn2) ** 2 / (vn1 ** 2 / (n1 - 1) + vn2 ** 2 / (n2 - 1))
+        df = np.where(np.isnan(df), 1, df)
+        t = (mean1 - mean2) / np.sqrt(vn1 + vn2)
+    return stdtr(df, -np.abs(t)) * 2
+
+
+def sliding_window(values):
+    """
+    RETURN (len(values), 2*weight_radius) WINDOWS, ONE CENTERED ON EACH VALUE
     :param values:
     :return:
     """
@@ -232,10 +493,132 @@ def sliding_MWU(values):
     ]
     combined = np.array(prefix + list(values) + suffix)
     b = combined.itemsize
-    window = as_strided(
+    return as_strided(
         combined, shape=(len(values), weight_radius * 2), strides=(b, b)
     )
 
+
+def score_windows(window):
+    """
+    MWU SCORE OF THE (WEIGHTED) RANKS IN FIRST HALF, AND SECOND HALF, OF EACH ROW
+    :param window: (n, 2*weight_radius) ARRAY
+    :return: (n, 2) ARRAY OF (U statistic, pvalue)
+    """
+    med = (len(median_weight) + 1) / 2
+    ranks, _ = rank_rows(window)
+    w = (ranks - med) * median_weight
+    return batch_MWU(w[:, :weight_radius], w[:, weight_radius:])
+
+
+def sliding_MWU(values):
+    """
+    RETURN MWU SCORE OF THE (WEIGHTED) RANKS BEFORE, AND AFTER, EACH VALUE
+    ALL WINDOWS ARE SCORED AT ONCE; SEE sliding_MWU_scipy() FOR THE REFERENCE
+    :param values:
+    :return: (len(values), 2) ARRAY OF (U statistic, pvalue)
+    """
+    if len(values) == 0:
+        return np.zeros((0, 2))
+    return score_windows(sliding_window(values))
+
+
+class SlidingMWU(object):
+    """
+    sliding_MWU() THAT CAN BE EXTENDED WITH MORE VALUES
+
+    A WINDOW IS FINAL ONCE IT NO LONGER TOUCHES THE MEDIAN PADDING AT THE
+    END OF THE SERIES. extend() ONLY SCORES THE NEW FINAL WINDOWS, AND THE
+    LAST weight_radius WINDOWS THAT DEPEND ON THE (CHANGED) PADDING
+    """
+
+    def __init__(self, values=()):
+        self.values = np.zeros(0)
+        self.prefix = None  # MEDIAN PADDING AT START, KNOWN ONCE WE HAVE ENOUGH VALUES
+        self.final = np.zeros((0, 2))  # SCORES THAT WILL NOT CHANGE
+        self.tail = np.zeros((0, 2))  # SCORES THAT DEPEND ON THE SUFFIX PADDING
+        self.extend(values)
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return self
+        self.values = np.concatenate([self.values, values])
+        n = len(self.values)
+        if n < 2 * weight_radius:
+            # PREFIX STILL CHANGING, SO SCORE EVERYTHING
+            self.tail = sliding_MWU(self.values)
+            return self
+
+        if self.prefix is None:
+            self.prefix = np.array(
+                [
+                    np.median(self.values[: i + weight_radius])
+                    for i in range(weight_radius)
+                ]
+            )
+        suffix = np.array(
+            [
+                np.median(self.values[-i - weight_radius:])
+                for i in reversed(range(weight_radius))
+            ]
+        )
+        start, end = len(self.final), n - weight_radius
+        combined = self._padded(start, n + 2 * weight_radius - 1, suffix)
+        b = combined.itemsize
+        window = as_strided(
+            combined, shape=(n - start, weight_radius * 2), strides=(b, b)
+        )
+        scores = score_windows(window)
+        self.final = np.concatenate([self.final, scores[: end - start]])
+        self.tail = scores[end - start:]
+        return self
+
+    def _padded(self, start, end, suffix):
+        """
+        RETURN prefix + values + suffix, BUT ONLY THE [start, end) SLICE
+        """
+        n = len(self.values)
+        r = weight_radius
+        return np.concatenate(
+            [
+                self.prefix[min(start, r) : min(end, r)],
+                self.values[max(start - r, 0) : max(min(end - r, n), 0)],
+                suffix[max(start - r - n, 0) : max(end - r - n, 0)],
+            ]
+        )
+
+    def scores(self):
+        """
+        :return: SAME AS sliding_MWU(values)
+        """
+        return np.concatenate([self.final, self.tail])
+
+    def __data__(self):
+        return {
+            "values": self.values.tolist(),
+            "prefix": None if self.prefix is None else self.prefix.tolist(),
+            "final": self.final.tolist(),
+            "tail": self.tail.tolist(),
+        }
+
+    @staticmethod
+    def new_instance(state):
+        output = SlidingMWU()
+        output.values = np.array(state["values"], dtype=float)
+        if state["prefix"] is not None:
+            output.prefix = np.array(state["prefix"], dtype=float)
+        output.final = np.array(state["final"], dtype=float).reshape(-1, 2)
+        output.tail = np.array(state["tail"], dtype=float).reshape(-1, 2)
+        return output
+
+
+def sliding_MWU_scipy(values):
+    """
+    SAME AS sliding_MWU(), BUT WITH ONE stats.mannwhitneyu() CALL PER WINDOW
+    :param values:
+    :return:
+    """
+    window = sliding_window(values)
     med = (len(median_weight) + 1) / 2
     try:
         m_score = np.array(
@@ -0,0 +1,99 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import numpy as np
+
+from moz_measure_noise import deviance_batch
+from moz_measure_noise.step_detector import StepDetector
+
+# THIS MODULE ONLY NEEDS numpy AND scipy, SO summarize() CAN RUN IN A
+# WORKER PROCESS WITHOUT LOADING THE DATABASE LIBRARIES
+
+
+def summarize(values, diff_type=None, diff_threshold=None, detector=None):
+    """
+    FIND THE SEGMENTS, AND MEASURE THE NOISE, OF ONE SERIES
+    :param values: NEW VALUES, ONE PER PUSH
+    :param diff_type: alert_change_type OF THE SIGNATURE
+    :param diff_threshold: alert_threshold OF THE SIGNATURE
+    :param detector: OPTIONAL StepDetector STATE; values ARE APPENDED TO IT
+    :return: dict WITH values, segments, diffs, detector STATE, AND summary
+    """
+    if detector:
+        detector = StepDetector.new_instance(detector).append(values)
+    else:
+        detector = StepDetector(diff_type, diff_threshold, values)
+    values = detector.values
+    new_segments, new_diffs = detector.segments()
+
+    if len(new_segments) == 1:
+        overall_dev_status = None
+        overall_dev_score = None
+        last_mean = None
+        last_std = None
+        last_dev_status = None
+        last_dev_score = None
+        relative_noise = None
+    else:
+        # NOISE OF LAST SEGMENT
+        s, e = new_segments[-2], new_segments[-1]
+        last_segment = np.array(values[s:e])
+        trimmed_segment = last_segment
+        last_mean = np.mean(trimmed_segment)
+        last_std = np.std(trimmed_segment)
+        relative_noise = last_std / last_mean
+
+        normalized = normalize_segments(values, new_segments, last_mean, last_std)
+
+        # DEVIANCE OF THE LAST SEGMENT, AND OF THE WHOLE NORMALIZED SERIES
+        statuses, scores = deviance_batch(
+            np.concatenate([trimmed_segment, normalized]),
+            [0, len(trimmed_segment), len(trimmed_segment) + len(normalized)],
+        )
+        last_dev_status, overall_dev_status = (str(status) for status in statuses)
+        last_dev_score, overall_dev_score = (float(score) for score in scores)
+
+    return {
+        "values": values.tolist(),
+        "segments": new_segments,
+        "diffs": new_diffs,
+        "detector": detector.__data__(),
+        "summary": {
+            "num_pushes": len(values),
+            "num_segments": len(new_segments) - 1,
+            "relative_noise": relative_noise,
+            "overall_dev_status": overall_dev_status,
+            "overall_dev_score": overall_dev_score,
+            "last_mean": last_mean,
+            "last_std": last_std,
+            "last_dev_status": last_dev_status,
+            "last_dev_score": last_dev_score,
+        },
+    }
+
+
+def normalize_segments(values, segments, mean, std):
+    """
+    FOR EACH SEGMENT, NORMALIZE MEAN AND VARIANCE
+    :param values: THE SERIES
+    :param segments: SEGMENT BOUNDARIES, FROM find_segments()
+    :param mean: THE MEAN EVERY SEGMENT WILL HAVE
+    :param std: THE STANDARD DEVIATION EVERY SEGMENT WILL HAVE
+    :return: ARRAY OF values[segments[0]:segments[-1]], NORMALIZED
+    """
+    values = np.asarray(values, dtype=float)[segments[0] : segments[-1]]
+    lengths = np.diff(segments)
+    ids = np.repeat(np.arange(len(lengths)), lengths)
+    means = np.bincount(ids, weights=values, minlength=len(lengths)) / lengths
+    diff = values - means[ids]
+    variances = np.bincount(ids, weights=diff * diff, minlength=len(lengths)) / lengths
+    stds = np.sqrt(variances)
+    return (diff + mean) * std / stds[ids]
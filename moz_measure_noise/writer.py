@@ -0,0 +1,207 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from mo_json import value2json
+from mo_logs import Log, Except
+from mo_threads import Lock, Thread, Till
+
+BATCH_ROWS = 500  # MAXIMUM ROWS SENT IN ONE REQUEST
+# MAXIMUM BYTES OF (UNTYPED) JSON SENT IN ONE REQUEST. BIGQUERY REJECTS
+# REQUESTS OVER 10MB, AND THE TYPED ENCODING MAKES THE ROWS BIGGER
+MAX_PAYLOAD = 5 * 1000 * 1000
+FLUSH_INTERVAL = 10  # SECONDS A ROW MAY WAIT IN THE BUFFER
+RETRIES = 3  # ATTEMPTS TO RESEND A FAILED BATCH BEFORE GIVING UP
+RETRY_WAIT = 2  # SECONDS BEFORE THE FIRST RETRY, DOUBLED FOR EACH RETRY AFTER
+# ERRORS ABOUT THE BATCH ITSELF, WHICH SMALLER BATCHES CAN FIX
+SPLIT_ERRORS = [
+    "Request payload size exceeds the limit",
+    "Your client has issued a malformed or illegal request.",
+    "Got {{num}} failures",  # jx_bigquery: insert_rows_json() REJECTED SOME ROWS
+]
+
+
+class BufferedWriter(object):
+    """
+    BUFFER ROWS FOR destination, AND SEND THEM IN BATCHES FROM A BACKGROUND
+    THREAD, SO WE MAKE ONE REQUEST PER BATCH, NOT ONE PER ROW.
+    BATCHES ARE SIZED TO STAY UNDER THE REQUEST PAYLOAD LIMIT. A BATCH THAT
+    IS TOO BIG, OR HAS A BAD ROW, IS SPLIT IN HALF, SO ONE BAD ROW ONLY LOSES
+    ITSELF. ANY OTHER FAILURE IS RETRIED, THEN RAISED BY flush() OR close(),
+    AND THE ROWS NOT WRITTEN STAY BUFFERED FOR THE NEXT flush(), WITHOUT
+    CALLING THEIR on_write.
+    A RETRIED BATCH MAY BE WRITTEN TWICE, SO READERS MUST PICK THE LATEST
+    ROW PER id
+    """
+
+    def __init__(
+        self,
+        destination,
+        batch_rows=BATCH_ROWS,
+        max_payload=MAX_PAYLOAD,
+        flush_interval=FLUSH_INTERVAL,
+        retries=RETRIES,
+        retry_wait=RETRY_WAIT,
+    ):
+        """
+        :param destination: ANYTHING WITH extend(rows), LIKE A jx_bigquery Table
+        :param batch_rows: MAXIMUM ROWS IN ONE extend()
+        :param max_payload: MAXIMUM BYTES OF JSON IN ONE extend()
+        :param flush_interval: SECONDS BEFORE A PARTIAL BATCH IS SENT ANYWAY
+        :param retries: ATTEMPTS TO RESEND A FAILED BATCH
+        :param retry_wait: SECONDS BEFORE THE FIRST RETRY
+        """
+        self.destination = destination
+        self.batch_rows = batch_rows
+        self.max_payload = max_payload
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_wait = retry_wait
+        self.lock = Lock("buffered writer")
+        self.rows = []  # (size, row, on_write) TRIPLES
+        self.size = 0  # TOTAL BYTES IN rows
+        self.flusher = Thread.run("buffered writer", self._flusher)
+
+    def add(self, row, on_write=None):
+        """
+        :param on_write: OPTIONAL FUNCTION, CALLED AFTER row IS WRITTEN
+        """
+        size = len(value2json(row))
+        with self.lock:
+            self.rows.append((size, row, on_write))
+            self.size += size
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        """
+        SEND EVERYTHING BUFFERED, FROM THE CALLING THREAD
+        """
+        self._write(self._pop_all())
+
+    def close(self):
+        """
+        STOP THE BACKGROUND THREAD, AND SEND EVERYTHING BUFFERED
+        """
+        self.flusher.stop()
+        self.flusher.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _is_full(self):
+        return len(self.rows) >= self.batch_rows or self.size >= self.max_payload
+
+    def _pop_all(self):
+        with self.lock:
+            rows, self.rows, self.size = self.rows, [], 0
+        return rows
+
+    def _flusher(self, please_stop):
+        while not please_stop:
+            deadline = Till(seconds=self.flush_interval)
+            with self.lock:
+                # ANY add() WAKES US, SO CHECK IF THERE IS A FULL BATCH YET
+                while not self._is_full() and not deadline and not please_stop:
+                    self.lock.wait(till=deadline | please_stop)
+            if please_stop:
+                # close() SENDS THE REST, SO IT CAN RAISE ANY PROBLEM
+                break
+            try:
+                self.flush()
+            except Exception as cause:
+                Log.warning("Problem writing rows", cause=cause)
+
+    def _write(self, rows):
+        """
+        :param rows: (size, row, on_write) TRIPLES, FROM _pop_all()
+        """
+        num_sent = 0
+        try:
+            for batch in batches(rows, self.batch_rows, self.max_payload):
+                self._send(batch)
+                num_sent += len(batch)
+        except Exception:
+            # THE NEXT flush() TRIES THE FAILED BATCH, AND THOSE AFTER IT, AGAIN
+            self._put_back(rows[num_sent:])
+            raise
+
+    def _put_back(self, rows):
+        with self.lock:
+            self.rows = rows + self.rows
+            self.size += sum(size for size, _, _ in rows)
+
+    def _send(self, batch):
+        """
+        :param batch: (row, on_write) PAIRS
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                self.destination.extend([row for row, _ in batch])
+                break
+            except Exception as cause:
+                cause = Except.wrap(cause)
+                if is_batch_problem(cause):
+                    if len(batch) == 1:
+                        Log.warning(
+                            "Could not write row {{id}}", id=batch[0][0].get("id"), cause=cause
+                        )
+                        return
+                    Log.warning(
+                        "Could not write {{num}} rows, splitting", num=len(batch), cause=cause
+                    )
+                    half = len(batch) // 2
+                    self._send(batch[:half])
+                    self._send(batch[half:])
+                    return
+                if attempt == self.retries:
+                    Log.error("Could not write {{num}} rows", num=len(batch), cause=cause)
+                Log.warning(
+                    "Problem writing {{num}} rows, retrying", num=len(batch), cause=cause
+                )
+                Till(seconds=self.retry_wait * 2 ** attempt).wait()
+
+        for _, on_write in batch:
+            if on_write:
+                try:
+                    on_write()
+                except Exception as cause:
+                    Log.warning("Problem after write", cause=cause)
+
+
+def is_batch_problem(cause):
+    """
+    :return: True IF cause IS ABOUT THE BATCH (TOO BIG, OR A BAD ROW), NOT THE
+             CONNECTION OR THE TABLE, SO SPLITTING THE BATCH CAN HELP
+    """
+    return any(message in cause for message in SPLIT_ERRORS)
+
+
+def batches(rows, batch_rows, max_payload):
+    """
+    :param rows: (size, row, on_write) TRIPLES
+    :return: LISTS OF (row, on_write) PAIRS, EACH WITH AT MOST batch_rows ROWS,
+             AND AT MOST max_payload BYTES (UNLESS IT IS ONE ROW BIGGER THAN THAT)
+    """
+    batch, batch_size = [], 0
+    for size, row, on_write in rows:
+        if batch and (len(batch) >= batch_rows or batch_size + size > max_payload):
+            yield batch
+            batch, batch_size = [], 0
+        batch.append((row, on_write))
+        batch_size += size
+    if batch:
+        yield batch
@@ -0,0 +1,211 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+"""
+FAKE SOURCES, TABLES, STATE AND DATABASE SHARED BY THE TESTS, SO THEY ALL
+FOLLOW THE SAME INTERFACES AS THE REAL ONES
+"""
+from __future__ import absolute_import, division, unicode_literals
+
+from contextlib import contextmanager
+
+import numpy
+
+from mo_dots import Data
+from mo_logs import Log  # NOT USED, BUT MUST BE IMPORTED BEFORE mo_times
+from mo_times import Date
+from moz_measure_noise import extract_perf
+from moz_measure_noise.sources import DataSource
+
+START = 1_000_000  # PUSH TIME OF THE FIRST PUSH
+SINCE = Date(START - 1)
+
+
+class FakeSource(DataSource):
+    """
+    ONE DATUM PER PUSH, PUSHES 1000 SECONDS APART, WITH A STEP IN THE MIDDLE
+    THE DATUM ids OF SIGNATURE s ARE s*10000, s*10000+1, ...
+    """
+
+    def __init__(self, num_pushes=60, sig_ids=(1, 2, 3)):
+        self.signatures = {}
+        self.datums = {}
+        self.requests = []  # (signature_ids, since) OR (marks, since) FOR EACH DATUM REQUEST
+        for sig_id in sig_ids:
+            self.signatures[sig_id] = Data(
+                id=sig_id,
+                framework="talos",
+                suite="suite",
+                test="test" + str(sig_id),
+                platform="linux",
+                repository="autoland",
+                last_updated=START + num_pushes * 1000,
+            )
+            self.datums[sig_id] = []
+            self.add(sig_id, num_pushes)
+
+    def add(self, sig_id, num_pushes, push_time=None):
+        """
+        ADD num_pushes NEW DATUMS, AFTER THE LAST PUSH, OR ALL AT push_time
+        """
+        datums = self.datums[sig_id]
+        for _ in range(num_pushes):
+            i = len(datums)
+            datum_id = sig_id * 10_000 + i
+            if push_time is None:
+                t = START + i * 1000
+            else:
+                t = push_time
+            value = (10 if i < 30 else 20) + numpy.sin(i)
+            datums.append((t, value, 0, datum_id))
+        if datums:
+            self.signatures[sig_id].last_updated = (
+                max(t for t, _, _, _ in datums) + len(datums) - 1
+            )
+
+    def get_signatures(self, signature_ids):
+        return {i: self.signatures[i] for i in signature_ids if i in self.signatures}
+
+    def get_signature_times(self, since):
+        since = Date(since).unix
+        return {
+            i: sig.last_updated
+            for i, sig in self.signatures.items()
+            if sig.last_updated > since
+        }
+
+    def get_dataum_columns(self, signature_ids, since, limit):
+        self.requests.append((list(signature_ids), Date(since).unix))
+        output = {}
+        for i in signature_ids:
+            columns = self._columns(i, lambda d: d[0] > Date(since).unix)
+            if columns:
+                output[i] = tuple(c[: limit + 1] for c in columns)
+        return output
+
+    def get_dataum_delta(self, marks, since):
+        self.requests.append((dict(marks), Date(since).unix))
+        output = {}
+        for i, mark in marks.items():
+            columns = self._columns(
+                i, lambda d: d[3] > mark and d[0] > Date(since).unix
+            )
+            if columns:
+                output[i] = columns
+        return output
+
+    def _columns(self, sig_id, keep):
+        if sig_id not in self.datums:
+            return None
+        datums = sorted(
+            (d for d in self.datums[sig_id] if keep(d)), key=lambda d: -d[0]
+        )
+        if not datums:
+            return None
+        push_times, values, alert_ids, datum_ids = zip(*datums)
+        return (
+            numpy.array(push_times, dtype=float),
+            numpy.array(values, dtype=float),
+            numpy.array(alert_ids, dtype=numpy.int64),
+            numpy.array(datum_ids, dtype=numpy.int64),
+        )
+
+
+class FakeTable(object):
+    """
+    ANYTHING WITH extend(rows), LIKE A jx_bigquery Table
+    """
+
+    def __init__(self, bad=None, failures=0):
+        """
+        :param bad: id OF A ROW THAT MAKES ITS WHOLE REQUEST MALFORMED
+        :param failures: NUMBER OF REQUESTS THAT FAIL, BEFORE ANY SUCCEED
+        """
+        self.bad = bad
+        self.failures = failures
+        self.requests = []  # THE ROW ids OF EACH extend()
+        self.rows = []  # THE ROWS WRITTEN
+
+    def extend(self, rows):
+        rows = list(rows)
+        self.requests.append([row.id for row in rows])
+        if self.failures:
+            self.failures -= 1
+            raise Exception("Connection reset by peer")
+        if any(row.id == self.bad for row in rows):
+            raise Exception("Your client has issued a malformed or illegal request.")
+        self.rows.extend(rows)
+
+
+class FakeState(object):
+    """
+    IN-MEMORY AnalysisState
+    """
+
+    def __init__(self, times=None):
+        """
+        :param times: OPTIONAL MAP FROM SIGNATURE ID TO THE last_updated ANALYZED
+        """
+        self.states = {
+            sig_id: Data(last_updated=last_updated)
+            for sig_id, last_updated in (times or {}).items()
+        }
+
+    def get(self, signature_id):
+        return self.states.get(signature_id)
+
+    def get_times(self):
+        return {sig_id: state.last_updated for sig_id, state in self.states.items()}
+
+    def set(self, signature_id, state):
+        self.states[signature_id] = state
+
+    def remove(self, signature_id):
+        self.states.pop(signature_id, None)
+
+    def close(self):
+        pass
+
+
+class FakeCursor(object):
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.sizes = []
+
+    def fetchmany(self, size):
+        self.sizes.append(size)
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+
+class FakeDB(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.sql = []
+
+    def query(self, sql, stream=False, row_tuples=False):
+        self.sql.append(str(sql))
+        return iter(self.rows)
+
+
+@contextmanager
+def use_db(db):
+    """
+    SEND extract_perf QUERIES TO db
+    """
+
+    @contextmanager
+    def connection(db_config):
+        yield db
+
+    old, extract_perf.connection = extract_perf.connection, connection
+    try:
+        yield
+    finally:
+        extract_perf.connection = old
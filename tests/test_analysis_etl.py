@@ -0,0 +1,202 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import tempfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import TestCase
+
+from mo_json import value2json
+from moz_measure_noise.analysis_etl import (
+    fetch_batch,
+    new_pool,
+    process,
+    process_all,
+)
+from moz_measure_noise.sources import DatumCache
+from moz_measure_noise.state import AnalysisState
+from tests.fakes import SINCE, START, FakeSource, FakeTable
+
+class BrokenSource(FakeSource):
+    """
+    ANY REQUEST FOR SIGNATURE 4 FAILS, AND SIGNATURE 5 CAN NOT BE SUMMARIZED
+    """
+
+    def __init__(self):
+        FakeSource.__init__(self, sig_ids=(1, 2, 3, 4, 5))
+        self.signatures[5].alert_threshold = "not a number"
+
+    def get_signatures(self, signature_ids):
+        if 4 in signature_ids:
+            raise Exception("Lost connection to MySQL server")
+        return FakeSource.get_signatures(self, signature_ids)
+
+
+class BrokenPool(object):
+    """
+    EVERY summarize() IS LOST, AS IF ITS PROCESS DIED
+    """
+
+    def submit(self, fn, **kwargs):
+        result = Future()
+        result.set_exception(BrokenProcessPool("A process died"))
+        return result
+
+
+def without_time(row):
+    return value2json({k: v for k, v in row.items() if k != "last_updated"})
+
+
+class TestAnalysisETL(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state = AnalysisState(os.path.join(self.directory.name, "state.sqlite"))
+
+    def tearDown(self):
+        self.state.close()
+        self.directory.cleanup()
+
+    def test_state_round_trip(self):
+        source = FakeSource()
+        process(1, SINCE, source, FakeTable(), self.state)
+        state = self.state.get(1)
+        self.assertEqual(state.last_updated, source.signatures[1].last_updated)
+        self.assertEqual(len(state.push_times), 60)
+        self.assertEqual(state.last_datum_id, 10_059)
+        self.assertEqual(self.state.get_times(), {1: state.last_updated})
+        self.assertIsNone(self.state.get(2))
+
+    def test_process_all(self):
+        source = BrokenSource()
+        expected, expected_state = FakeTable(), AnalysisState(
+            os.path.join(self.directory.name, "expected.sqlite")
+        )
+        try:
+            for sig_id in [1, 2, 3]:
+                process(sig_id, SINCE, source, expected, expected_state)
+            expected_states = {i: expected_state.get(i) for i in [1, 2, 3]}
+        finally:
+            expected_state.close()
+
+        result = FakeTable()
+        written = []
+        process_all(
+            [1, 2, 3, 4, 5],
+            SINCE,
+            source,
+            result,
+            self.state,
+            num_compute=2,
+            on_write=lambda sig: written.append(sig.id),
+        )
+
+        self.assertEqual(sorted(row.id for row in result.rows), [1, 2, 3])
+        self.assertEqual(sorted(written), [1, 2, 3])
+        expected_rows = {row.id: row for row in expected.rows}
+        for row in result.rows:
+            self.assertEqual(
+                without_time(row), without_time(expected_rows[row.id])
+            )
+            self.assertEqual(self.state.get(row.id), expected_states[row.id])
+        self.assertIsNone(self.state.get(4))
+        self.assertIsNone(self.state.get(5))
+
+    def test_shared_pool(self):
+        source = FakeSource()
+        result = FakeTable()
+        pool = new_pool(2)
+        try:
+            process_all([1], SINCE, source, result, self.state, pool=pool)
+            process_all([2, 3], SINCE, source, result, self.state, pool=pool)
+            # NOT SHUT DOWN
+            self.assertEqual(pool.submit(abs, -1).result(), 1)
+        finally:
+            pool.shutdown()
+        self.assertEqual(sorted(row.id for row in result.rows), [1, 2, 3])
+
+    def test_cache(self):
+        source = FakeSource()
+        cache = DatumCache(source, os.path.join(self.directory.name, "cache"))
+        try:
+            process(1, SINCE, cache, FakeTable(), self.state)
+            # THE NEW PUSHES ARE FETCHED THROUGH THE CACHE, NOT FROM IT
+            source.add(1, 5)
+            (job,) = fetch_batch([1], SINCE, cache, self.state)
+            _, _, push_times, last_datum_id, work = job
+            self.assertIn("detector", work)
+            self.assertEqual(len(work["values"]), 5)
+            self.assertEqual(len(push_times), 65)
+            self.assertEqual(last_datum_id, 10_064)
+        finally:
+            cache.close()
+
+    def test_broken_pool(self):
+        pool = new_pool(1)
+        try:
+            # A summarize() PROCESS DIES
+            pool.submit(os._exit, 1).exception()
+            with self.assertRaises(Exception):
+                process_all(
+                    [1, 2], SINCE, FakeSource(), FakeTable(), self.state, pool=pool
+                )
+        finally:
+            pool.shutdown()
+        self.assertIsNone(self.state.get(1))
+
+    def test_broken_results(self):
+        # MORE THAN ONE FAILURE, ONLY THE FIRST IS THE cause
+        with self.assertRaises(Exception) as context:
+            process_all(
+                [1, 2], SINCE, FakeSource(), FakeTable(), self.state, pool=BrokenPool()
+            )
+        self.assertIn("A process died", str(context.exception))
+        self.assertIsNone(self.state.get(1))
+        self.assertIsNone(self.state.get(2))
+
+    def test_decisions(self):
+        source = FakeSource()
+        for sig_id in [1, 2, 3]:
+            process(sig_id, SINCE, source, FakeTable(), self.state)
+
+        # NO NEW DATA
+        self.assertEqual(fetch_batch([1, 2, 3], SINCE, source, self.state), [])
+
+        # NEW PUSHES ARE APPENDED
+        source.add(1, 5)
+        # DETECTOR SETTINGS CHANGED
+        source.signatures[2].alert_threshold = 0.2
+        # LATE DATUM FOR A PUSH ALREADY ANALYZED
+        source.add(3, 1, push_time=START + 10 * 1000)
+
+        jobs = {
+            sig.id: (push_times, last_datum_id, work)
+            for sig, _, push_times, last_datum_id, work in fetch_batch(
+                [1, 2, 3], SINCE, source, self.state
+            )
+        }
+        self.assertEqual(sorted(jobs), [1, 2, 3])
+
+        push_times, last_datum_id, work = jobs[1]
+        self.assertIn("detector", work)
+        self.assertEqual(len(work["values"]), 5)
+        self.assertEqual(len(push_times), 65)
+        self.assertEqual(last_datum_id, 10_064)
+
+        push_times, last_datum_id, work = jobs[2]
+        self.assertNotIn("detector", work)
+        self.assertEqual(work["diff_threshold"], 0.2)
+        self.assertEqual(len(work["values"]), 60)
+
+        push_times, last_datum_id, work = jobs[3]
+        self.assertNotIn("detector", work)
+        self.assertEqual(len(push_times), 60)
+        self.assertEqual(last_datum_id, 30_060)
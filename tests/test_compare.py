@@ -0,0 +1,69 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+import numpy
+
+from moz_measure_noise.compare import (
+    TOLERANCE,
+    agreement,
+    alert_segments,
+    compare,
+    to_table,
+    unmatched,
+)
+
+
+class TestCompare(TestCase):
+    def test_unmatched(self):
+        numpy.random.seed(42)
+        for _ in range(100):
+            A = numpy.sort(numpy.random.randint(0, 500, numpy.random.randint(0, 20)))
+            B = numpy.sort(numpy.random.randint(0, 500, numpy.random.randint(0, 20)))
+            expected = [
+                all(not (a - TOLERANCE <= b <= a + TOLERANCE) for b in B) for a in A
+            ]
+            self.assertEqual(unmatched(A, B).tolist(), expected)
+
+    def test_alert_segments(self):
+        pushes = numpy.array([10.0, 20.0, 30.0, 40.0])
+        push_times = numpy.array([40.0, 30.0, 30.0, 20.0, 10.0, 5.0])
+        alert_ids = numpy.array([0, 7, 0, 0, 0, 9])
+        self.assertEqual(alert_segments(pushes, push_times, alert_ids), (0, 2, 4))
+
+    def test_compare(self):
+        numpy.random.seed(42)
+        values = numpy.concatenate(
+            [
+                numpy.random.normal(loc=10, size=60),
+                numpy.random.normal(loc=30, size=40),
+                numpy.random.normal(loc=20, size=60),
+            ]
+        )
+        agree = compare(values, (0, 60, 100, 160))
+        self.assertEqual(agree["num_pushes"], 160)
+        self.assertEqual(agree["num_alert"], 3)
+        self.assertTrue(agree["new_alert_agree"])
+        self.assertTrue(agree["perfalert_alert_agree"])
+        self.assertEqual(agree["new_alert_extra"], 0)
+        self.assertTrue(numpy.isnan(agree["new_alert_max_extra_diff"]))
+
+        missed = compare(values, (0, 60, 160))
+        self.assertFalse(missed["new_alert_agree"])
+        self.assertEqual(missed["new_alert_extra"], 1)
+        self.assertEqual(missed["new_alert_missing"], 0)
+
+        table = to_table([1, 2], [agree, missed])
+        self.assertEqual(table["new_alert_agree"].tolist(), [True, False])
+        summary = agreement(table)
+        self.assertEqual(summary["num_signatures"], 2)
+        self.assertEqual(summary["new_alert_agree_rate"], 0.5)
@@ -0,0 +1,51 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+from moz_measure_noise.compare import agreement
+from moz_measure_noise.compare_etl import compare_signatures, table_rows
+from tests.fakes import SINCE, FakeSource
+
+
+class NoQuerySource(FakeSource):
+    """
+    AN EMPTY LIST OF IDS WOULD BE AN `IN ()` QUERY, WHICH MySQL REJECTS
+    """
+
+    def get_signatures(self, signature_ids):
+        if not signature_ids:
+            raise Exception("You have an error in your SQL syntax")
+        return FakeSource.get_signatures(self, signature_ids)
+
+    def get_dataum_columns(self, signature_ids, since, limit):
+        if not signature_ids:
+            raise Exception("You have an error in your SQL syntax")
+        return FakeSource.get_dataum_columns(self, signature_ids, since, limit)
+
+
+class TestCompareETL(TestCase):
+    def test_compare_signatures(self):
+        table = compare_signatures(NoQuerySource(), [1, 2, 9], SINCE)
+        self.assertEqual(table["id"].tolist(), [1, 2])
+        self.assertEqual(agreement(table)["num_signatures"], 2)
+
+    def test_no_signatures(self):
+        table = compare_signatures(NoQuerySource(), [], SINCE)
+        self.assertEqual(table["id"].tolist(), [])
+        self.assertEqual(agreement(table), {"num_signatures": 0})
+
+    def test_table_rows(self):
+        table = compare_signatures(NoQuerySource(), [1, 2], SINCE)
+        rows = table_rows(table)
+        self.assertEqual([row["id"] for row in rows], [1, 2])
+        self.assertEqual(sorted(rows[0]), sorted(table))
+        self.assertEqual(table_rows(compare_signatures(NoQuerySource(), [], SINCE)), [])
@@ -0,0 +1,153 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from decimal import Decimal
+from unittest import TestCase
+
+from jx_bigquery import bigquery
+from mo_dots import Data
+from mo_threads import Thread, Till
+from mo_times import Date, Duration
+from moz_measure_noise import daemon as daemon_module
+from moz_measure_noise.daemon import Daemon, StaleQueue, priority
+from moz_measure_noise.sources import MySQLSource
+from tests.fakes import FakeDB, FakeSource, FakeState, FakeTable, use_db
+
+DAY = Duration("day").seconds
+
+
+def times_source(times):
+    """
+    :param times: MAP FROM SIGNATURE ID TO ITS last_updated
+    """
+    source = FakeSource(num_pushes=1, sig_ids=list(times))
+    for sig_id, last_updated in times.items():
+        source.signatures[sig_id].last_updated = last_updated
+    return source
+
+
+class BigQueryTable(FakeTable, bigquery.Table):
+    """
+    refresh_latest() IS ONLY FOR BIGQUERY TABLES
+    """
+
+
+class TestDaemon(TestCase):
+    def test_queue(self):
+        queue = StaleQueue("test")
+        queue.add(1, -10)
+        queue.add(2, -30)
+        queue.add(3, -20)
+        # A LATER add() CHANGES THE PRIORITY
+        queue.add(1, -40)
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.pop(2), [1, 2])
+        self.assertEqual(queue.pop(2), [3])
+        self.assertEqual(queue.pop(2, till=Till(seconds=0.1)), [])
+        queue.close()
+        self.assertEqual(queue.pop(2), [])
+
+    def test_priority(self):
+        now = Date.now().unix
+        since = now - 100 * DAY
+        self.assertIsNone(priority(now - DAY, now - DAY, since, now))
+        never = priority(now - DAY, None, since, now)
+        stale = priority(now - DAY, now - 10 * DAY, since, now)
+        fresh = priority(now - DAY, now - 2 * DAY, since, now)
+        idle = priority(now - 30 * DAY, now - 40 * DAY, since, now)
+        self.assertLess(never, stale)
+        self.assertLess(stale, fresh)
+        # SAME STALENESS, BUT NO RECENT DATUMS
+        self.assertLess(stale, idle)
+
+    def test_scan(self):
+        now = Date.now().unix
+        source = times_source(
+            {
+                1: now - DAY,  # UP TO DATE
+                2: now - DAY,  # NEVER ANALYZED
+                3: now - DAY,  # STALE
+                4: now - 400 * DAY,  # TOO OLD
+            }
+        )
+        state = FakeState({1: now - DAY, 3: now - 5 * DAY})
+        daemon = Daemon(source, destination=None, state=state)
+        daemon.scan()
+        self.assertEqual(daemon.queue.pop(10), [2, 3])
+
+        daemon.working = {2}
+        daemon.scan()
+        self.assertEqual(daemon.queue.pop(10), [3])
+
+    def test_scan_decimal(self):
+        # MySQL RETURNS UNIX_TIMESTAMP() OF A datetime(6) AS A Decimal
+        now = Date.now().unix
+        db = FakeDB([(1, Decimal(now - DAY) + Decimal("0.000001")), (2, Decimal(now))])
+        state = FakeState({1: now - 5 * DAY})
+        daemon = Daemon(MySQLSource(None), destination=None, state=state)
+        with use_db(db):
+            daemon.scan()
+        self.assertEqual(daemon.queue.pop(10), [2, 1])
+
+    def run_daemon(self, written):
+        """
+        :param written: THE SIGNATURES THE FAKE process_all() WRITES
+        :return: THE CALLS TO process_all() AND refresh_latest()
+        """
+        calls = []
+
+        def process_all(sig_ids, *args, on_write=None, **kwargs):
+            calls.append(("process_all", sorted(sig_ids), Thread.current().name))
+            Till(seconds=0.3).wait()
+            for sig_id in sig_ids:
+                if sig_id in written:
+                    on_write(Data(id=sig_id))
+
+        def refresh_latest(table):
+            calls.append(("refresh_latest", [], Thread.current().name))
+
+        old = daemon_module.process_all, daemon_module.refresh_latest
+        daemon_module.process_all, daemon_module.refresh_latest = (
+            process_all,
+            refresh_latest,
+        )
+        try:
+            now = Date.now().unix
+            daemon = Daemon(
+                times_source({1: now - DAY, 2: now - DAY}),
+                destination=BigQueryTable(),
+                state=FakeState({}),
+                rescan="hour",
+                throttle=0,
+                latest_refresh=Duration(0.1),
+            ).start()
+            Till(seconds=1).wait()
+            daemon.stop()
+        finally:
+            daemon_module.process_all, daemon_module.refresh_latest = old
+        return calls
+
+    def test_refresh_latest(self):
+        calls = self.run_daemon(written=[2])
+        # BETWEEN BATCHES, ON THE SAME THREAD, AND ONLY AFTER SOMETHING WAS WRITTEN
+        refresher = "refresh stale signatures"
+        self.assertEqual(
+            calls,
+            [
+                ("process_all", [1, 2], refresher),
+                ("refresh_latest", [], refresher),
+            ],
+        )
+
+    def test_nothing_written(self):
+        # SIGNATURES THAT WERE SKIPPED, OR FAILED, DO NOT REBUILD THE LATEST TABLE
+        calls = self.run_daemon(written=[])
+        self.assertEqual(calls, [("process_all", [1, 2], "refresh stale signatures")])
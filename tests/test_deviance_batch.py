@@ -0,0 +1,66 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+import numpy
+
+from moz_measure_noise import deviance, deviance_batch
+
+
+def some_series():
+    numpy.random.seed(42)
+    return [
+        numpy.random.normal(size=20),
+        numpy.random.lognormal(size=50),
+        numpy.random.exponential(size=100) + 1,
+        numpy.concatenate(
+            [numpy.random.normal(size=30), 10 + numpy.random.normal(size=30)]
+        ),
+        numpy.random.standard_t(2, size=200),
+        numpy.ones(10),
+        numpy.random.normal(size=5),
+        numpy.random.normal(size=6),
+        numpy.array([]),
+    ]
+
+
+class TestDevianceBatch(TestCase):
+    def assertSameAsDeviance(self, series, result):
+        descriptions, scores = result
+        self.assertEqual(len(descriptions), len(series))
+        for s, desc, score in zip(series, descriptions, scores):
+            expected_desc, expected_score = deviance(s)
+            self.assertEqual(desc, expected_desc)
+            if numpy.isnan(expected_score):
+                self.assertTrue(numpy.isnan(score))
+            else:
+                self.assertAlmostEqual(score, expected_score, places=8)
+
+    def test_ragged(self):
+        series = some_series()
+        offsets = numpy.cumsum([0] + [len(s) for s in series])
+        self.assertSameAsDeviance(
+            series, deviance_batch(numpy.concatenate(series), offsets)
+        )
+
+    def test_padded(self):
+        series = some_series()
+        padded = numpy.full((len(series), max(len(s) for s in series)), numpy.nan)
+        for i, s in enumerate(series):
+            padded[i, : len(s)] = s
+        self.assertSameAsDeviance(series, deviance_batch(padded))
+
+    def test_many_normal(self):
+        numpy.random.seed(42)
+        padded = numpy.random.normal(size=(1000, 20))
+        descriptions, _ = deviance_batch(padded)
+        self.assertLessEqual(990, sum(descriptions == "OK"))
@@ -0,0 +1,75 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+from moz_measure_noise import extract_perf
+from moz_measure_noise.extract_perf import columns_sql, read_columns
+from tests.fakes import FakeCursor, FakeDB, use_db
+
+# (signature_id, push_time, value, alert_id, datum_id), SORTED AS columns_sql() DOES
+ROWS = [
+    (1, 300, 3.0, 0, 13),
+    (1, 200, 2.0, 7, 12),
+    (1, 100, 1.0, 0, 11),
+    (2, 250, 5.0, 0, 22),
+    (4, 150, 6.0, 0, 41),
+]
+
+
+class TestExtractPerf(TestCase):
+    def test_read_columns(self):
+        result = dict(read_columns(ROWS))
+        self.assertEqual(sorted(result), [1, 2, 4])
+        push_times, values, alert_ids, datum_ids = result[1]
+        self.assertEqual(push_times.tolist(), [300, 200, 100])
+        self.assertEqual(values.tolist(), [3.0, 2.0, 1.0])
+        self.assertEqual(alert_ids.tolist(), [0, 7, 0])
+        self.assertEqual(datum_ids.tolist(), [13, 12, 11])
+        self.assertEqual(result[4][3].tolist(), [41])
+        self.assertEqual(list(read_columns([])), [])
+
+    def test_read_chunks(self):
+        cursor = FakeCursor(ROWS)
+        result = dict(read_columns(cursor, chunk_size=2))
+        self.assertEqual(cursor.sizes, [2, 2, 2, 2])
+        expected = dict(read_columns(ROWS))
+        self.assertEqual(sorted(result), sorted(expected))
+        for sig_id, columns in expected.items():
+            for column, expect in zip(result[sig_id], columns):
+                self.assertEqual(column.dtype, expect.dtype)
+                self.assertEqual(column.tolist(), expect.tolist())
+
+    def test_limit_in_query(self):
+        sql = columns_sql([1, 2], 0, limit=11)
+        self.assertIn("PARTITION BY d.signature_id", sql)
+        self.assertIn("_rank <= 11", sql)
+        self.assertNotIn("_rank", columns_sql([1, 2], 0))
+
+    def test_split_by_signature(self):
+        db = FakeDB(ROWS)
+        with use_db(db):
+            result = extract_perf.get_dataum_columns(None, [1, 2, 3, 4], 0, 10)
+
+        self.assertEqual(len(db.sql), 1)
+        self.assertIn("_rank <= 11", db.sql[0])
+        self.assertEqual(sorted(result), [1, 2, 4])
+        self.assertEqual(result[2][0].tolist(), [250])
+        self.assertEqual(result[1][1].tolist(), [3.0, 2.0, 1.0])
+
+    def test_no_signatures(self):
+        db = FakeDB(ROWS)
+        with use_db(db):
+            self.assertEqual(extract_perf.get_signatures(None, []), {})
+            self.assertEqual(extract_perf.get_dataum_columns(None, [], 0, 10), {})
+            self.assertEqual(extract_perf.get_dataum_delta(None, {}, 0), {})
+        # AN EMPTY `IN ()` IS A SYNTAX ERROR
+        self.assertEqual(db.sql, [])
@@ -0,0 +1,58 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import tempfile
+from unittest import TestCase
+
+from moz_measure_noise.latest import LatestMirror, local_query
+
+DOCS = [
+    {"id": "1", "framework": "talos", "overall_dev_score": 3.0, "num_pushes": 40},
+    {"id": "2", "framework": "talos", "overall_dev_score": -5.0, "num_pushes": 10},
+    {"id": "3", "framework": "raptor", "overall_dev_score": 9.0, "num_pushes": 50},
+    {"id": "4", "framework": "talos", "num_pushes": 60},
+]
+
+
+class TestLatest(TestCase):
+    def test_mirror(self):
+        with tempfile.TemporaryDirectory() as directory:
+            mirror = LatestMirror(os.path.join(directory, "latest.sqlite"))
+            try:
+                mirror.extend(DOCS, replace=True)
+                # A NEWER ROW REPLACES THE OLD ONE
+                mirror.extend([{"id": "1", "framework": "talos", "overall_dev_score": 4.0}])
+                self.assertEqual(len(mirror), 4)
+
+                result = mirror.jx_query(
+                    {
+                        "where": {"eq": {"framework": "talos"}},
+                        "sort": {"value": {"abs": "overall_dev_score"}, "sort": "desc"},
+                        "limit": 10,
+                    }
+                ).data
+                self.assertEqual([d["id"] for d in result], ["2", "1", "4"])
+
+                result = mirror.jx_query({"sort": "num_pushes", "limit": 2}).data
+                self.assertEqual([d["id"] for d in result], ["2", "3"])
+            finally:
+                mirror.close()
+
+    def test_local_query(self):
+        result = local_query(
+            DOCS,
+            {
+                "where": {"gte": {"num_pushes": 30}},
+                "sort": [{"value": "framework", "sort": "desc"}, "num_pushes"],
+            },
+        )
+        self.assertEqual([d["id"] for d in result], ["1", "4", "3"])
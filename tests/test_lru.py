@@ -0,0 +1,43 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+from moz_measure_noise.lru import LRU
+
+
+class TestLRU(TestCase):
+    def test_forget_least_recent(self):
+        cache = LRU(max_size=10, sizeof=len)
+        cache.set((1, "a"), "1234")
+        cache.set((2, "a"), "1234")
+        self.assertEqual(cache.get((1, "a")), "1234")
+        # (2, "a") IS NOW THE LEAST RECENTLY USED
+        cache.set((3, "a"), "1234")
+        self.assertNotIn((2, "a"), cache)
+        self.assertIn((1, "a"), cache)
+        self.assertEqual(cache.size, 8)
+
+        # TOO BIG TO KEEP
+        cache.set((4, "a"), "12345678901")
+        self.assertNotIn((4, "a"), cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_remove(self):
+        cache = LRU(max_size=10)
+        for i in range(5):
+            cache.set((i % 2, i), i)
+        cache.remove(lambda key: key[0] == 1)
+        self.assertEqual(sorted(cache.data), [(0, 0), (0, 2), (0, 4)])
+        self.assertEqual(cache.size, 3)
+        cache.remove()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
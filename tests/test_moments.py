@@ -0,0 +1,87 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import json
+from unittest import TestCase
+
+import numpy
+from scipy.stats import kurtosis, skew
+
+from moz_measure_noise import DevianceMoments, Moments, describe, deviance, moments
+
+
+class TestMoments(TestCase):
+    def test_same_as_scipy(self):
+        numpy.random.seed(42)
+        samples = numpy.random.lognormal(size=1000)
+        count, mean, std, skew_, kurt = moments(samples)
+        self.assertEqual(count, 1000)
+        self.assertAlmostEqual(mean, numpy.mean(samples))
+        self.assertAlmostEqual(std, numpy.std(samples))
+        self.assertAlmostEqual(skew_, skew(samples))
+        self.assertAlmostEqual(kurt, kurtosis(samples))
+
+    def test_merge(self):
+        numpy.random.seed(42)
+        samples = numpy.random.standard_t(3, size=1000)
+        merged = Moments()
+        for chunk in numpy.split(samples, [0, 10, 11, 500, 999]):
+            merged = merged + Moments(chunk)
+        whole = Moments(samples)
+        self.assertEqual(merged.count, whole.count)
+        self.assertAlmostEqual(merged.mean, whole.mean)
+        self.assertAlmostEqual(merged.std, whole.std)
+        self.assertAlmostEqual(merged.skew, whole.skew)
+        self.assertAlmostEqual(merged.kurtosis, whole.kurtosis)
+
+    def test_empty(self):
+        for empty in [Moments(), Moments() + Moments([])]:
+            self.assertEqual(empty.count, 0)
+            self.assertTrue(numpy.isnan(empty.skew))
+            self.assertTrue(numpy.isnan(empty.kurtosis))
+
+    def test_deviance_same_as_sorted(self):
+        numpy.random.seed(42)
+        for samples in [
+            numpy.random.normal(size=20),
+            numpy.random.lognormal(size=200),
+            numpy.random.standard_t(2, size=200),
+            numpy.round(numpy.random.normal(size=100)),
+        ]:
+            desc, score = deviance(samples)
+            trimmed = sorted(samples)[1:-1]
+            if all(v > 0 for v in samples):
+                trimmed = numpy.log(trimmed)
+            expected_desc, expected_score = describe(
+                len(trimmed), skew(trimmed), kurtosis(trimmed)
+            )
+            self.assertEqual(desc, expected_desc)
+            self.assertAlmostEqual(score, expected_score)
+
+    def test_deviance_over_chunks(self):
+        numpy.random.seed(42)
+        for samples in [
+            numpy.random.normal(size=20),
+            numpy.random.lognormal(size=200),
+            numpy.ones(10),
+        ]:
+            merged = DevianceMoments()
+            for chunk in numpy.split(samples, [0, 3, 4, 15]):
+                # STATE CAN BE SENT BETWEEN WORKERS
+                state = json.loads(json.dumps(DevianceMoments(chunk).__data__()))
+                merged = merged + DevianceMoments.new_instance(state)
+            desc, score = deviance(samples)
+            merged_desc, merged_score = merged.deviance()
+            self.assertEqual(desc, merged_desc)
+            if numpy.isnan(score):
+                self.assertTrue(numpy.isnan(merged_score))
+            else:
+                self.assertAlmostEqual(score, merged_score)
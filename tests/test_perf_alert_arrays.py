@@ -0,0 +1,66 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+import numpy
+
+from perfalert import RevisionDatum, detect_changes, detect_changes_arrays
+
+
+class TestPerfAlertArrays(TestCase):
+    def assertSameAsDetectChanges(self, push_indexes, values):
+        revisions = {}
+        for p, v in zip(push_indexes, values):
+            revisions.setdefault(p, []).append(v)
+        expected = detect_changes(
+            [RevisionDatum(p, p, v) for p, v in revisions.items()]
+        )
+
+        t, change_detected, amount_prev_data, amount_next_data = detect_changes_arrays(
+            push_indexes, values
+        )
+        self.assertTrue(numpy.allclose(t, [d.t for d in expected]))
+        self.assertEqual(
+            change_detected.tolist(), [d.change_detected for d in expected]
+        )
+        self.assertEqual(
+            amount_prev_data[1:].tolist(), [d.amount_prev_data for d in expected[1:]]
+        )
+        self.assertEqual(
+            amount_next_data[1:].tolist(), [d.amount_next_data for d in expected[1:]]
+        )
+
+    def test_one_value_per_push(self):
+        numpy.random.seed(42)
+        values = numpy.concatenate(
+            [
+                numpy.random.normal(loc=10, size=60),
+                numpy.random.normal(loc=30, size=40),
+                numpy.random.normal(loc=20, size=60),
+            ]
+        )
+        self.assertSameAsDetectChanges(list(range(len(values))), values)
+        _, change_detected, _, _ = detect_changes_arrays(range(len(values)), values)
+        self.assertEqual(numpy.flatnonzero(change_detected).tolist(), [60, 100])
+
+    def test_many_values_per_push(self):
+        numpy.random.seed(42)
+        push_indexes = numpy.random.randint(0, 150, size=400)
+        values = numpy.where(push_indexes < 70, 100, 110) + numpy.random.normal(
+            size=400
+        )
+        self.assertSameAsDetectChanges(push_indexes.tolist(), values.tolist())
+
+    def test_empty(self):
+        t, change_detected, _, _ = detect_changes_arrays([], [])
+        self.assertEqual(len(t), 0)
+        self.assertEqual(len(change_detected), 0)
@@ -0,0 +1,70 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from statistics import median
+from unittest import TestCase
+
+import numpy
+
+from moz_measure_noise.pushes import aggregate_pushes, merge_datums
+
+
+class TestPushes(TestCase):
+    def test_matches_groupby_median(self):
+        numpy.random.seed(42)
+        push_times = numpy.random.randint(0, 50, 1000)
+        values = numpy.random.normal(size=1000)
+
+        pushes, medians, counts = aggregate_pushes(push_times, values, since=10)
+
+        expected = {}
+        for t, v in zip(push_times, values):
+            if t > 10:
+                expected.setdefault(t, []).append(v)
+        self.assertEqual(pushes.tolist(), sorted(expected))
+        self.assertEqual(counts.tolist(), [len(expected[t]) for t in sorted(expected)])
+        self.assertTrue(
+            numpy.allclose(medians, [median(expected[t]) for t in sorted(expected)])
+        )
+
+    def test_even_and_odd_runs(self):
+        pushes, medians, counts = aggregate_pushes(
+            [2, 1, 2, 1, 1, 3, 3, 3, 3], [5, 9, 1, 3, 6, 4, 1, 3, 2]
+        )
+        self.assertEqual(pushes.tolist(), [1, 2, 3])
+        self.assertEqual(medians.tolist(), [6, 3, 2.5])
+        self.assertEqual(counts.tolist(), [3, 2, 4])
+
+    def test_empty(self):
+        pushes, medians, counts = aggregate_pushes([], [])
+        self.assertEqual(len(pushes), 0)
+        self.assertEqual(len(medians), 0)
+        self.assertEqual(len(counts), 0)
+
+    def test_merge_datums(self):
+        old = (
+            numpy.array([30.0, 20.0, 20.0, 10.0]),
+            numpy.array([3.0, 2.0, 2.5, 1.0]),
+            numpy.array([0, 0, 0, 0]),
+            numpy.array([3, 2, 4, 1]),
+        )
+        # A NEW PUSH, A LATE DATUM FOR AN OLD PUSH, AND A CHANGED ALERT
+        new = (
+            numpy.array([40.0, 20.0, 30.0]),
+            numpy.array([4.0, 2.2, 3.0]),
+            numpy.array([0, 0, 8]),
+            numpy.array([6, 5, 3]),
+        )
+        push_times, values, alert_ids, datum_ids = merge_datums(old, new)
+        self.assertEqual(push_times.tolist(), [40, 30, 20, 20, 20, 10])
+        self.assertEqual(datum_ids.tolist(), [6, 3, 2, 4, 5, 1])
+        self.assertEqual(values.tolist(), [4, 3, 2, 2.5, 2.2, 1])
+        self.assertEqual(alert_ids.tolist(), [0, 8, 0, 0, 0, 0])
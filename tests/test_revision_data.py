@@ -0,0 +1,91 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+import numpy
+
+from perfalert import RevisionData, RevisionDatum, detect_changes
+
+
+def random_datums():
+    # SHUFFLED PUSHES, WITH ONE TO THREE VALUES EACH, AND A STEP EVERY 50 PUSHES
+    numpy.random.seed(42)
+    return [
+        RevisionDatum(
+            p, p + 1000, list(numpy.random.normal(loc=10 * (p // 50), size=p % 3 + 1))
+        )
+        for p in numpy.random.permutation(150).tolist()
+    ]
+
+
+class TestRevisionData(TestCase):
+    def test_same_as_detect_changes(self):
+        datums = random_datums()
+        expected = detect_changes(datums)
+        result = RevisionData.from_datums(datums).detect_changes()
+
+        self.assertEqual(len(result), len(expected))
+        for r, e in zip(result, expected):
+            self.assertEqual(r, e)
+            self.assertEqual(r.push_id, e.push_id)
+            self.assertEqual(r.values.tolist(), e.values)
+            self.assertAlmostEqual(r.t, e.t)
+            self.assertEqual(r.change_detected, e.change_detected)
+        # detect_changes() SETS NO AMOUNTS ON THE FIRST REVISION
+        for r, e in list(zip(result, expected))[1:]:
+            self.assertEqual(r.amount_prev_data, e.amount_prev_data)
+            self.assertEqual(r.amount_next_data, e.amount_next_data)
+        self.assertTrue(any(r.change_detected for r in result))
+
+    def test_sorted_by_push_timestamp(self):
+        data = RevisionData([30, 10, 20], [3, 1, 2], [3, 3, 1, 2, 2], [0, 2, 3, 5])
+        self.assertEqual(data.push_timestamp.tolist(), [10, 20, 30])
+        self.assertEqual(data.push_id.tolist(), [1, 2, 3])
+        self.assertEqual(data.offsets.tolist(), [0, 1, 3, 5])
+        self.assertEqual([v.values.tolist() for v in data], [[1], [2, 2], [3, 3]])
+
+    def test_view(self):
+        data = RevisionData.from_datums(random_datums())
+        self.assertEqual(data[-1].push_timestamp, 149)
+        self.assertEqual(data[-1].push_id, 1149)
+        self.assertLess(data[0], data[1])
+        self.assertEqual(data[2], RevisionDatum(2, 0, [0]))
+        self.assertEqual(
+            repr(data[1]), repr(RevisionDatum(1, 1001, data[1].values.tolist()))
+        )
+        self.assertFalse(hasattr(data[0], "__dict__"))
+        with self.assertRaises(IndexError):
+            data[len(data)]
+        with self.assertRaises(IndexError):
+            data[-len(data) - 1]
+
+    def test_empty(self):
+        data = RevisionData([], [], [], [0]).detect_changes()
+        self.assertEqual(len(data), 0)
+        self.assertEqual(list(data), [])
+
+    def test_empty_revision(self):
+        datums = sorted(random_datums())
+        with_values = RevisionData.from_datums(datums).detect_changes()
+        # THE SAME REVISIONS, WITH AN EMPTY ONE BETWEEN EACH, AND AT THE END
+        empty = [RevisionDatum(d.push_timestamp + 0.5, -1, []) for d in datums]
+        result = RevisionData.from_datums(datums + empty).detect_changes()
+
+        self.assertEqual(len(result), 2 * len(datums))
+        self.assertEqual(result.t[1::2].tolist(), [0] * len(datums))
+        self.assertFalse(result.change_detected[1::2].any())
+        self.assertEqual(result.t[::2].tolist(), with_values.t.tolist())
+        self.assertEqual(
+            result.change_detected[::2].tolist(), with_values.change_detected.tolist()
+        )
+        self.assertEqual(result[-1].push_id, -1)
+        self.assertFalse(result[-1].change_detected)
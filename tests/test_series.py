@@ -0,0 +1,49 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+import numpy
+
+from mo_dots import Data
+from moz_measure_noise.analysis_etl import series_writer, write
+from moz_measure_noise.series import pack_values, unpack_values
+from moz_measure_noise.summary import summarize
+from moz_measure_noise.writer import BufferedWriter
+from tests.fakes import FakeState, FakeTable
+
+
+class TestSeries(TestCase):
+    def test_pack(self):
+        values = numpy.random.normal(100, 5, 1000)
+        packed = pack_values(values)
+        self.assertIsInstance(packed, str)
+        self.assertLess(len(packed), len(values) * 6)
+        self.assertTrue(numpy.allclose(unpack_values(packed), values, rtol=1e-6))
+        self.assertEqual(len(unpack_values(pack_values([]))), 0)
+
+    def test_summary_refers_to_series(self):
+        numpy.random.seed(42)
+        result = summarize(numpy.random.normal(100, 5, 200), 0, 2)
+        sig = Data(id=7, last_updated=123, framework="talos")
+        summaries, series, state = FakeTable(), FakeTable(), FakeState()
+        with BufferedWriter(summaries) as writer, series_writer(series) as values:
+            write(sig, "title", list(range(200)), 9, result, writer, state, values)
+
+        (summary,) = summaries.rows
+        (row,) = series.rows
+        self.assertNotIn("values", summary)
+        self.assertEqual(summary["series_version"], row.version)
+        self.assertEqual(row.id, 7)
+        self.assertTrue(
+            numpy.allclose(unpack_values(row["values"]), result["values"], rtol=1e-6)
+        )
+        self.assertEqual(state.states[7].last_datum_id, 9)
@@ -0,0 +1,120 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+import tempfile
+from unittest import TestCase
+
+from mo_dots import Data
+from moz_measure_noise.sources import (
+    DatumCache,
+    LocalSource,
+    data_source,
+    snapshot,
+)
+from tests.fakes import START, FakeSource
+
+
+def some_source():
+    # 100 PUSHES, AND NO SIGNATURE 3
+    return FakeSource(num_pushes=100, sig_ids=(1, 2, 4, 5))
+
+
+class TestSources(TestCase):
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot(some_source(), [5, 1, 3, 2], 0, directory, limit=1000)
+            source = data_source(Data(local=directory))
+            self.assertIsInstance(source, LocalSource)
+
+            self.assertEqual(sorted(source.get_signatures([1, 2, 3, 9])), [1, 2])
+            self.assertEqual(source.get_signature(5).framework, "talos")
+
+            expected = some_source().get_dataum_columns([2], 0, 10)[2]
+            datums = source.get_dataum_columns([2, 3], START + 50_000, limit=10)
+            self.assertEqual(list(datums), [2])
+            for column, expect in zip(datums[2], expected):
+                self.assertEqual(column.tolist(), expect.tolist())
+
+            datums = source.get_dataum_columns([5], START + 94_500, limit=1000)
+            self.assertEqual(
+                datums[5][0].tolist(), [START + p * 1000 for p in [99, 98, 97, 96, 95]]
+            )
+
+            delta = source.get_dataum_delta({2: 20_096, 3: 0}, 0)
+            self.assertEqual(list(delta), [2])
+            self.assertEqual(delta[2][3].tolist(), [20_099, 20_098, 20_097])
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = some_source()
+            cache = DatumCache(source, directory, ttl="hour")
+            try:
+                first = cache.get_dataum_columns([1, 2], 0, limit=1000)
+                self.assertEqual(len(first[1][0]), 100)
+                self.assertEqual(source.requests, [([1, 2], 0)])
+
+                # WITHIN THE ttl, NO NEW REQUESTS
+                recent = cache.get_dataum_columns([1, 2], START + 49_500, limit=1000)
+                self.assertEqual(len(source.requests), 1)
+                self.assertEqual(recent[2][0].tolist(), first[2][0][:50].tolist())
+
+                # AFTER THE ttl, ONLY THE NEW DATUMS ARE REQUESTED
+                cache.ttl = -1
+                source.add(1, 20)
+                source.add(2, 20)
+                latest = cache.get_dataum_columns([1, 2], 0, limit=1000)
+                self.assertEqual(source.requests[-1], ({1: 10_099, 2: 20_099}, 0))
+                expected = source.get_dataum_columns([2], 0, 1000)[2]
+                for column, expect in zip(latest[2], expected):
+                    self.assertEqual(column.tolist(), expect.tolist())
+
+                # EVICT THE LEAST RECENTLY USED
+                cache.max_size = 120 * 32
+                cache.get_dataum_columns([4], 0, limit=1000)
+                self.assertEqual(
+                    cache.db.query("SELECT id FROM datum_cache").data, [(4,)]
+                )
+            finally:
+                cache.close()
+
+    def test_cache_missing_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = some_source()
+            cache = DatumCache(source, directory, ttl="hour")
+            try:
+                cache.get_dataum_columns([1], 0, limit=1000)
+                # INDEXED, BUT ITS FILE IS GONE, SO FETCHED AGAIN
+                os.remove(cache._filename(1))
+                datums = cache.get_dataum_columns([1], 0, limit=1000)
+                self.assertEqual(source.requests, [([1], 0), ([1], 0)])
+                self.assertEqual(len(datums[1][0]), 100)
+            finally:
+                cache.close()
+
+    def test_cache_truncated_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = some_source()
+            cache = DatumCache(source, directory, ttl="hour")
+            try:
+                cache.get_dataum_columns([1], 0, limit=1000)
+                # LEFT HALF WRITTEN BY A CRASH
+                filename = cache._filename(1)
+                with open(filename, "r+b") as f:
+                    f.truncate(os.path.getsize(filename) // 2)
+                datums = cache.get_dataum_columns([1], 0, limit=1000)
+                self.assertEqual(source.requests, [([1], 0), ([1], 0)])
+                self.assertEqual(len(datums[1][0]), 100)
+                # THE NEW FILE IS GOOD
+                cache.get_dataum_columns([1], 0, limit=1000)
+                self.assertEqual(len(source.requests), 2)
+            finally:
+                cache.close()
@@ -0,0 +1,119 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+import json
+from unittest import TestCase
+
+import numpy
+from scipy.stats import rankdata
+
+from moz_measure_noise.step_detector import (
+    JITTER,
+    StepDetector,
+    SlidingMWU,
+    find_segments,
+    jitter_MWU,
+    jitter_MWU_scipy,
+    no_good_edge,
+    rank_rows,
+    sliding_MWU,
+    sliding_MWU_scipy,
+)
+
+SEED = 42  # SO ANY FAILURE CAN BE REPRODUCED
+
+
+class TestStepDetector(TestCase):
+    def test_rank_rows(self):
+        rng = numpy.random.default_rng(SEED)
+        data = numpy.round(rng.normal(size=(20, 30)))
+        ranks, tie_term = rank_rows(data)
+        for row, rank, tie in zip(data, ranks, tie_term):
+            self.assertTrue(numpy.array_equal(rank, rankdata(row)))
+            _, t = numpy.unique(row, return_counts=True)
+            self.assertEqual(tie, (t ** 3 - t).sum())
+
+    def test_sliding_MWU_matches_scipy(self):
+        rng = numpy.random.default_rng(SEED)
+        data = numpy.concatenate(
+            [
+                rng.normal(loc=10, size=200),
+                rng.normal(loc=12, size=150),
+                numpy.round(rng.normal(loc=10, size=150)),  # TIES
+            ]
+        )
+        expected = sliding_MWU_scipy(data)
+        result = sliding_MWU(data)
+        self.assertEqual(result.shape, (len(data), 2))
+        self.assertTrue(numpy.allclose(result, expected, rtol=1e-9, atol=0))
+
+    def test_sliding_MWU_identical(self):
+        result = sliding_MWU([3.0] * 40)
+        self.assertTrue(numpy.all(result[:, 1] == 1))
+
+    def test_sliding_MWU_extend(self):
+        rng = numpy.random.default_rng(SEED)
+        data = numpy.concatenate(
+            [
+                rng.normal(loc=10, size=150),
+                numpy.round(rng.normal(loc=12, size=150)),
+            ]
+        )
+        mwu = SlidingMWU()
+        end = 0
+        for size in [1, 5, 40, 13, 1, 100, 140]:
+            mwu.extend(data[end : end + size])
+            end += size
+            self.assertTrue(numpy.array_equal(mwu.scores(), sliding_MWU(data[:end])))
+
+    def test_jitter_MWU_matches_scipy(self):
+        rng = numpy.random.default_rng(SEED)
+        data = numpy.concatenate(
+            [
+                rng.normal(loc=10, size=120),
+                numpy.round(rng.normal(loc=12, size=80)),  # TIES
+            ]
+        )
+        edges = [(0, 110, 200), (0, 30, 200), (20, 190, 200), (0, 5, 60)]
+        for start, mid, end in edges:
+            m_score, t_score, best = jitter_MWU(data, start, mid, end)
+            e_m_score, e_t_score, e_best = jitter_MWU_scipy(data, start, mid, end)
+            self.assertEqual(best, e_best)
+            self.assertAlmostEqual(m_score.pvalue, e_m_score.pvalue, delta=1e-9)
+            self.assertAlmostEqual(t_score.pvalue, e_t_score.pvalue, delta=1e-9)
+
+    def test_jitter_MWU_constant(self):
+        data = numpy.full(100, 7.0)
+        m_score, t_score, best = jitter_MWU(data, 0, 50, 100)
+        self.assertEqual(m_score.pvalue, no_good_edge.pvalue)
+        self.assertEqual(t_score.pvalue, no_good_edge.pvalue)
+        self.assertEqual(best, 50 - JITTER)
+
+    def test_step_detector_append(self):
+        rng = numpy.random.default_rng(SEED)
+        data = numpy.concatenate(
+            [
+                rng.normal(loc=100, scale=5, size=300),
+                rng.normal(loc=130, scale=5, size=200),
+                rng.normal(loc=100, scale=5, size=100),
+            ]
+        )
+        detector = StepDetector()
+        end = 0
+        for size in [250, 100, 3, 1, 150, 96]:
+            detector.append(data[end : end + size])
+            end += size
+            expected = find_segments(data[:end], None, None)
+            self.assertEqual(detector.segments(), expected)
+
+            # STATE SURVIVES JSON
+            state = json.loads(json.dumps(detector.__data__()))
+            detector = StepDetector.new_instance(state)
@@ -0,0 +1,59 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+import numpy
+
+from moz_measure_noise import deviance
+from moz_measure_noise.summary import normalize_segments, summarize
+
+
+class TestSummary(TestCase):
+    def test_normalize_segments(self):
+        numpy.random.seed(42)
+        values = numpy.concatenate(
+            [
+                numpy.random.normal(10, 1, size=40),
+                numpy.random.normal(20, 3, size=2),
+                numpy.random.normal(5, 0.5, size=100),
+            ]
+        )
+        segments = (0, 40, 42, 142)
+
+        expected = []
+        for s, e in zip(segments[:-1], segments[1:]):
+            data = values[s:e]
+            expected.extend((data + 7 - numpy.mean(data)) * 2 / numpy.std(data))
+
+        result = normalize_segments(values, segments, 7, 2)
+        self.assertTrue(numpy.allclose(result, expected))
+        for s, e in zip(segments[:-1], segments[1:]):
+            self.assertAlmostEqual(numpy.std(result[s:e]), 2)
+
+    def test_summarize_deviance(self):
+        numpy.random.seed(42)
+        values = numpy.concatenate(
+            [numpy.random.normal(10, 1, size=100), numpy.random.lognormal(3, 0.5, 80)]
+        )
+        result = summarize(values)
+        summary = result["summary"]
+        s, e = result["segments"][-2:]
+        last = numpy.array(result["values"][s:e])
+        status, score = deviance(last)
+        self.assertEqual(summary["last_dev_status"], status)
+        self.assertAlmostEqual(summary["last_dev_score"], score)
+        normalized = normalize_segments(
+            result["values"], result["segments"], numpy.mean(last), numpy.std(last)
+        )
+        status, score = deviance(normalized)
+        self.assertEqual(summary["overall_dev_status"], status)
+        self.assertAlmostEqual(summary["overall_dev_score"], score)
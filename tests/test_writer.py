@@ -0,0 +1,93 @@
+# encoding: utf-8
+#
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Contact: Perftest Team (perftest@mozilla.com)
+#
+from __future__ import absolute_import, division, unicode_literals
+
+from unittest import TestCase
+
+from mo_dots import Data
+from moz_measure_noise.writer import BufferedWriter, batches
+from tests.fakes import FakeTable
+
+
+class TestWriter(TestCase):
+    def test_batches(self):
+        rows = [(size, i, None) for i, size in enumerate([4, 4, 4, 9, 1, 1, 1, 1])]
+        result = [[row for row, _ in b] for b in batches(rows, 3, 10)]
+        self.assertEqual(result, [[0, 1], [2], [3, 4], [5, 6, 7]])
+
+    def test_batched_writes(self):
+        table = FakeTable()
+        written = []
+        with BufferedWriter(table, batch_rows=4, flush_interval=60) as writer:
+            for i in range(10):
+                writer.add(Data(id=i), on_write=lambda i=i: written.append(i))
+        self.assertEqual(sum(table.requests, []), list(range(10)))
+        self.assertTrue(all(len(r) <= 4 for r in table.requests))
+        self.assertLess(len(table.requests), 10)
+        self.assertEqual(sorted(written), list(range(10)))
+
+    def test_retry_and_split(self):
+        table = FakeTable(bad=5, failures=1)
+        written = []
+        writer = BufferedWriter(table, flush_interval=60, retries=1, retry_wait=0)
+        try:
+            for i in range(8):
+                writer.add(Data(id=i), on_write=lambda i=i: written.append(i))
+            writer.flush()
+        finally:
+            writer.close()
+        # ONLY THE BAD ROW IS LOST
+        self.assertEqual(sorted(written), [0, 1, 2, 3, 4, 6, 7])
+        self.assertEqual(table.requests[:2], [list(range(8))] * 2)
+        self.assertIn([5], table.requests)
+
+    def test_persistent_failure(self):
+        table = FakeTable(failures=100)
+        written = []
+        writer = BufferedWriter(table, flush_interval=60, retries=2, retry_wait=0)
+        try:
+            for i in range(8):
+                writer.add(Data(id=i), on_write=lambda i=i: written.append(i))
+            with self.assertRaises(Exception):
+                writer.flush()
+            # RETRIED, NOT SPLIT, AND NOTHING IS MARKED AS WRITTEN
+            self.assertEqual(table.requests, [list(range(8))] * 3)
+            self.assertEqual(written, [])
+            table.failures = 0
+        finally:
+            writer.close()
+        # STILL BUFFERED, SO close() WRITES THEM
+        self.assertEqual(table.requests[3:], [list(range(8))])
+        self.assertEqual(sorted(written), list(range(8)))
+
+    def test_first_batch_fails(self):
+        table = FakeTable(failures=1)
+        written = []
+        writer = BufferedWriter(table, batch_rows=4, flush_interval=60, retries=0)
+        try:
+            for i in range(8):
+                writer.add(Data(id=i), on_write=lambda i=i: written.append(i))
+            with self.assertRaises(Exception):
+                writer.flush()
+            # THE LATER BATCH IS NOT DROPPED
+            self.assertEqual(len(writer.rows), 8)
+            writer.flush()
+        finally:
+            writer.close()
+        self.assertEqual(table.requests, [[0, 1, 2, 3], [0, 1, 2, 3], [4, 5, 6, 7]])
+        self.assertEqual(sorted(written), list(range(8)))
+
+    def test_close_raises(self):
+        table = FakeTable(failures=100)
+        writer = BufferedWriter(table, flush_interval=60, retries=0, retry_wait=0)
+        writer.add(Data(id=0))
+        with self.assertRaises(Exception):
+            writer.close()
+        self.assertEqual(table.requests, [[0]])